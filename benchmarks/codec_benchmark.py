@@ -0,0 +1,92 @@
+"""
+Micro-benchmark of the decode cost per message for the payload shapes of the chains:
+
+    python benchmarks/codec_benchmark.py --iterations 20000
+
+- legacy:        previous custom_json_loads, probing every field for datetime and Decimal
+- stdlib:        json.loads without conversions
+- codec:         helpers.codec.loads (orjson if installed)
+- codec_typed:   helpers.codec.TypedDecoder with the schema of the payload shape
+"""
+import argparse
+import json
+import os
+import sys
+import timeit
+from datetime import datetime
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from helpers import codec  # noqa: E402
+
+# Nachrichten wie sie von den MQTT-Quellen und Triggern der Ketten kommen
+PAYLOADS = {
+    'product_data': ({
+        "topic": "productdata",
+        "data": {
+            "product_id": 4711,
+            "machinenumber": "M-12",
+            "record_id": 987654,
+            "inserttime": "2024-03-01T12:34:56.789000",
+            "readytodelete": False,
+            "data": [{str(group_id): round(group_id * 1.25, 2) for group_id in range(20)} for _ in range(5)],
+        },
+    }, {"data.inserttime": "datetime"}),
+    'section_data': ({
+        "topic": "sectiondata",
+        "data": {"id": 1234, "name": "Section 7", "starttime": "2024-03-01T06:00:00"},
+    }, {"data.starttime": "datetime"}),
+    'trigger_row': ({
+        "entity_object_id": 123456,
+        "group_id": "G-42",
+        "value": "17.50",
+        "updated_at": "2024-03-01T12:34:56.789000+00:00",
+    }, {"updated_at": "datetime", "value": "decimal"}),
+}
+
+
+def legacy_loads(s):
+    """
+    custom_json_loads before the codec was introduced. The original only caught ValueError and failed
+    with decimal.InvalidOperation on non-numeric strings, here such strings are left unchanged.
+    """
+    def json_decoder(obj):
+        for key, value in obj.items():
+            try:
+                obj[key] = datetime.fromisoformat(value)
+            except (TypeError, ValueError):
+                if isinstance(value, str):
+                    try:
+                        obj[key] = Decimal(value)
+                    except (ValueError, ArithmeticError):
+                        pass
+        return obj
+
+    return json.loads(s, object_hook=json_decoder)
+
+
+def main(args):
+    print(f"orjson: {'yes' if codec.orjson is not None else 'no'}")
+    print(f"{'payload':<14} {'bytes':>6} {'decoder':<12} {'us/msg':>8} {'speedup':>8}")
+    for name, (message, schema) in PAYLOADS.items():
+        payload = json.dumps(message).encode()
+        typed_decoder = codec.TypedDecoder(schema)
+        decoders = {
+            'legacy': lambda: legacy_loads(payload),
+            'stdlib': lambda: json.loads(payload),
+            'codec': lambda: codec.loads(payload),
+            'codec_typed': lambda: typed_decoder.decode(payload),
+        }
+        baseline = None
+        for decoder_name, decode in decoders.items():
+            seconds = min(timeit.repeat(decode, number=args.iterations, repeat=args.repeat)) / args.iterations
+            baseline = baseline or seconds
+            print(f"{name:<14} {len(payload):>6} {decoder_name:<12} {seconds * 1e6:>8.2f} {baseline / seconds:>7.1f}x")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--repeat', type=int, default=3)
+    main(parser.parse_args())
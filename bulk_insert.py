@@ -0,0 +1,137 @@
+import csv
+import io
+import json
+import re
+from datetime import date, datetime, time
+from decimal import Decimal
+
+# Named bind parameters (":name"), ignoring PostgreSQL casts ("::text")
+NAMED_PARAMETER_PATTERN = re.compile(r'(?<![:\w]):(\w+)')
+
+INSERT_STATEMENT_PATTERN = re.compile(
+    r'^\s*INSERT\s+INTO\s+(?P<table>[\w."]+)\s*\((?P<columns>[^)]*)\)\s*VALUES\s*\((?P<values>[^)]*)\)\s*;?\s*$',
+    re.IGNORECASE | re.DOTALL)
+
+# NULL-Darstellung im CSV-Format, damit leere Strings und NULL unterscheidbar bleiben
+CSV_NULL = '\\N'
+
+
+def compile_named_statement(statement):
+    """
+    Converts a statement with named bind parameters (":name") into the positional form of asyncpg ("$1").
+
+    :return: Tuple of the converted statement and the parameter names in positional order.
+    """
+    names = []
+
+    def replace(match):
+        name = match.group(1)
+        if name not in names:
+            names.append(name)
+        return f"${names.index(name) + 1}"
+
+    return NAMED_PARAMETER_PATTERN.sub(replace, statement), names
+
+
+def split_table_name(table):
+    """
+    Splits 'schema.table' into schema and table name, removing identifier quotes.
+    """
+    parts = [part.strip().strip('"') for part in table.split('.')]
+    if len(parts) == 1:
+        return None, parts[0]
+    return parts[-2], parts[-1]
+
+
+def to_csv_value(value):
+    if value is None:
+        return CSV_NULL
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=str)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+    return value
+
+
+class BulkInsertPlan:
+    """
+    Column layout of a postgres target, derived once from the configured 'insert_statement'
+    or from an explicit column mapping.
+
+    COPY is only possible if every inserted value is a plain bind parameter; statements with expressions
+    (e.g. ':value::int' or 'now()') are executed with executemany instead.
+    """
+
+    def __init__(self, insert_statement=None, columns=None, table=None):
+        """
+        :param insert_statement: INSERT statement with named bind parameters (":name").
+        :param columns: Optional mapping of table column to message field, or a list of columns named like the fields.
+        :param table: Table name ('schema.table'), required if no parsable insert_statement is given.
+        """
+        self.insert_statement = insert_statement
+        self.statement = None
+        self.parameter_names = []
+        self.columns = []
+        self.fields = []
+        self.schema_name = None
+        self.table_name = None
+        self.copy_supported = False
+
+        if insert_statement:
+            self.statement, self.parameter_names = compile_named_statement(insert_statement)
+
+        parsed = INSERT_STATEMENT_PATTERN.match(insert_statement) if insert_statement else None
+        if parsed and not table:
+            table = parsed.group('table')
+
+        if columns:
+            if isinstance(columns, dict):
+                self.columns, self.fields = list(columns.keys()), list(columns.values())
+            else:
+                self.columns, self.fields = list(columns), list(columns)
+            self.copy_supported = table is not None
+        elif parsed:
+            statement_columns = [column.strip().strip('"') for column in parsed.group('columns').split(',')]
+            values = [value.strip() for value in parsed.group('values').split(',')]
+            value_fields = [value[1:] if re.fullmatch(r':\w+', value) else None for value in values]
+            if len(statement_columns) == len(value_fields) and None not in value_fields:
+                self.columns, self.fields = statement_columns, value_fields
+                self.copy_supported = True
+
+        if table:
+            self.schema_name, self.table_name = split_table_name(table)
+
+        if not self.statement and self.copy_supported:
+            # Statement für das zeilenweise Einfügen aus dem Spalten-Mapping ableiten
+            qualified = f"{self.schema_name}.{self.table_name}" if self.schema_name else self.table_name
+            placeholders = ', '.join(f"${i + 1}" for i in range(len(self.columns)))
+            self.statement = f"INSERT INTO {qualified} ({', '.join(self.columns)}) VALUES ({placeholders})"
+            self.parameter_names = list(self.fields)
+
+    def parameters(self, data):
+        """
+        Positional parameters of the insert statement for every record.
+        """
+        return [tuple(record.get(name) for name in self.parameter_names) for record in data]
+
+    def copy_records(self, data):
+        """
+        Records in column order for COPY.
+        """
+        return [tuple(record.get(field) for field in self.fields) for record in data]
+
+    def csv_buffer(self, data):
+        """
+        Encodes the records as CSV for 'COPY ... FROM STDIN (FORMAT csv)'.
+        """
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        for record in data:
+            writer.writerow([to_csv_value(record.get(field)) for field in self.fields])
+        return io.BytesIO(buffer.getvalue().encode())
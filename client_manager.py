@@ -1,8 +1,12 @@
 import asyncio
 
 from db_client import DBClient
+from incremental_polling import IncrementalQuery, PollingStateStore
 from mqtt_client import MQTTClient
 from helpers.custom_logging_helper import logger
+from helpers.metrics import REGISTRY
+from helpers.metrics_server import MetricsServer, monitor_event_loop_lag
+from helpers.tracing import Profiler, Tracer
 from redis_client import RedisClient
 from rule_chain import RuleChain
 
@@ -12,8 +16,23 @@ class ClientManager:
         self.mqtt_clients = {}
         self.db_clients = {}
         self.redis_clients = {}
+        self.polling_state_stores = {}
         self.targets = self.extract_targets(specific_configs["data_processing_chains"])
         self.rule_chain = None
+        self.metrics_server = None
+        self.loop_lag_task = None
+        self.tracing_config = specific_configs.get('tracing') or {}
+        self.profiler = None
+    def extract_client_configs(self):
+        """
+        Returns the configuration of every client by ID as (client_type, config).
+        """
+        client_configs = {}
+        for client_type, key in (('mqtt', 'mqtt_clients'), ('postgres', 'postgres_clients'), ('redis', 'redis_clients')):
+            for client_config in self.specific_configs.get(key, []):
+                client_configs[client_config['id']] = (client_type, client_config)
+        return client_configs
+
     def extract_targets(self, chains_config):
         targets = []
         for chain in chains_config:
@@ -32,16 +51,149 @@ class ClientManager:
         # subscribing to topics, and initializing DB polling.
         # Note: setup_rule_chains is not async and does not need to be awaited.
         self.setup_rule_chains()
+        await self.start_metrics_server()
+        self.start_profiler()
         # Since subscribe_to_topics and initialize_db_polling are async,
         # they should be awaited or scheduled with asyncio.create_task if they are intended to run concurrently.
 
-        await asyncio.gather(
-            self.rule_chain.initialize_external_scripts(),
-            self.subscribe_to_topics(),
-            self.initialize_db_polling(),
-            self.initialize_db_triggers()
-        )
+        try:
+            await asyncio.gather(
+                self.rule_chain.initialize_external_scripts(),
+                self.rule_chain.initialize_transforms(),
+                self.subscribe_to_topics(),
+                self.initialize_db_polling(),
+                self.initialize_db_triggers()
+            )
+        finally:
+            await self.shutdown()
+
+    async def shutdown(self):
+        """
+        Flushes buffered target records and closes the database connections.
+        """
+        logger.info("Shutting down clients...")
+        if self.loop_lag_task is not None:
+            self.loop_lag_task.cancel()
+        if self.metrics_server is not None:
+            await self.metrics_server.close()
+        for mqtt_client in self.mqtt_clients.values():
+            await mqtt_client.dispatcher.stop()
+        if self.rule_chain:
+            await self.rule_chain.shutdown()
+        for mqtt_client in self.mqtt_clients.values():
+            await mqtt_client.publish_queue.close()
+        for redis_client in self.redis_clients.values():
+            await redis_client.close()
+        for db_client in self.db_clients.values():
+            await db_client.close_pool()
+
 
+    async def start_metrics_server(self):
+        """
+        Serves the metrics in the Prometheus text format if the top level 'metrics' configuration enables it:
+        {"enabled": true, "host": "0.0.0.0", "port": 8000, "loop_lag_interval": 0.5}
+        """
+        metrics_config = self.specific_configs.get('metrics') or {}
+        if not metrics_config.get('enabled', False):
+            return
+        self.register_metrics()
+        self.metrics_server = MetricsServer(host=metrics_config.get('host', '0.0.0.0'),
+                                            port=metrics_config.get('port', 8000))
+        try:
+            await self.metrics_server.start()
+        except OSError as e:
+            logger.error(f"Failed to start the metrics server: {e}")
+            self.metrics_server = None
+            return
+        self.loop_lag_task = asyncio.create_task(monitor_event_loop_lag(metrics_config.get('loop_lag_interval', 0.5)))
+
+    def create_tracer(self):
+        """
+        Creates the tracer of the rule chains if the top level 'tracing' configuration enables it:
+        {"enabled": true, "sample_rate": 0.001, "slow_threshold_ms": 200}
+        """
+        if not self.tracing_config.get('enabled', False):
+            return None
+        return Tracer(sample_rate=self.tracing_config.get('sample_rate', 0.0),
+                      slow_threshold_ms=self.tracing_config.get('slow_threshold_ms', 200),
+                      max_events=self.tracing_config.get('max_events', 200))
+
+    def start_profiler(self):
+        """
+        Enables on-demand profiling of the event loop via SIGUSR1 and, if the metrics server runs,
+        via GET /profile?seconds=N. Configured with 'tracing': {"profiling": true, "profile_dir": "profiles",
+        "profile_seconds": 30}.
+        """
+        if not self.tracing_config.get('profiling', False):
+            return
+        self.profiler = Profiler(directory=self.tracing_config.get('profile_dir', 'profiles'),
+                                 default_seconds=self.tracing_config.get('profile_seconds', 30))
+        self.profiler.install_signal_handler()
+        if self.metrics_server is not None:
+            self.metrics_server.add_route('/profile', self.profiler.handle_request)
+            logger.info(f"Profiling available at http://{self.metrics_server.host}:{self.metrics_server.port}"
+                        f"/profile?seconds={self.profiler.default_seconds}")
+
+    def register_metrics(self):
+        """
+        Registers the queue depths and latencies kept by the clients, collected on every scrape.
+        """
+        mqtt_clients = self.mqtt_clients
+        REGISTRY.gauge('dc_mqtt_inbound_queue_depth', 'Messages waiting in the incoming queue of a MQTT client.',
+                       ('client_id',), callback=lambda: [((client_id,), client.dispatcher.depth)
+                                                          for client_id, client in mqtt_clients.items()])
+        REGISTRY.gauge('dc_mqtt_inbound_dropped', 'Incoming messages dropped because the queue was full.',
+                       ('client_id',), callback=lambda: [((client_id,), client.dispatcher.dropped)
+                                                          for client_id, client in mqtt_clients.items()])
+        REGISTRY.histogram('dc_mqtt_inbound_pickup_age_seconds', 'Time incoming messages waited in the queue.',
+                           ('client_id',), callback=lambda: [((client_id,), client.dispatcher.pickup_age)
+                                                              for client_id, client in mqtt_clients.items()])
+        REGISTRY.gauge('dc_mqtt_outbound_queue_depth', 'Messages waiting in the publish queue of a MQTT client.',
+                       ('client_id',), callback=lambda: [((client_id,), client.publish_queue.depth)
+                                                          for client_id, client in mqtt_clients.items()])
+        REGISTRY.gauge('dc_mqtt_outbound_in_flight', 'Publishes awaiting the broker.',
+                       ('client_id',), callback=lambda: [((client_id,), len(client.publish_queue.in_flight))
+                                                          for client_id, client in mqtt_clients.items()])
+        REGISTRY.gauge('dc_mqtt_outbound_dropped', 'Outgoing messages dropped because the publish queue was full.',
+                       ('client_id',), callback=lambda: [((client_id,), client.publish_queue.dropped)
+                                                          for client_id, client in mqtt_clients.items()])
+        REGISTRY.histogram('dc_mqtt_publish_latency_seconds', 'Time from queueing a message until the broker '
+                           'accepted it.', ('client_id',),
+                           callback=lambda: [((client_id,), client.publish_queue.latency)
+                                             for client_id, client in mqtt_clients.items()])
+        REGISTRY.gauge('dc_target_buffer_depth', 'Records waiting in the buffer of a PostgreSQL target.',
+                       ('buffer',), callback=self.collect_target_buffer_depths)
+        REGISTRY.gauge('dc_target_buffer_age_seconds', 'Age of the oldest record in the buffer of a target.',
+                       ('buffer',), callback=self.collect_target_buffer_ages)
+        REGISTRY.gauge('dc_notification_queue_depth', 'Notifications waiting to be processed per trigger channel.',
+                       ('client_id', 'channel'), callback=self.collect_notification_depths)
+        REGISTRY.gauge('dc_coalescing_buffer_depth', 'Rows waiting in the coalescing buffer of a trigger channel.',
+                       ('client_id', 'channel'), callback=self.collect_coalescing_depths)
+        REGISTRY.gauge('dc_micro_batcher_pending', 'Messages waiting for their micro-batch.',
+                       ('batcher',), callback=self.collect_batcher_pending)
+
+    def collect_target_buffer_depths(self):
+        return [((target_buffer.name,), target_buffer.depth) for target_buffer in self.rule_chain.target_buffers.values()]
+
+    def collect_target_buffer_ages(self):
+        return [((target_buffer.name,), target_buffer.age) for target_buffer in self.rule_chain.target_buffers.values()]
+
+    def collect_notification_depths(self):
+        return [((client_id, name), subscription.queue.qsize())
+                for client_id, db_client in self.db_clients.items()
+                for name, subscription in db_client.notification_hub.channels.items()]
+
+    def collect_coalescing_depths(self):
+        return [((client_id, name), subscription.buffer.depth)
+                for client_id, db_client in self.db_clients.items()
+                for name, subscription in db_client.notification_hub.channels.items()
+                if subscription.buffer is not None]
+
+    def collect_batcher_pending(self):
+        batchers = list(self.rule_chain.step_batchers.values())
+        batchers.extend(executor.batcher for executor in self.rule_chain.script_executors.values()
+                        if hasattr(executor, 'batcher'))
+        return [((batcher.name,), len(batcher.pending)) for batcher in batchers]
 
     async def initialize_all_clients(self):
         """
@@ -54,18 +206,33 @@ class ClientManager:
         )
 
 
+    @staticmethod
+    def create_redis_client(redis_client_config):
+        """
+        Creates a Redis client from its configuration. Also used by process workers to re-create clients.
+        """
+        return RedisClient(
+            client_id=redis_client_config['id'],
+            host=redis_client_config['host'],
+            port=redis_client_config['port'],
+            db=redis_client_config['db'],
+            password=redis_client_config.get('password'),
+            max_connections=redis_client_config.get('max_connections', 50),
+            max_retry_delay=redis_client_config.get('max_retry_delay', 30),
+            socket_timeout=redis_client_config.get('socket_timeout', 5),
+            local_cache_size=redis_client_config.get('local_cache_size', 0),
+            local_cache_ttl=redis_client_config.get('local_cache_ttl', 5.0),
+            local_cache_prefixes=redis_client_config.get('local_cache_prefixes'),
+            invalidation_listener=redis_client_config.get('invalidation_listener', False)
+        )
+
     async def initialize_redis_clients(self):
         """
         Initialize all Redis clients.
         """
         for redis_client_config in self.specific_configs.get('redis_clients', []):
             if redis_client_config['id'] not in self.redis_clients:
-                redis_client = RedisClient(
-                    client_id=redis_client_config['id'],
-                    host=redis_client_config['host'],
-                    port=redis_client_config['port'],
-                    db=redis_client_config['db']
-                )
+                redis_client = self.create_redis_client(redis_client_config)
                 self.redis_clients[redis_client_config['id']] = redis_client
                 logger.success(f"Redis client for {redis_client_config['id']} initialized.")
 
@@ -80,20 +247,44 @@ class ClientManager:
                 port=mqtt_client_config['port'],
                 client_id=mqtt_client_config['id'],
                 username=mqtt_client_config['username'],
-                password=mqtt_client_config['password']
+                password=mqtt_client_config['password'],
+                max_workers=mqtt_client_config.get('max_workers', 16),
+                queue_size=mqtt_client_config.get('queue_size', 10000),
+                overflow_policy=mqtt_client_config.get('overflow_policy', 'block'),
+                ordered_by_topic=mqtt_client_config.get('ordered_by_topic', False),
+                connections=mqtt_client_config.get('connections', 1),
+                protocol=mqtt_client_config.get('protocol', 4),
+                max_in_flight=mqtt_client_config.get('max_in_flight', 100),
+                publish_queue_size=mqtt_client_config.get('publish_queue_size', 10000),
+                publish_overflow_policy=mqtt_client_config.get('publish_overflow_policy', 'block')
             )
             self.mqtt_clients[mqtt_client_config['id']] = mqtt_client
             logger.success(f"MQTT client for {mqtt_client_config['id']} initialized.")
 
+    @staticmethod
+    def create_db_client(db_client_config):
+        """
+        Creates a PostgreSQL client from its configuration. It still has to be connected.
+        """
+        return DBClient(
+            client_id = db_client_config['id'],
+            connection_string = db_client_config['connection_string'],
+            engine = db_client_config.get('engine', 'asyncpg'),
+            pool_min_size = db_client_config.get('pool_min_size', 1),
+            pool_max_size = db_client_config.get('pool_max_size', 10),
+            pool_timeout = db_client_config.get('pool_timeout', 10),
+            command_timeout = db_client_config.get('command_timeout', 60),
+            fetch_size = db_client_config.get('fetch_size', 100),
+            listen_check_interval = db_client_config.get('listen_check_interval', 10),
+            notify_fetch_batch_size = db_client_config.get('notify_fetch_batch_size', 500)
+        )
+
     async def initialize_db_clients(self):
         """
         Initialize all PostgreSQL clients.
         """
         for db_client_config in self.specific_configs['postgres_clients']:
-            db_client = DBClient(
-                client_id = db_client_config['id'],
-                connection_string = db_client_config['connection_string']
-            )
+            db_client = self.create_db_client(db_client_config)
             await db_client.connect_and_verify()
             self.db_clients[db_client_config['id']] = db_client
             logger.success(f"DB client for {db_client_config['id']} initialized.")
@@ -125,16 +316,43 @@ class ClientManager:
                         "polling_interval")  # Entfernt Standardwert, um das Fehlen zu überprüfen
                     query = source.get("query")
                     if query and polling_interval:
+                        incremental = self.create_incremental_query(db_client, query, source.get('incremental'))
                         # Startet das Polling für die SQL-Abfrage, falls vorhanden
                         asyncio.create_task(
-                            db_client.start_polling_query(query, int(polling_interval), self.rule_chain))
+                            db_client.start_polling_query(query, int(polling_interval), self.rule_chain,
+                                                          batch_format=source.get('batch_format'),
+                                                          max_rows_per_batch=source.get('max_rows_per_batch', 1000),
+                                                          incremental=incremental))
                         logger.info(f"Initialized polling for query '{query}' every {polling_interval} seconds.")
                     else:
                         # Logge Warnung, falls notwendige Informationen fehlen
                         logger.warning(f"Missing 'query', 'polling_interval' or no polling defined for client {source['client_id']}.")
 
+    def create_incremental_query(self, db_client, query, incremental_config):
+        """
+        Creates the IncrementalQuery of a polling source, or None if the source polls the full query.
+        """
+        if not incremental_config:
+            return None
+        if not db_client.use_async:
+            logger.error(f"Incremental polling requires the asyncpg engine, client {db_client.client_id} "
+                         f"polls the full query instead.")
+            return None
+        state_client = incremental_config.get('state_client')
+        if state_client and state_client not in self.redis_clients:
+            logger.warning(f"Redis client '{state_client}' for the polling state not found, using the local state file.")
+            state_client = None
+        if state_client not in self.polling_state_stores:
+            self.polling_state_stores[state_client] = PollingStateStore(
+                redis_client=self.redis_clients.get(state_client) if state_client else None)
+        try:
+            return IncrementalQuery(db_client, query, incremental_config, self.polling_state_stores[state_client])
+        except ValueError as e:
+            logger.error(f"Invalid incremental polling configuration for query '{query}': {e}")
+            return None
+
     async def subscribe_to_topics(self):
-        topics_by_client = {}  # Sammeln von Topics nach Client-ID
+        topics_by_client = {}  # Sammeln von Abonnements (Topic, QoS, Shared-Gruppe) nach Client-ID
         target_clients_without_sources = set()  # Sammeln von Client-IDs, die als Ziele konfiguriert sind, aber keine Quellen haben
 
         # Schritt 1: Durchlaufen der Sources, um Topics nach Client zu sammeln
@@ -142,9 +360,11 @@ class ClientManager:
             for source in chain_config.get("sources", []):
                 client_id = source["client_id"]
                 if source["client_type"] == "mqtt":
-                    if client_id not in topics_by_client:
-                        topics_by_client[client_id] = []
-                    topics_by_client[client_id].append(source["topic"])
+                    subscriptions = topics_by_client.setdefault(client_id, {})
+                    key = (source["topic"], source.get("shared_group"))
+                    qos = max(source.get("qos", 0), subscriptions.get(key, {}).get("qos", 0))
+                    subscriptions[key] = {"topic": source["topic"], "qos": qos,
+                                          "shared_group": source.get("shared_group")}
 
             # Schritt 2: Ermitteln von Clients, die als Targets konfiguriert sind
             for target in chain_config.get("targets", []):
@@ -152,21 +372,23 @@ class ClientManager:
                 if target["client_type"] == "mqtt" and client_id not in topics_by_client:
                     target_clients_without_sources.add(client_id)
 
-        # Schritt 3: Abonnieren der Topics für jeden Client
-        for client_id, topics in topics_by_client.items():
+        # Schritt 3: Abonnieren der Topics für jeden Client (die Verbindungen laufen dauerhaft, daher parallel)
+        subscription_tasks = []
+        for client_id, subscriptions in topics_by_client.items():
             if client_id in self.mqtt_clients:
                 client = self.mqtt_clients[client_id]
-                logger.info(f"Subscribing client '{client_id}' to topics: {topics}")
-                await client.subscribe_to_topics(topics)
-                for topic in topics:
-                    logger.info(f"Subscribed to topic: {topic}")
+                subscriptions = list(subscriptions.values())
+                logger.info(f"Subscribing client '{client_id}' to topics: {[s['topic'] for s in subscriptions]}")
+                subscription_tasks.append(client.subscribe_to_topics(subscriptions))
 
         # Schritt 4: Keepalive-Topic für Clients ohne Quellen abonnieren
         for client_id in target_clients_without_sources:
             if client_id in self.mqtt_clients:
                 client = self.mqtt_clients[client_id]
                 logger.info(f"Client '{client_id}' has no sources. Subscribing to keepalive topic.")
-                await self.subscribe_to_keepalive_topic(client)
+                subscription_tasks.append(self.subscribe_to_keepalive_topic(client))
+
+        await asyncio.gather(*subscription_tasks)
 
     async def subscribe_to_keepalive_topic(self, client):
         keepalive_topic = "$SYS/keepalive"
@@ -175,7 +397,8 @@ class ClientManager:
 
     def setup_rule_chains(self):
         self.rule_chain = RuleChain(self.specific_configs["data_processing_chains"], self.targets, self.mqtt_clients,
-                                    self.db_clients, self.redis_clients)
+                                    self.db_clients, self.redis_clients, self.extract_client_configs(),
+                                    tracer=self.create_tracer())
 
 
 
@@ -23,6 +23,8 @@ def extract_specific_configs(validated_data):
     postgres_clients = []
     redis_clients = []
     valid_data_processing_chains = []
+    metrics = {}
+    tracing = {}
 
     chain_config = validated_data.get('chain_config')
     if chain_config:
@@ -30,6 +32,8 @@ def extract_specific_configs(validated_data):
         postgres_clients = chain_config.get('postgres_clients', [])
         redis_clients = chain_config.get('redis_clients', [])
         data_processing_chains = chain_config.get('data_processing_chains', [])
+        metrics = chain_config.get('metrics', {})
+        tracing = chain_config.get('tracing', {})
 
         # Filter chains that have at least one source and one target
         for chain in data_processing_chains:
@@ -40,7 +44,9 @@ def extract_specific_configs(validated_data):
         "mqtt_clients": mqtt_clients,
         "postgres_clients": postgres_clients,
         "redis_clients": redis_clients,
-        "data_processing_chains": valid_data_processing_chains
+        "data_processing_chains": valid_data_processing_chains,
+        "metrics": metrics,
+        "tracing": tracing
     }
 
 def validate_and_get_configs(config_managers) -> Optional[Dict[str, Any]]:
@@ -1,6 +1,6 @@
 
 # Einmalige, initiale Ausführung:
-async def initialize(input_message, clients):
+async def initialize(clients):
    return
 
 
@@ -1,28 +1,20 @@
+import asyncio
+
 from helpers.custom_json_encoder import custom_json_dumps, custom_json_loads
 from helpers.custom_logging_helper import logger
 
 
-async def get_group_data_initial(redis_client, db_client):
-    """
-    This function is intended to be called once to initialize the cache with group data.
-    """
-    cache_key = "groups_data"
-    try:
-        query = "SELECT entity_object_id, group_id FROM data_pipeline.entity_objects WHERE group_id IS NOT NULL"
-        result_stream = db_client.execute_query(query)
-        groups_data = [result for result in result_stream]
-
-        # Cache each group data individually
-        for group in groups_data:
-            group_id = group['group_id']
-            entity_object_id = group['entity_object_id']
-            # Assuming each entity_object_id is unique and can be used as a Redis key
-            await redis_client.set(f"group_data:{entity_object_id}", custom_json_dumps(group_id))
-
-        logger.info("Initial group data loaded into cache.")
-    except Exception as e:
-        logger.error(f"Error initializing group data cache: {e}")
-        raise
+# Gruppenzuordnung je entity_object_id als Feld des Hashs 'group_data' (HGET group_data <id>).
+# Frühere Versionen schrieben einzelne Keys 'group_data:<id>', die beim Start einmalig entfernt werden;
+# Verbraucher dieser Keys müssen auf den Hash umgestellt werden. Die Keys '<id>' ohne Präfix aus der
+# ursprünglichen Initialisierung werden nicht angefasst und sind bei Bedarf manuell zu löschen.
+GROUP_DATA_HASH = "group_data"
+GROUP_DATA_PROGRESS_KEY = "group_data:warm_up"
+LEGACY_GROUP_DATA_PATTERN = "group_data:*"
+LEGACY_KEYS_REMOVED_KEY = "group_data:legacy_keys_removed"
+
+# Warm-up, der nach einem Timeout der Initialisierung im Hintergrund weiterläuft
+warm_up_task = None
 
 
 async def update_group_data_cache(redis_client, entity_object_id, group_id):
@@ -32,50 +24,59 @@ async def update_group_data_cache(redis_client, entity_object_id, group_id):
     try:
         if group_id is not None:
             # Update the cache with the new group_id
-            redis_client.set(f"group_data:{entity_object_id}", custom_json_dumps(group_id))
+            redis_client.hset(GROUP_DATA_HASH, entity_object_id, custom_json_dumps(group_id))
             logger.info(f"Cache updated for entity_object_id {entity_object_id} with group_id {group_id}.")
         else:
             # Remove the key from the cache if group_id is null
-            redis_client.delete(f"group_data:{entity_object_id}")
+            redis_client.hdel(GROUP_DATA_HASH, entity_object_id)
             logger.info(f"Cache entry removed for entity_object_id {entity_object_id} as group_id is null.")
     except Exception as e:
         logger.error(f"Error updating/removing group data cache for entity_object_id {entity_object_id}: {e}")
 
 
 async def initialize_group_data(redis_client, db_client):
-        cache_key = "groups_data"
-        groups_data = None
-        try:
-            cached_data = await redis_client.get(cache_key)
-            if cached_data:
-                try:
-                    groups_data = custom_json_loads(cached_data)
-                    #logger.debug("Retrieved group data from cache.")
-                    #logger.debug(f"Cached groups data: {groups_data}")
-                except Exception as e:
-                    logger.error(f"Error decoding cached groups data: {e}")
-                    groups_data = None
-
-            if not cached_data or groups_data is None:
-                try:
-                    query = "SELECT entity_object_id, group_id FROM data_pipeline.entity_objects WHERE group_id IS NOT NULL"
-                    result_stream = db_client.execute_query(query)
-                    groups_data = [result for result in result_stream]
-
-                    #logger.debug(f"Group meta data before caching: {len(groups_data)}")
-                    # Inside get_group_data, after fetching data from the database
-                    for group in groups_data:
-                        group_id = group['group_id']
-                        entity_object_id = group['entity_object_id']
-                        redis_client.set(entity_object_id, custom_json_dumps(group_id))
-                    logger.info("Retrieved group data from database and updated cache.")
-                except Exception as e:
-                    logger.error(f"Error fetching group data from database: {e}")
-                    raise
-        except Exception as e:
-            logger.error(f"Unexpected error in get_group_data: {e}")
-            raise
-        logger.info("Initial group data load and cache update completed.")
+    """
+    Streams the group assignments from the database into the Redis hash 'group_data' in pipelined chunks.
+    After an initialization timeout the warm-up continues in the background (see 'initialize'); a warm-up
+    interrupted by a restart continues after the last written entity object.
+    """
+    try:
+        checkpoint = await redis_client.get_warm_up_checkpoint(GROUP_DATA_PROGRESS_KEY)
+        if checkpoint and not checkpoint.get("done") and checkpoint.get("last_key") is not None:
+            logger.info(f"Resuming group data warm-up after entity_object_id {checkpoint['last_key']}.")
+            query = ("SELECT entity_object_id, group_id FROM data_pipeline.entity_objects "
+                     "WHERE group_id IS NOT NULL AND entity_object_id > $1 ORDER BY entity_object_id")
+            rows = db_client.execute_query(query, checkpoint["last_key"])
+        else:
+            checkpoint = None
+            query = ("SELECT entity_object_id, group_id FROM data_pipeline.entity_objects "
+                     "WHERE group_id IS NOT NULL ORDER BY entity_object_id")
+            rows = db_client.execute_query(query)
+
+        await redis_client.warm_up(rows, key="entity_object_id", value="group_id", hash_name=GROUP_DATA_HASH,
+                                   serializer=custom_json_dumps, chunk_size=5000,
+                                   progress_key=GROUP_DATA_PROGRESS_KEY, resume_from=checkpoint)
+    except Exception as e:
+        logger.error(f"Error fetching group data from database: {e}")
+        raise
+    logger.info("Initial group data load and cache update completed.")
+
+
+async def remove_legacy_group_keys(redis_client):
+    """
+    Removes the per-entity keys 'group_data:<id>' of previous versions once, marked by LEGACY_KEYS_REMOVED_KEY.
+    """
+    try:
+        if await redis_client.get(LEGACY_KEYS_REMOVED_KEY):
+            return
+        removed = await redis_client.delete_matching(
+            LEGACY_GROUP_DATA_PATTERN, exclude=(GROUP_DATA_PROGRESS_KEY, LEGACY_KEYS_REMOVED_KEY))
+        await redis_client.set(LEGACY_KEYS_REMOVED_KEY, "1")
+        logger.info(f"Removed {removed} legacy group data keys '{LEGACY_GROUP_DATA_PATTERN}'.")
+    except Exception as e:
+        logger.error(f"Error removing legacy group data keys: {e}")
+
+
 async def update_last_section_id_in_redis(redis_client, db_client):
     """
     Fetches the last section ID from the database using DBClient and updates a Redis entry with it.
@@ -85,8 +86,8 @@ async def update_last_section_id_in_redis(redis_client, db_client):
     query = "SELECT MAX(id) as last_section_id FROM public.section"
 
     try:
-        result_stream = db_client.execute_query(query)
-        result = next(result_stream, None)  # Attempt to fetch the first (and only) row from the generator
+        rows = await db_client.fetch_all(query)
+        result = rows[0] if rows else None  # The query returns exactly one row
 
         if result is not None and result['last_section_id'] is not None:
             last_section_id = result['last_section_id']
@@ -143,11 +144,20 @@ async def format_product_data(input_message, redis_client):
     return formatted_data
 
 async def initialize(clients):
+    global warm_up_task
     db_client = clients['db1']
     batchdata_db_client = clients["db2"]
     redis_client = clients['redis1']
-    await initialize_group_data(redis_client, db_client)
     await update_last_section_id_in_redis(redis_client, batchdata_db_client)
+    await remove_legacy_group_keys(redis_client)
+    if warm_up_task is None or warm_up_task.done():
+        warm_up_task = asyncio.create_task(initialize_group_data(redis_client, db_client))
+    try:
+        # shield: bei einem Timeout der Initialisierung läuft der Warm-up im Hintergrund weiter
+        await asyncio.shield(warm_up_task)
+    except asyncio.CancelledError:
+        logger.warning("Group data warm-up continues in the background after the initialization timeout.")
+        raise
     return
 async def process_message(input_message, clients):
     """
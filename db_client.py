@@ -1,5 +1,7 @@
 import asyncio
 import json
+import re
+import time
 
 import asyncpg
 
@@ -7,28 +9,134 @@ from sqlalchemy import create_engine, exc, text
 from sqlalchemy.exc import SQLAlchemyError
 from sqlalchemy.orm import sessionmaker
 
+from bulk_insert import BulkInsertPlan, CSV_NULL
 from helpers.custom_json_encoder import custom_json_dumps
 from helpers.custom_logging_helper import logger
+from helpers.metrics import REGISTRY
+from notification_hub import MAX_NOTIFY_PAYLOAD, PRIMARY_KEY_MARKER, NotificationHub
+from record_batch import ColumnBatch
 from uuid import uuid4
 
 # TODO: add db target
 # TODO: Versionierung
 # TODO:  grouplogik implementieren
 # TODO: Testen
+
+# Fehler, bei denen die Verbindungsprüfung erneut versucht wird
+CONNECTION_ERRORS = (exc.SQLAlchemyError, asyncpg.PostgresError, asyncpg.InterfaceError, OSError,
+                     asyncio.TimeoutError)
+
+POLL_DURATION = REGISTRY.histogram('dc_db_poll_duration_seconds',
+                                   'Duration of a polling run including the processing of its rows.', ('client_id',))
+POLL_ERRORS = REGISTRY.counter('dc_db_poll_errors_total', 'Failed polling runs.', ('client_id',))
+POLLED_ROWS = REGISTRY.counter('dc_db_polled_rows_total', 'Rows passed on by polling queries.', ('client_id',))
+INSERT_DURATION = REGISTRY.histogram('dc_db_insert_duration_seconds', 'Duration of a bulk insert.', ('client_id',))
+INSERTED_ROWS = REGISTRY.counter('dc_db_inserted_rows_total', 'Rows inserted by bulk inserts.', ('client_id',))
+REJECTED_ROWS = REGISTRY.counter('dc_db_rejected_rows_total', 'Rows a bulk insert could not insert.', ('client_id',))
+
+
+class QueryStream:
+    """
+    Result of DBClient.execute_query.
+
+    Iterating with 'async for' streams the rows through the asyncpg pool without blocking the event loop.
+    Plain iteration ('for', 'next()') keeps the previous behaviour and streams through the synchronous
+    SQLAlchemy session, so existing scripts keep working unchanged.
+    """
+
+    def __init__(self, db_client, query, args):
+        self.db_client = db_client
+        self.query = query
+        self.args = args
+        self._sync_rows = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._sync_rows is None:
+            if self.args:
+                raise ValueError("Query parameters are only supported with 'async for' iteration.")
+            self._sync_rows = self.db_client.execute_query_sync(self.query)
+        return next(self._sync_rows)
+
+    def __aiter__(self):
+        return self.db_client.stream_query(self.query, *self.args).__aiter__()
+
+
 class DBClient:
-    def __init__(self, client_id, connection_string, retry_limit=-1, retry_interval=10):
+    def __init__(self, client_id, connection_string, retry_limit=-1, retry_interval=10, engine='asyncpg',
+                 pool_min_size=1, pool_max_size=10, pool_timeout=10, command_timeout=60, fetch_size=100,
+                 listen_check_interval=10, notify_fetch_batch_size=500):
+        """
+        :param engine: 'asyncpg' runs queries non-blocking through an asyncpg connection pool,
+            'sqlalchemy' uses the synchronous SQLAlchemy session on the event loop.
+        :param pool_min_size: Minimum number of connections in the asyncpg pool.
+        :param pool_max_size: Maximum number of connections in the asyncpg pool.
+        :param pool_timeout: Timeout in seconds for establishing and acquiring a pool connection.
+        :param command_timeout: Default timeout in seconds for a single statement.
+        :param fetch_size: Number of rows fetched per round trip when streaming query results.
+        :param listen_check_interval: Interval in seconds in which the shared LISTEN connection is checked.
+        :param notify_fetch_batch_size: Maximum number of rows fetched at once for primary key notifications.
+        """
         self.connection_string = connection_string
         self.retry_limit = retry_limit
         self.retry_interval = retry_interval
         self.engine = None
         self.session = None
+        self.use_async = engine == 'asyncpg'
+        self.pool = None
+        self.pool_min_size = pool_min_size
+        self.pool_max_size = pool_max_size
+        self.pool_timeout = pool_timeout
+        self.command_timeout = command_timeout
+        self.fetch_size = fetch_size
+        self.pool_lock = asyncio.Lock()
+        self.insert_plans = {}
         self.client_id = client_id or str(uuid4())
+        self.notification_hub = NotificationHub(self, check_interval=listen_check_interval,
+                                                fetch_batch_size=notify_fetch_batch_size)
         # Generiere eine eindeutige ID für diese Instanz
 
+    @property
+    def asyncpg_dsn(self):
+        """
+        Connection string without SQLAlchemy driver suffix (e.g. 'postgresql+psycopg2://').
+        """
+        return re.sub(r'^(postgres(?:ql)?)\+\w+://', r'\1://', self.connection_string)
+
     async def connect(self):
+        self.connect_sync()
+        if self.use_async:
+            try:
+                await self.ensure_pool()
+            except CONNECTION_ERRORS as e:
+                # Der Pool wird bei der Verbindungsprüfung erneut aufgebaut
+                logger.error(f"Failed to create connection pool: {e}. Client ID: {self.client_id}")
+
+    def connect_sync(self):
+        """
+        Creates the SQLAlchemy engine and session used by the synchronous code paths.
+        """
         self.engine = create_engine(self.connection_string)
         Session = sessionmaker(bind=self.engine)
         self.session = Session()
+
+    async def ensure_pool(self):
+        """
+        Returns the asyncpg connection pool, creating it if necessary.
+        """
+        if self.pool is None:
+            async with self.pool_lock:
+                if self.pool is None:
+                    self.pool = await asyncpg.create_pool(dsn=self.asyncpg_dsn,
+                                                          min_size=self.pool_min_size,
+                                                          max_size=self.pool_max_size,
+                                                          timeout=self.pool_timeout,
+                                                          command_timeout=self.command_timeout)
+                    logger.info(f"Connection pool created (size {self.pool_min_size}-{self.pool_max_size}). "
+                                f"Client ID: {self.client_id}")
+        return self.pool
     async def start_periodic_verification(self, interval=30):
         """
         Starts periodic verification of the database connection.
@@ -46,13 +154,18 @@ class DBClient:
         while self.retry_limit == -1 or attempt < self.retry_limit:
             try:
                 # Versuche, eine einfache Abfrage auszuführen, um die Verbindung zu überprüfen
-                self.session.execute(text("SELECT 1"))
+                if self.use_async:
+                    pool = await self.ensure_pool()
+                    async with pool.acquire(timeout=self.pool_timeout) as conn:
+                        await conn.fetchval("SELECT 1")
+                else:
+                    self.session.execute(text("SELECT 1"))
                 #logger.debug(f"Database connection verified. Client ID: {self.client_id}")
                 return
-            except exc.SQLAlchemyError as e:
+            except CONNECTION_ERRORS as e:
                 logger.error(f"Failed to verify database connection: {e}. Client ID: {self.client_id}")
                 # Führe ein Rollback durch, um sicherzustellen, dass die Transaktion zurückgerollt wird
-                if self.session:
+                if self.session and not self.use_async:
                     self.session.rollback()
                 if self.retry_limit == -1 or attempt < self.retry_limit - 1:
                     logger.info(f"Retrying to connect after {self.retry_interval} seconds... Client ID: {self.client_id}")
@@ -68,80 +181,197 @@ class DBClient:
 
     async def create_trigger(self, trigger_config):
         try:
-            # Erstellen der Trigger-Funktion
-            create_function_sql = text(f"""
-            CREATE OR REPLACE FUNCTION notify_{trigger_config['trigger_name']}()
+            # Erstellen der Trigger-Funktion und des Triggers
+            if trigger_config.get('level') == 'statement':
+                create_function_sql = text(self.statement_notify_function_sql(trigger_config))
+                create_trigger_sql = text(self.statement_trigger_sql(trigger_config))
+            else:
+                create_function_sql = text(self.notify_function_sql(trigger_config))
+                create_trigger_sql = text(self.row_trigger_sql(trigger_config))
+
+            if self.use_async:
+                pool = await self.ensure_pool()
+                async with pool.acquire() as conn:
+                    async with conn.transaction():
+                        await conn.execute(create_function_sql.text)
+                        await conn.execute(create_trigger_sql.text)
+            else:
+                # Ausführen der SQL-Befehle über die SQLAlchemy-Engine
+                with self.engine.begin() as conn:
+                    conn.execute(create_function_sql)
+                    conn.execute(create_trigger_sql)
+            logger.info(f"Trigger {trigger_config['trigger_name']} created on {trigger_config['table']}.")
+
+        except (SQLAlchemyError, asyncpg.PostgresError, ValueError) as e:
+            logger.error(f"Failed to create trigger {trigger_config['trigger_name']} on {trigger_config['table']}: {e}")
+
+    @staticmethod
+    def drop_triggers_sql(trigger_config):
+        """
+        Drops the triggers of both levels, so a trigger can switch between row and statement level.
+        """
+        trigger_name = trigger_config['trigger_name']
+        return "\n            ".join(f"DROP TRIGGER IF EXISTS {trigger_name}{suffix} ON {trigger_config['table']};"
+                         for suffix in ('_trigger', '_insert_trigger', '_update_trigger'))
+
+    @classmethod
+    def row_trigger_sql(cls, trigger_config):
+        trigger_name = trigger_config['trigger_name']
+        return f"""
+            {cls.drop_triggers_sql(trigger_config)}
+            CREATE TRIGGER {trigger_name}_trigger
+            AFTER INSERT OR UPDATE ON {trigger_config['table']}
+            FOR EACH ROW EXECUTE FUNCTION notify_{trigger_name}();
+            """
+
+    @classmethod
+    def statement_trigger_sql(cls, trigger_config):
+        """
+        Transition tables are only allowed for triggers with a single event, hence one trigger per event.
+        """
+        trigger_name = trigger_config['trigger_name']
+        return f"""
+            {cls.drop_triggers_sql(trigger_config)}
+            CREATE TRIGGER {trigger_name}_insert_trigger
+            AFTER INSERT ON {trigger_config['table']}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_{trigger_name}();
+            CREATE TRIGGER {trigger_name}_update_trigger
+            AFTER UPDATE ON {trigger_config['table']}
+            REFERENCING NEW TABLE AS new_rows
+            FOR EACH STATEMENT EXECUTE FUNCTION notify_{trigger_name}();
+            """
+
+    @staticmethod
+    def statement_notify_function_sql(trigger_config):
+        """
+        Builds the function of a statement level trigger ('level': 'statement'). Instead of one notification
+        per row it sends the primary keys of the changed rows matching the condition in chunks of at most
+        'payload_chunk_size' keys; the notification hub fetches the rows with one query per chunk.
+        A chunk is also sent early before its payload would exceed the NOTIFY limit, e.g. with long text keys.
+        The condition is written as for row level triggers, 'NEW.' refers to the rows of the transition table.
+        """
+        trigger_name = trigger_config['trigger_name']
+        primary_key = trigger_config.get('primary_key')
+        if not primary_key:
+            raise ValueError(f"Statement level trigger {trigger_name} requires a 'primary_key'")
+        chunk_size = int(trigger_config.get('payload_chunk_size', 200))
+        # Platz für {"__dc_primary_key" : [...]} und die Trennzeichen
+        max_key_bytes = MAX_NOTIFY_PAYLOAD - len(PRIMARY_KEY_MARKER) - 16
+        condition = re.sub(r'\bNEW\.', 'new_rows.', trigger_config.get('condition') or 'TRUE', flags=re.IGNORECASE)
+        send_chunk = f"PERFORM pg_notify('{trigger_name}', json_build_object('{PRIMARY_KEY_MARKER}', array_to_json(chunk))::text);"
+        return f"""
+            CREATE OR REPLACE FUNCTION notify_{trigger_name}()
             RETURNS TRIGGER AS $$
+            DECLARE
+                row_key json;
+                key_bytes integer;
+                chunk json[] := '{{}}';
+                chunk_bytes integer := 0;
+            BEGIN
+                FOR row_key IN
+                    SELECT to_json(new_rows.{primary_key}) FROM new_rows WHERE ({condition})
+                LOOP
+                    key_bytes := octet_length(row_key::text) + 2;
+                    IF key_bytes > {max_key_bytes} THEN
+                        RAISE WARNING 'Primary key too large for notification on {trigger_name}';
+                        CONTINUE;
+                    END IF;
+                    IF chunk_bytes > 0 AND (cardinality(chunk) >= {chunk_size} OR chunk_bytes + key_bytes > {max_key_bytes}) THEN
+                        {send_chunk}
+                        chunk := '{{}}';
+                        chunk_bytes := 0;
+                    END IF;
+                    chunk := chunk || row_key;
+                    chunk_bytes := chunk_bytes + key_bytes;
+                END LOOP;
+                IF chunk_bytes > 0 THEN
+                    {send_chunk}
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+            """
+
+    @staticmethod
+    def notify_function_sql(trigger_config):
+        """
+        Builds the trigger function sending the changed row. Rows exceeding the NOTIFY payload limit are
+        sent as primary key (trigger option 'primary_key') and fetched by the notification hub;
+        'notify_payload': 'key' always sends the primary key only.
+        """
+        trigger_name = trigger_config['trigger_name']
+        primary_key = trigger_config.get('primary_key')
+        if primary_key:
+            key_payload = f"json_build_object('{PRIMARY_KEY_MARKER}', NEW.{primary_key})::text"
+            if trigger_config.get('notify_payload') == 'key':
+                build_payload = f"payload := {key_payload};"
+            else:
+                build_payload = f"""payload := row_to_json(NEW)::text;
+                    IF octet_length(payload) >= {MAX_NOTIFY_PAYLOAD} THEN
+                        payload := {key_payload};
+                    END IF;"""
+        else:
+            # Ohne Primärschlüssel wird die Zeile übersprungen, statt die schreibende Transaktion abzubrechen
+            build_payload = f"""payload := row_to_json(NEW)::text;
+                    IF octet_length(payload) >= {MAX_NOTIFY_PAYLOAD} THEN
+                        RAISE WARNING 'Row too large for notification on {trigger_name}';
+                        RETURN NEW;
+                    END IF;"""
+        return f"""
+            CREATE OR REPLACE FUNCTION notify_{trigger_name}()
+            RETURNS TRIGGER AS $$
+            DECLARE
+                payload text;
             BEGIN
                 IF ({trigger_config['condition']}) THEN
-                    PERFORM pg_notify('{trigger_config['trigger_name']}', row_to_json(NEW)::text);
+                    {build_payload}
+                    PERFORM pg_notify('{trigger_name}', payload);
                 END IF;
                 RETURN NEW;
             END;
             $$ LANGUAGE plpgsql;
-            """)
-
-            # Erstellen des Triggers
-            create_trigger_sql = text(f"""
-            DROP TRIGGER IF EXISTS {trigger_config['trigger_name']}_trigger ON {trigger_config['table']};
-            CREATE TRIGGER {trigger_config['trigger_name']}_trigger
-            AFTER INSERT OR UPDATE ON {trigger_config['table']}
-            FOR EACH ROW EXECUTE FUNCTION notify_{trigger_config['trigger_name']}();
-            """)
-
-            # Ausführen der SQL-Befehle über die SQLAlchemy-Engine
-            with self.engine.begin() as conn:
-                conn.execute(create_function_sql)
-                conn.execute(create_trigger_sql)
-                logger.info(f"Trigger {trigger_config['trigger_name']} created on {trigger_config['table']}.")
-
-        except SQLAlchemyError as e:
-            logger.error(f"Failed to create trigger {trigger_config['trigger_name']} on {trigger_config['table']}: {e}")
+            """
 
     async def trigger_exists(self, trigger_name, table_name):
+        """
+        Checks for the row level trigger or the statement level triggers of a trigger configuration.
+        """
+        trigger_names = [f"{trigger_name}{suffix}" for suffix in ('_trigger', '_insert_trigger', '_update_trigger')]
+        if self.use_async:
+            pool = await self.ensure_pool()
+            async with pool.acquire() as conn:
+                return await conn.fetchval("""
+                SELECT EXISTS (
+                    SELECT 1
+                    FROM pg_trigger
+                    WHERE NOT tgisinternal
+                    AND tgname = ANY($1::text[])
+                );
+                """, trigger_names)
+
         check_trigger_sql = text(f"""
         SELECT EXISTS (
             SELECT 1
             FROM pg_trigger
             WHERE NOT tgisinternal
-            AND tgname = '{trigger_name}_trigger'
+            AND tgname IN ({', '.join(f"'{name}'" for name in trigger_names)})
         );
         """)
         result = self.session.execute(check_trigger_sql)
         return result.scalar()
 
-    async def listen_to_notifications(self, trigger_name, processing_chain):
+    async def listen_to_notifications(self, trigger_config, processing_chain):
         """
-        Modified to accept a processing_chain parameter and use a dynamically created handler.
+        Subscribes the trigger channel on the shared LISTEN connection of the notification hub, which passes
+        the notifications to the processing chain.
+        The optional field schema (trigger option 'schema') converts the declared fields, e.g. timestamps.
         """
         try:
-            conn = await asyncpg.connect(self.connection_string)
-
-            async def notification_handler(conn, pid, channel, payload):
-                """
-                Handle notifications with access to the processing_chain.
-                """
-                try:
-                    notification_data = json.loads(payload)
-                    logger.info(f"Notification received on channel {channel}: {notification_data}")
-                    # Pass the data to the processing chain
-                    await processing_chain.process_step(notification_data, self.client_id)
-                except json.JSONDecodeError:
-                    logger.error(f"Error decoding JSON from notification on channel {channel}")
-                except Exception as e:
-                    logger.error(f"Error handling notification from {channel}: {e}")
-
-            # Use the custom notification_handler that captures processing_chain
-            await conn.add_listener(trigger_name, notification_handler)
-            logger.info(f"DB Client subscribed to {trigger_name} notifications.")
+            await self.notification_hub.subscribe(trigger_config, processing_chain)
+        except (ValueError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+            logger.error(f"Failed to subscribe to {trigger_config['trigger_name']} notifications: {e}")
 
-            try:
-                await asyncio.Future()  # Run indefinitely until cancelled or an error occurs
-            finally:
-                await conn.close()
-                logger.info("DB connection closed.")
-        except Exception as e:
-            logger.error(f"Failed to establish connection for listening to notifications: {e}")
     async def listen_for_triggers(self, trigger_config, processing_chain):
         if not self.engine:
             logger.info("Engine is not established. Attempting to reconnect and verify.")
@@ -158,19 +388,28 @@ class DBClient:
             logger.info(f"Trigger {trigger_name} already exists. Recreating...")
         await self.create_trigger(trigger_config)
 
-        await self.listen_to_notifications(trigger_name, processing_chain)
+        await self.listen_to_notifications(trigger_config, processing_chain)
 
-    def execute_query(self, query):
+    def execute_query(self, query, *args):
         """
         Executes a SQL query and streams the results.
+
+        The returned stream supports 'async for' (non-blocking, with positional '$1' parameters) as well as
+        plain iteration through the synchronous session for existing scripts.
+        """
+        return QueryStream(self, query, args)
+
+    def execute_query_sync(self, query):
+        """
+        Executes a SQL query through the synchronous SQLAlchemy session and streams the results.
         """
         if not self.session:
-            logger.info("Session is not established. Attempting to reconnect and verify.")
-            self.connect_and_verify()
+            logger.info("Session is not established. Attempting to reconnect.")
+            self.connect_sync()
 
         try:
             # Verwende `yield_per` für Streaming
-            result_proxy = self.session.execute(text(query)).yield_per(100)  # Anpassen nach Bedarf
+            result_proxy = self.session.execute(text(query)).yield_per(self.fetch_size)
             for row in result_proxy:
                 #logger.debug(f"Row data: {row}")
                 try:
@@ -186,35 +425,210 @@ class DBClient:
             self.session.rollback()
             raise
 
-    async def start_polling_query(self, query, polling_interval, processing_chain):
+    async def stream_query(self, query, *args, fetch_size=None):
+        """
+        Streams the rows of a query as dictionaries using a server-side cursor of a pooled connection.
+        Falls back to the synchronous session if the client does not run in asyncpg mode.
+
+        The connection and its transaction stay open until the iteration ends, so the consumer should not
+        wait for slow work (or for another pool connection) between rows; see 'poll_batches'.
+        """
+        if not self.use_async:
+            if args:
+                raise ValueError("Query parameters require the asyncpg engine.")
+            for row in self.execute_query_sync(query):
+                yield row
+            return
+
+        pool = await self.ensure_pool()
+        async with pool.acquire() as conn:
+            # Cursors are only available inside a transaction
+            async with conn.transaction():
+                async for record in conn.cursor(query, *args, prefetch=fetch_size or self.fetch_size):
+                    yield dict(record)
+
+    async def fetch_all(self, query, *args):
+        """
+        Executes a query and returns all rows as a list of dictionaries.
+        """
+        if not self.use_async:
+            return [row async for row in self.stream_query(query, *args)]
+        pool = await self.ensure_pool()
+        async with pool.acquire() as conn:
+            return [dict(record) for record in await conn.fetch(query, *args)]
+
+    async def start_polling_query(self, query, polling_interval, processing_chain, batch_format=None,
+                                  max_rows_per_batch=1000, incremental=None):
+        """
+        Runs the query every polling_interval seconds and passes the results to the processing chain.
+
+        :param batch_format: None passes every row as JSON string (previous behaviour), 'rows' passes
+            up to max_rows_per_batch rows as one list of dictionaries and 'columns' as one ColumnBatch.
+            Batches keep the native Python types of the columns.
+        :param max_rows_per_batch: Maximum number of rows per batch message.
+        :param incremental: Optional IncrementalQuery, which fetches only new or changed rows and records
+            the processed rows after every batch.
+        """
+        poll_duration = POLL_DURATION.labels(self.client_id)
         while True:
+            start = time.perf_counter()
             try:
-                result_stream = self.execute_query(query)
-                for result in result_stream:
-                    # Verwende den angepassten Encoder für die JSON-Serialisierung
-                    json_result = custom_json_dumps(result)
-                    await processing_chain.process_step(json_result, self.client_id)
+                await self.poll_batches(query, processing_chain, batch_format, max_rows_per_batch, incremental)
                 # logger.debug(f"Polling query executed: {query}")
             except Exception as e:
+                POLL_ERRORS.labels(self.client_id).inc()
                 logger.error(f"Failed to execute polling query: {e}")
+            poll_duration.observe(time.perf_counter() - start)
             await asyncio.sleep(polling_interval)
 
-    async def execute_bulk_insert(self, insert_statement, data, batch_size=100):
+    async def poll_batches(self, query, processing_chain, batch_format='rows', max_rows_per_batch=1000,
+                           incremental=None):
+        """
+        Reads the query result in batches and passes them to the processing chain.
+
+        The result is read completely before the chain runs, so the pooled connection and the cursor
+        transaction are released first: slow chains or targets do not keep a transaction open, and DB steps
+        of the chain can use the pool even with 'pool_max_size' 1. The rows of one poll are therefore held
+        in memory; large tables should be polled incrementally.
+        """
+        rows = incremental.rows() if incremental else self.execute_query(query)
+        batches = []
+        batch = []
+        async for row in rows:
+            batch.append(row)
+            if len(batch) >= max_rows_per_batch:
+                batches.append(batch)
+                batch = []
+        if batch:
+            batches.append(batch)
+        for batch in batches:
+            await self.emit_batch(batch, query, processing_chain, batch_format, incremental)
+
+    async def emit_batch(self, rows, query, processing_chain, batch_format='rows', incremental=None):
+        POLLED_ROWS.labels(self.client_id).inc(len(rows))
+        if not batch_format:
+            for row in rows:
+                # Verwende den angepassten Encoder für die JSON-Serialisierung
+                await processing_chain.process_step(custom_json_dumps(row), self.client_id, 'postgres', query)
+        else:
+            message = ColumnBatch.from_rows(rows) if batch_format == 'columns' else rows
+            await processing_chain.process_step(message, self.client_id, 'postgres', query)
+        if incremental:
+            # Zustand erst nach der Verarbeitung sichern (at-least-once)
+            await incremental.commit(rows)
+
+    def get_insert_plan(self, insert_statement, columns=None, table=None):
+        """
+        Returns the cached column layout for a postgres target.
+        """
+        key = (insert_statement, json.dumps(columns, sort_keys=True), table)
+        plan = self.insert_plans.get(key)
+        if plan is None:
+            plan = BulkInsertPlan(insert_statement, columns, table)
+            self.insert_plans[key] = plan
+        return plan
+
+    async def execute_bulk_insert(self, insert_statement, data, batch_size=100, columns=None, table=None,
+                                  insert_mode='copy', copy_format='csv'):
+        """
+        Inserts the records in batches.
+
+        :param columns: Optional mapping of table column to message field (or list of columns) used instead of
+            the column list of the insert statement.
+        :param table: Target table, required if the insert statement cannot be parsed.
+        :param insert_mode: 'copy' uses COPY ... FROM STDIN per batch, 'executemany' one multi-row statement.
+        :param copy_format: 'csv' (values are cast by the server, tolerant to JSON strings) or 'binary'
+            (fastest, requires native Python types matching the column types).
+        :return: Number of records inserted.
+        """
+        start = time.perf_counter()
+        plan = self.get_insert_plan(insert_statement, columns, table)
+        if not self.use_async:
+            inserted = self.execute_bulk_insert_sync(plan, data, batch_size)
+            self.record_insert(start, len(data), inserted)
+            return inserted
+
+        inserted = 0
+        try:
+            pool = await self.ensure_pool()
+            async with pool.acquire() as conn:
+                for i in range(0, len(data), batch_size):
+                    batch_data = data[i:i + batch_size]
+                    try:
+                        if insert_mode == 'copy' and plan.copy_supported:
+                            await self.copy_batch(conn, plan, batch_data, copy_format)
+                        else:
+                            async with conn.transaction():
+                                await conn.executemany(plan.statement, plan.parameters(batch_data))
+                        inserted += len(batch_data)
+                    except (asyncpg.PostgresError, ValueError, TypeError) as e:
+                        logger.warning(f"Batch insert of {len(batch_data)} records failed ({e}). "
+                                       f"Retrying row by row to isolate invalid records.")
+                        inserted += await self.insert_rows_individually(conn, plan, batch_data, insert_mode,
+                                                                        copy_format)
+                    #logger.debug(f"Bulk insert completed for {len(batch_data)} records.")
+        except Exception as e:
+            logger.error(f"Failed to execute bulk insert: {e}")
+        self.record_insert(start, len(data), inserted)
+        return inserted
+
+    def record_insert(self, start, records, inserted):
+        INSERT_DURATION.labels(self.client_id).observe(time.perf_counter() - start)
+        INSERTED_ROWS.labels(self.client_id).inc(inserted)
+        if inserted < records:
+            REJECTED_ROWS.labels(self.client_id).inc(records - inserted)
+
+    async def copy_batch(self, conn, plan, batch_data, copy_format='csv'):
+        if copy_format == 'binary':
+            await conn.copy_records_to_table(plan.table_name, schema_name=plan.schema_name,
+                                             columns=plan.columns, records=plan.copy_records(batch_data))
+        else:
+            await conn.copy_to_table(plan.table_name, schema_name=plan.schema_name, columns=plan.columns,
+                                     source=plan.csv_buffer(batch_data), format='csv', null=CSV_NULL)
+
+    async def insert_rows_individually(self, conn, plan, batch_data, insert_mode='copy', copy_format='csv'):
+        """
+        Fallback for a failed batch: inserts every record on its own and logs the records that fail.
+        """
+        inserted = 0
+        for record in batch_data:
+            try:
+                if insert_mode == 'copy' and plan.copy_supported:
+                    await self.copy_batch(conn, plan, [record], copy_format)
+                else:
+                    await conn.execute(plan.statement, *plan.parameters([record])[0])
+                inserted += 1
+            except (asyncpg.PostgresError, ValueError, TypeError) as e:
+                logger.error(f"Skipping invalid record for {plan.table_name}: {e}. Record: {record}")
+        return inserted
+
+    def execute_bulk_insert_sync(self, plan, data, batch_size=100):
+        inserted = 0
         try:
             # Aufteilen der Daten in Batches
             for i in range(0, len(data), batch_size):
                 batch_data = data[i:i + batch_size]
-                # Bereite eine Liste von Statements vor, die ausgeführt werden sollen
-                statements = [text(insert_statement).bindparams(**record) for record in batch_data]
-                # Ausführen der Statements in einem Batch
-                self.session.execute(text("BEGIN"))  # Starte eine Transaktion, falls nicht automatisch verwaltet
-                for stmt in statements:
-                    self.session.execute(stmt)
-                self.session.commit()  # Commit nach dem Ausführen der Batches
-                #logger.debug(f"Bulk insert completed for {len(batch_data)} records.")
+                try:
+                    # Ein Statement mit allen Parametersätzen des Batches (executemany)
+                    self.session.execute(text(plan.insert_statement), batch_data)
+                    self.session.commit()  # Commit nach dem Ausführen der Batches
+                    inserted += len(batch_data)
+                except SQLAlchemyError as e:
+                    self.session.rollback()
+                    logger.warning(f"Batch insert of {len(batch_data)} records failed ({e}). "
+                                   f"Retrying row by row to isolate invalid records.")
+                    for record in batch_data:
+                        try:
+                            self.session.execute(text(plan.insert_statement), record)
+                            self.session.commit()
+                            inserted += 1
+                        except SQLAlchemyError as row_error:
+                            self.session.rollback()
+                            logger.error(f"Skipping invalid record: {row_error}. Record: {record}")
         except Exception as e:
             logger.error(f"Failed to execute bulk insert: {e}")
             self.session.rollback()  # Rollback im Fehlerfall
+        return inserted
 
     def close(self):
         """
@@ -223,3 +637,14 @@ class DBClient:
         if self.session:
             self.session.close()
             logger.info("Database connection closed.")
+
+    async def close_pool(self):
+        """
+        Closes the LISTEN connection, the asyncpg connection pool and the synchronous session.
+        """
+        await self.notification_hub.close()
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+            logger.info(f"Connection pool closed. Client ID: {self.client_id}")
+        self.close()
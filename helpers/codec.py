@@ -0,0 +1,119 @@
+"""
+JSON codec used for all payloads. Uses orjson if it is installed and the standard library otherwise.
+"""
+import json
+from collections.abc import Mapping
+from datetime import date, datetime, time
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional dependency
+    orjson = None
+
+# orjson.JSONDecodeError is a subclass of json.JSONDecodeError
+JSONDecodeError = json.JSONDecodeError
+
+
+def default(obj):
+    """
+    Serializes the types orjson does not support natively.
+    """
+    if isinstance(obj, (datetime, date, time)):
+        return obj.isoformat()
+    if isinstance(obj, Decimal):
+        # Decimal als String, um Präzisionsverlust zu vermeiden
+        return str(obj)
+    if isinstance(obj, Mapping):
+        # z.B. MessageEnvelope
+        return dict(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(obj):
+    """
+    Encodes an object as JSON bytes.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            # e.g. integers beyond 64 bit, handled by the standard library
+            pass
+    return json.dumps(obj, default=default).encode()
+
+
+def dumps_str(obj):
+    """
+    Encodes an object as JSON string.
+    """
+    return dumps(obj).decode()
+
+
+def loads(data):
+    """
+    Decodes JSON from bytes, bytearray, memoryview or str without any type conversion.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    if isinstance(data, memoryview):
+        data = data.tobytes()
+    return json.loads(data)
+
+
+FIELD_CONVERTERS = {
+    'datetime': datetime.fromisoformat,
+    'date': date.fromisoformat,
+    'time': time.fromisoformat,
+    'decimal': lambda value: Decimal(str(value)),
+    'int': int,
+    'float': float,
+    'str': str,
+}
+
+
+class TypedDecoder:
+    """
+    Decodes JSON and converts only the fields declared in a schema, e.g.
+
+        {"inserttime": "datetime", "data.value": "decimal"}
+
+    A path is split at dots; lists on the way are traversed element by element.
+    Values that cannot be converted are left unchanged.
+    """
+
+    def __init__(self, schema):
+        unknown = {field_type for field_type in schema.values() if field_type not in FIELD_CONVERTERS}
+        if unknown:
+            raise ValueError(f"Unknown field types in schema: {unknown}")
+        self.schema = dict(schema)
+        self.fields = [(path.split('.'), FIELD_CONVERTERS[field_type]) for path, field_type in schema.items()]
+
+    def decode(self, data):
+        return self.apply(loads(data))
+
+    def apply(self, obj):
+        for path, converter in self.fields:
+            self._convert(obj, path, converter)
+        return obj
+
+    def _convert(self, obj, path, converter):
+        if isinstance(obj, list):
+            for item in obj:
+                self._convert(item, path, converter)
+            return
+        if not isinstance(obj, dict):
+            return
+        key = path[0]
+        if key not in obj:
+            return
+        if len(path) > 1:
+            self._convert(obj[key], path[1:], converter)
+            return
+        value = obj[key]
+        if value is None:
+            return
+        try:
+            obj[key] = converter(value)
+        except (TypeError, ValueError, ArithmeticError):
+            pass
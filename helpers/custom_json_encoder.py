@@ -2,6 +2,8 @@ import json
 from datetime import datetime, date, time
 from decimal import Decimal
 
+from helpers import codec
+
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, datetime):
@@ -17,21 +19,13 @@ class CustomJSONEncoder(json.JSONEncoder):
         return super().default(obj)
 
 def custom_json_dumps(data):
-    return json.dumps(data, cls=CustomJSONEncoder)
-
-def custom_json_loads(s):
-    def json_decoder(obj):
-        for key, value in obj.items():
-            try:
-                # Versuche, Strings, die datetime Objekte darstellen könnten, zu parsen
-                obj[key] = datetime.fromisoformat(value)
-            except (TypeError, ValueError):
-                # Versuche, Strings, die Decimal Objekte darstellen könnten, zu parsen
-                if isinstance(value, str):
-                    try:
-                        obj[key] = Decimal(value)
-                    except ValueError:
-                        pass
-        return obj
+    return codec.dumps_str(data)
 
-    return json.loads(s, object_hook=json_decoder)
\ No newline at end of file
+def custom_json_loads(s, schema=None):
+    """
+    Decodes JSON. Only the fields declared in the optional schema (e.g. {"inserttime": "datetime"})
+    are converted; all other values keep their JSON types.
+    """
+    if schema:
+        return codec.TypedDecoder(schema).decode(s)
+    return codec.loads(s)
@@ -0,0 +1,136 @@
+import time
+from collections import OrderedDict
+
+MISSING = object()
+
+
+class LocalCache:
+    """
+    In-process LRU cache with a time-to-live per entry.
+    """
+
+    def __init__(self, max_size=10000, ttl=5.0):
+        """
+        :param max_size: Maximum number of entries; the least recently used entry is evicted first.
+        :param ttl: Time in seconds an entry stays valid. None keeps entries until they are evicted or invalidated.
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        # Schlüssel je Gruppe (z.B. alle Felder eines Redis-Hashs), um Gruppen ohne Vollscan zu invalidieren
+        self.groups = {}
+        # Laufende Lesevorgänge je Schlüssel: [Anzahl, Version, Gruppe], siehe begin_read
+        self.reads = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """
+        Returns the cached value or MISSING. A cached None is a valid value (key does not exist).
+        """
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return MISSING
+        value, expires_at, group = entry
+        if expires_at is not None and expires_at < time.monotonic():
+            self.remove(key)
+            self.misses += 1
+            return MISSING
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key, value, ttl=MISSING, group=None):
+        """
+        :param group: Optional group of the key, see 'invalidate_group'.
+        """
+        self.touch(key)
+        self.store(key, value, ttl, group)
+
+    def store(self, key, value, ttl=MISSING, group=None):
+        ttl = self.ttl if ttl is MISSING else ttl
+        if key in self.entries:
+            self.remove(key)
+        self.entries[key] = (value, time.monotonic() + ttl if ttl is not None else None, group)
+        if group is not None:
+            self.groups.setdefault(group, set()).add(key)
+        while len(self.entries) > self.max_size:
+            self.remove(next(iter(self.entries)))
+            self.evictions += 1
+
+    def remove(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is None:
+            return False
+        group = entry[2]
+        if group is not None:
+            keys = self.groups.get(group)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.groups[group]
+        return True
+
+    def invalidate(self, key):
+        self.touch(key)
+        if self.remove(key):
+            self.invalidations += 1
+
+    def invalidate_group(self, group):
+        """
+        Evicts all keys that were put with the given group.
+        """
+        for key in list(self.groups.get(group, ())):
+            self.invalidate(key)
+        for key, read in self.reads.items():
+            if read[2] == group:
+                read[1] += 1
+
+    def touch(self, key):
+        read = self.reads.get(key)
+        if read is not None:
+            read[1] += 1
+
+    def begin_read(self, key, group=None):
+        """
+        Registers a read of 'key' from the backend and returns its version for 'end_read'.
+        """
+        read = self.reads.get(key)
+        if read is None:
+            read = self.reads[key] = [0, 0, group]
+        read[0] += 1
+        return read[1]
+
+    def end_read(self, key, version, value=MISSING, group=None):
+        """
+        Stores the value read from the backend, unless the key was written or invalidated while the read
+        was in flight: the value may then be older than the one written in between.
+        """
+        read = self.reads[key]
+        read[0] -= 1
+        if not read[0]:
+            del self.reads[key]
+        if value is not MISSING and read[1] == version:
+            self.store(key, value, group=group)
+
+    def clear(self):
+        for read in self.reads.values():
+            read[1] += 1
+        self.invalidations += len(self.entries)
+        self.entries.clear()
+        self.groups.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+from helpers.custom_logging_helper import logger
+from helpers.metrics import Histogram
+from helpers.tracing import received_at
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop_newest')
+
+
+class MessageDispatcher:
+    """
+    Bounded queue with a fixed number of worker coroutines.
+
+    Without ordering all workers share one queue. With ordering every worker owns a queue and a message
+    is assigned by its key (e.g. the MQTT topic), so messages with the same key are handled sequentially
+    and in order while different keys are processed in parallel. The capacity is shared by all queues,
+    so a few busy keys can use all of it.
+    """
+
+    def __init__(self, name, handler, workers=16, queue_size=10000, overflow_policy='block', ordered=False):
+        """
+        :param name: Name used in logs and metrics.
+        :param handler: Coroutine function called with every submitted item.
+        :param workers: Number of worker coroutines.
+        :param queue_size: Total capacity of all queues together.
+        :param overflow_policy: 'block' waits for free space, 'drop_oldest' discards the oldest queued item,
+            'drop_newest' discards the submitted item.
+        :param ordered: Process items with the same key sequentially.
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}', expected one of {OVERFLOW_POLICIES}")
+        self.name = name
+        self.handler = handler
+        self.workers = max(1, workers)
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.ordered = ordered
+        self.queues = []
+        self.capacity = None
+        self.worker_tasks = []
+        self.pickup_age = Histogram()
+        self.submitted = 0
+        self.processed = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def start(self):
+        """
+        Starts the worker coroutines. Calling it again has no effect.
+        """
+        if self.worker_tasks:
+            return
+        # Die Queues selbst sind unbegrenzt, die Semaphore begrenzt die Summe aller Einträge
+        self.capacity = asyncio.Semaphore(max(1, self.queue_size))
+        if self.ordered:
+            self.queues = [asyncio.Queue() for _ in range(self.workers)]
+            self.worker_tasks = [asyncio.create_task(self.worker(queue)) for queue in self.queues]
+        else:
+            queue = asyncio.Queue()
+            self.queues = [queue]
+            self.worker_tasks = [asyncio.create_task(self.worker(queue)) for _ in range(self.workers)]
+        logger.info(f"Dispatcher {self.name} started with {self.workers} workers "
+                    f"(queue size {self.queue_size}, overflow policy '{self.overflow_policy}', ordered: {self.ordered}).")
+
+    async def submit(self, item, key=None):
+        """
+        Queues an item. Depending on the overflow policy this waits for free space or drops an item.
+        """
+        self.start()
+        queue = self.queues[hash(key) % len(self.queues)] if self.ordered else self.queues[0]
+        entry = (time.monotonic(), item)
+        self.submitted += 1
+        if self.capacity.locked() and self.overflow_policy != 'block':
+            self.dropped += 1
+            if self.overflow_policy == 'drop_newest':
+                return False
+            # Der Platz des verworfenen Eintrags wird übernommen, bevorzugt aus der Queue desselben Keys
+            victim = queue if not queue.empty() else max(self.queues, key=lambda q: q.qsize())
+            victim.get_nowait()
+            queue.put_nowait(entry)
+            return True
+        await self.capacity.acquire()
+        queue.put_nowait(entry)
+        return True
+
+    async def worker(self, queue):
+        while True:
+            enqueued_at, item = await queue.get()
+            self.capacity.release()
+            self.pickup_age.observe(time.monotonic() - enqueued_at)
+            token = received_at.set(enqueued_at)
+            try:
+                await self.handler(item)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Dispatcher {self.name}: error while handling message: {e}")
+            finally:
+                received_at.reset(token)
+                self.processed += 1
+
+    async def stop(self):
+        for task in self.worker_tasks:
+            task.cancel()
+        await asyncio.gather(*self.worker_tasks, return_exceptions=True)
+        self.worker_tasks = []
+
+    @property
+    def depth(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    def metrics(self):
+        return {
+            "depth": self.depth,
+            "capacity": self.queue_size,
+            "submitted": self.submitted,
+            "processed": self.processed,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "pickup_age": self.pickup_age.snapshot(),
+        }
@@ -0,0 +1,177 @@
+import bisect
+
+from helpers.custom_logging_helper import logger
+
+DEFAULT_LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """
+    Cumulative bucket histogram, e.g. for latencies in seconds.
+    """
+
+    def __init__(self, buckets=DEFAULT_LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.bucket_counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.bucket_counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def average(self):
+        return self.sum / self.count if self.count else 0.0
+
+    def snapshot(self):
+        """
+        Returns count, sum, max and the cumulative counts per upper bucket bound.
+        """
+        cumulative = []
+        total = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), self.bucket_counts):
+            total += bucket_count
+            cumulative.append((bound, total))
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "max": self.max,
+            "average": self.average,
+            "buckets": cumulative,
+        }
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0.0
+
+    def set(self, value):
+        self.value = value
+
+
+METRIC_TYPES = {'counter': Counter, 'gauge': Gauge, 'histogram': Histogram}
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+class MetricFamily:
+    """
+    Metric with labels. Children are created on first use of a label combination, e.g.
+
+        CHAIN_DURATION.labels('chain1').observe(0.012)
+
+    A callback family collects its values on every scrape from a function returning
+    (label values, value) pairs, e.g. for queue depths.
+    """
+
+    def __init__(self, name, documentation, metric_type, label_names=(), buckets=None, callback=None):
+        self.name = name
+        self.documentation = documentation
+        self.type = metric_type
+        self.label_names = tuple(label_names)
+        self.buckets = buckets
+        self.callback = callback
+        self.children = {}
+
+    def labels(self, *label_values):
+        child = self.children.get(label_values)
+        if child is None:
+            if self.type == 'histogram':
+                child = Histogram(self.buckets or DEFAULT_LATENCY_BUCKETS)
+            else:
+                child = METRIC_TYPES[self.type]()
+            self.children[label_values] = child
+        return child
+
+    def samples(self):
+        if self.callback is None:
+            return list(self.children.items())
+        try:
+            return [(tuple(label_values), value) for label_values, value in self.callback()]
+        except Exception as e:
+            # Ein fehlerhafter Callback darf den Scrape nicht abbrechen
+            logger.error(f"Collecting metric {self.name} failed: {e}")
+            return []
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"]
+        for label_values, sample in self.samples():
+            if self.type == 'histogram':
+                snapshot = sample.snapshot()
+                for bound, count in snapshot['buckets']:
+                    labels = format_labels(self.label_names, label_values, ('le', format_value(bound)))
+                    lines.append(f"{self.name}_bucket{labels} {count}")
+                labels = format_labels(self.label_names, label_values)
+                lines.append(f"{self.name}_sum{labels} {format_value(snapshot['sum'])}")
+                lines.append(f"{self.name}_count{labels} {snapshot['count']}")
+            else:
+                value = sample.value if isinstance(sample, (Counter, Gauge)) else sample
+                lines.append(f"{self.name}{format_labels(self.label_names, label_values)} {format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    Collection of all metrics, rendered in the Prometheus text format.
+    """
+
+    def __init__(self):
+        self.families = {}
+
+    def register(self, name, documentation, metric_type, label_names=(), buckets=None, callback=None):
+        family = self.families.get(name)
+        if family is None:
+            family = MetricFamily(name, documentation, metric_type, label_names, buckets, callback)
+            self.families[name] = family
+        elif callback is not None:
+            family.callback = callback
+        return family
+
+    def counter(self, name, documentation, label_names=()):
+        return self.register(name, documentation, 'counter', label_names)
+
+    def gauge(self, name, documentation, label_names=(), callback=None):
+        return self.register(name, documentation, 'gauge', label_names, callback=callback)
+
+    def histogram(self, name, documentation, label_names=(), buckets=None, callback=None):
+        """
+        :param callback: Optional function returning (label values, Histogram) pairs of histograms
+            maintained elsewhere, e.g. by the message dispatchers.
+        """
+        return self.register(name, documentation, 'histogram', label_names, buckets, callback)
+
+    def render(self):
+        lines = []
+        for family in self.families.values():
+            lines.extend(family.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
@@ -0,0 +1,102 @@
+import asyncio
+import time
+from urllib.parse import parse_qs, urlsplit
+
+from helpers.custom_logging_helper import logger
+from helpers.metrics import REGISTRY
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+HTTP_REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+                409: 'Conflict', 500: 'Internal Server Error'}
+
+LOOP_LAG = REGISTRY.histogram('dc_event_loop_lag_seconds', 'Delay of the event loop in scheduling a timer.',
+                              buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+LOOP_LAG_LAST = REGISTRY.gauge('dc_event_loop_lag_last_seconds', 'Last measured event loop delay.')
+
+
+async def monitor_event_loop_lag(interval=0.5):
+    """
+    Measures how much later than scheduled the event loop wakes up, i.e. how long callbacks block it.
+    """
+    histogram = LOOP_LAG.labels()
+    gauge = LOOP_LAG_LAST.labels()
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        histogram.observe(lag)
+        gauge.set(lag)
+
+
+class MetricsServer:
+    """
+    Minimal HTTP server on the asyncio loop. Serves the metrics registry under /metrics;
+    further GET routes can be added with add_route.
+    """
+
+    def __init__(self, host='0.0.0.0', port=8000, registry=REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self.server = None
+        self.routes = {'/metrics': self.metrics}
+
+    def add_route(self, path, handler):
+        """
+        :param handler: Coroutine function receiving the query parameters and returning
+            (status, content type, body).
+        """
+        self.routes[path] = handler
+
+    async def metrics(self, query):
+        return 200, PROMETHEUS_CONTENT_TYPE, self.registry.render()
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        logger.info(f"Metrics server listening on {self.host}:{self.port}.")
+
+    async def handle_connection(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=10)
+            # Header werden gelesen und verworfen
+            while True:
+                line = await asyncio.wait_for(reader.readline(), timeout=10)
+                if line in (b'\r\n', b'\n', b''):
+                    break
+            status, content_type, body = await self.dispatch(request_line.decode('latin-1'))
+        except (asyncio.TimeoutError, ConnectionError):
+            writer.close()
+            return
+        payload = body.encode() if isinstance(body, str) else body
+        writer.write(f"HTTP/1.1 {status} {HTTP_REASONS.get(status, '')}\r\n"
+                     f"Content-Type: {content_type}\r\n"
+                     f"Content-Length: {len(payload)}\r\n"
+                     f"Connection: close\r\n\r\n".encode() + payload)
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, request_line):
+        parts = request_line.split()
+        if len(parts) < 2:
+            return 400, 'text/plain', 'Bad Request\n'
+        method, target = parts[0], parts[1]
+        if method != 'GET':
+            return 405, 'text/plain', 'Method Not Allowed\n'
+        url = urlsplit(target)
+        handler = self.routes.get(url.path)
+        if handler is None:
+            return 404, 'text/plain', 'Not Found\n'
+        try:
+            return await handler(parse_qs(url.query))
+        except Exception as e:
+            logger.error(f"Error serving {url.path}: {e}")
+            return 500, 'text/plain', f"{e}\n"
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
@@ -0,0 +1,95 @@
+import asyncio
+
+from helpers.custom_logging_helper import logger
+
+
+class MicroBatcher:
+    """
+    Collects single items submitted by concurrent callers into batches and passes each batch to a handler.
+
+    A batch is started when 'max_size' items are collected or the first item waited 'max_wait' seconds.
+    Every caller receives the result of its own item.
+    """
+
+    def __init__(self, name, handler, max_size=100, max_wait=0.005, max_concurrency=None):
+        """
+        :param name: Name of the batcher used in logs.
+        :param handler: Coroutine function receiving a list of items and returning one result per item.
+        :param max_size: Maximum number of items per batch.
+        :param max_wait: Maximum time in seconds an item waits for further items.
+        :param max_concurrency: Maximum number of batches handled at the same time, unlimited if None.
+        """
+        self.name = name
+        self.handler = handler
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.semaphore = asyncio.Semaphore(max_concurrency) if max_concurrency else None
+        self.pending = []
+        self.timer = None
+        self.tasks = set()
+        self.batches = 0
+        self.items = 0
+
+    async def submit(self, item):
+        """
+        Adds an item to the next batch and returns its result.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = asyncio.get_running_loop().call_later(self.max_wait, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        if not self.pending:
+            return
+        batch = self.pending
+        self.pending = []
+        task = asyncio.create_task(self.run(batch))
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def run(self, batch):
+        items = [item for item, _ in batch]
+        try:
+            if self.semaphore is not None:
+                async with self.semaphore:
+                    results = await self.handler(items)
+            else:
+                results = await self.handler(items)
+            if len(results) != len(items):
+                raise ValueError(f"Batch handler of {self.name} returned {len(results)} results "
+                                 f"for {len(items)} items")
+        except Exception as e:
+            logger.error(f"Processing a batch of {len(items)} items in {self.name} failed: {e}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.items += len(items)
+        for (_, future), result in zip(batch, results):
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        """
+        Handles the pending items and waits for all running batches.
+        """
+        self.flush()
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+
+    def metrics(self):
+        return {
+            "pending": len(self.pending),
+            "running_batches": len(self.tasks),
+            "batches": self.batches,
+            "items": self.items,
+            "average_batch_size": self.items / self.batches if self.batches else 0.0,
+        }
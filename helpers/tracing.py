@@ -0,0 +1,191 @@
+import asyncio
+import contextvars
+import cProfile
+import io
+import os
+import pstats
+import random
+import signal
+import time
+
+from helpers.custom_logging_helper import logger
+
+try:
+    import yappi
+except ImportError:
+    yappi = None
+
+# Span der Nachricht, die der aktuelle Task gerade verarbeitet
+current_span = contextvars.ContextVar('dc_current_span', default=None)
+# Zeitpunkt (time.monotonic), zu dem die Nachricht in die Warteschlange des Dispatchers gestellt wurde
+received_at = contextvars.ContextVar('dc_received_at', default=None)
+
+
+def record(name, start):
+    """
+    Records an operation that started at 'start' (time.monotonic) into the span of the current message, if any.
+    """
+    span = current_span.get()
+    if span is not None:
+        span.record(name, start)
+
+
+class Span:
+    """
+    Timings of one message from its receipt until all targets acknowledged it.
+
+    The span stays open while references are held: the chain run holds one, every MQTT publish awaiting
+    the broker holds another one. The tracer is called when the last reference is released.
+    """
+
+    __slots__ = ('tracer', 'source', 'start', 'events', 'references')
+
+    def __init__(self, tracer, source, start):
+        self.tracer = tracer
+        self.source = source
+        self.start = start
+        self.events = []
+        self.references = 1
+
+    def record(self, name, start, end=None):
+        if len(self.events) < self.tracer.max_events:
+            self.events.append((name, start, (end or time.monotonic()) - start))
+
+    def hold(self):
+        self.references += 1
+
+    def release(self):
+        self.references -= 1
+        if not self.references:
+            self.tracer.finish(self)
+
+    def format(self, duration):
+        lines = [f"{self.source}: {duration * 1000:.1f} ms"]
+        for name, start, elapsed in self.events:
+            lines.append(f"  +{(start - self.start) * 1000:8.1f} ms {elapsed * 1000:8.1f} ms  {name}")
+        return '\n'.join(lines)
+
+
+class Tracer:
+    """
+    Opt-in tracer of the rule chains. Every message gets a span while tracing is enabled; the timing breakdown
+    is logged for messages slower than 'slow_threshold_ms' and for a random share 'sample_rate' of all messages.
+    """
+
+    def __init__(self, sample_rate=0.0, slow_threshold_ms=None, max_events=200):
+        """
+        :param sample_rate: Share of messages (0.0 - 1.0) whose breakdown is logged regardless of their duration.
+        :param slow_threshold_ms: Messages taking longer are logged, None disables the threshold.
+        :param max_events: Maximum number of recorded operations per message.
+        """
+        self.sample_rate = sample_rate
+        self.slow_threshold = slow_threshold_ms / 1000 if slow_threshold_ms is not None else None
+        self.max_events = max_events
+        self.traced = 0
+        self.logged = 0
+
+    def start(self, source):
+        """
+        Opens the span of a message and makes it the current span. Returns the span and the context token.
+        """
+        start = received_at.get()
+        now = time.monotonic()
+        span = Span(self, source, start if start is not None else now)
+        if start is not None:
+            span.record('queue_wait', start, now)
+        return span, current_span.set(span)
+
+    def finish(self, span):
+        duration = time.monotonic() - span.start
+        self.traced += 1
+        slow = self.slow_threshold is not None and duration >= self.slow_threshold
+        if slow or (self.sample_rate and random.random() < self.sample_rate):
+            self.logged += 1
+            logger.warning(f"{'Slow' if slow else 'Sampled'} message {span.format(duration)}")
+
+
+class Profiler:
+    """
+    Profiles the event loop thread on demand for a number of seconds with yappi if it is installed,
+    otherwise with cProfile. The statistics are written to 'directory' as .pstats and .txt files.
+    """
+
+    def __init__(self, directory='profiles', default_seconds=30, max_seconds=300, top=40):
+        self.directory = directory
+        self.default_seconds = default_seconds
+        self.max_seconds = max_seconds
+        self.top = top
+        self.task = None
+
+    @property
+    def running(self):
+        return self.task is not None and not self.task.done()
+
+    def start(self, seconds=None):
+        """
+        Starts a profiling run in the background. Returns None if a run is already in progress.
+        """
+        if self.running:
+            logger.warning("A profiling run is already in progress.")
+            return None
+        seconds = min(float(seconds or self.default_seconds), self.max_seconds)
+        self.task = asyncio.create_task(self.run(seconds))
+        return self.task
+
+    async def run(self, seconds):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, time.strftime('profile-%Y%m%d-%H%M%S'))
+        logger.info(f"Profiling the event loop for {seconds} seconds ({'yappi' if yappi else 'cProfile'}).")
+        if yappi is not None:
+            yappi.clear_stats()
+            yappi.set_clock_type('wall')
+            yappi.start()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                yappi.stop()
+            yappi.get_func_stats().save(f"{path}.pstats", type='pstat')
+            yappi.clear_stats()
+        else:
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                await asyncio.sleep(seconds)
+            finally:
+                profile.disable()
+            profile.dump_stats(f"{path}.pstats")
+
+        output = io.StringIO()
+        pstats.Stats(f"{path}.pstats", stream=output).sort_stats('cumulative').print_stats(self.top)
+        summary = output.getvalue()
+        with open(f"{path}.txt", 'w') as file:
+            file.write(summary)
+        logger.info(f"Profile written to {path}.pstats and {path}.txt.")
+        return summary
+
+    def install_signal_handler(self, signal_number=getattr(signal, 'SIGUSR1', None)):
+        """
+        Starts a profiling run of the default duration on the signal (SIGUSR1), where supported.
+        """
+        if signal_number is None:
+            return
+        try:
+            asyncio.get_running_loop().add_signal_handler(signal_number, self.start)
+        except (NotImplementedError, RuntimeError) as e:
+            logger.warning(f"Profiling signal handler not available: {e}")
+            return
+        logger.info(f"Send signal {signal.Signals(signal_number).name} to process {os.getpid()} to profile "
+                    f"the event loop for {self.default_seconds} seconds.")
+
+    async def handle_request(self, query):
+        """
+        Route of the metrics server: /profile?seconds=N profiles for N seconds and returns the summary.
+        """
+        try:
+            seconds = float(query.get('seconds', [self.default_seconds])[0])
+        except ValueError:
+            return 400, 'text/plain', 'Invalid seconds\n'
+        task = self.start(seconds)
+        if task is None:
+            return 409, 'text/plain', 'A profiling run is already in progress\n'
+        return 200, 'text/plain', await task
@@ -0,0 +1,232 @@
+import hashlib
+import json
+import os
+import re
+from datetime import date, datetime
+from decimal import Decimal
+
+from helpers import codec
+from helpers.custom_logging_helper import logger
+
+DEFAULT_STATE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'state', 'polling_state.json')
+# Markierung der Zeilen, die im Hash-Modus mit 'emit_deletes' für gelöschte Schlüssel ausgegeben werden
+DELETED_FIELD = '_deleted'
+
+
+def serialize_watermark(value):
+    """
+    Serializes a watermark together with its type, so it can be bound as query parameter again.
+    """
+    if isinstance(value, datetime):
+        return {"type": "datetime", "value": value.isoformat()}
+    if isinstance(value, date):
+        return {"type": "date", "value": value.isoformat()}
+    if isinstance(value, Decimal):
+        return {"type": "decimal", "value": str(value)}
+    return {"type": "plain", "value": value}
+
+
+def deserialize_watermark(state):
+    if state is None:
+        return None
+    value = state.get("value")
+    if value is None:
+        return None
+    if state.get("type") == "datetime":
+        return datetime.fromisoformat(value)
+    if state.get("type") == "date":
+        return date.fromisoformat(value)
+    if state.get("type") == "decimal":
+        return Decimal(value)
+    return value
+
+
+class PollingStateStore:
+    """
+    Persists the state of incremental polling sources, either in a Redis client or in a local JSON file.
+    """
+
+    def __init__(self, redis_client=None, state_file=DEFAULT_STATE_FILE):
+        self.redis_client = redis_client
+        self.state_file = state_file
+        self.local_state = None
+
+    def _read_file(self):
+        if self.local_state is None:
+            try:
+                with open(self.state_file, 'r') as f:
+                    self.local_state = json.load(f)
+            except FileNotFoundError:
+                self.local_state = {}
+            except (OSError, ValueError) as e:
+                logger.error(f"Cannot read polling state file {self.state_file}: {e}")
+                self.local_state = {}
+        return self.local_state
+
+    def _write_file(self):
+        os.makedirs(os.path.dirname(self.state_file), exist_ok=True)
+        temporary_file = f"{self.state_file}.tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump(self.local_state, f, indent=4)
+        # Atomar ersetzen, damit ein Abbruch keine halbe Datei hinterlässt
+        os.replace(temporary_file, self.state_file)
+
+    async def load_watermark(self, key):
+        if self.redis_client is not None:
+            state = await self.redis_client.get(key)
+            return deserialize_watermark(json.loads(state)) if state else None
+        return deserialize_watermark(self._read_file().get(key))
+
+    async def save_watermark(self, key, value):
+        state = serialize_watermark(value)
+        if self.redis_client is not None:
+            await self.redis_client.set(key, json.dumps(state))
+            return
+        self._read_file()[key] = state
+        self._write_file()
+
+    async def load_row_hashes(self, key):
+        """
+        Row hashes are only persisted in Redis; without Redis client they are kept in memory.
+        """
+        if self.redis_client is None:
+            return {}
+        return await self.redis_client.hgetall(key)
+
+    async def save_row_hashes(self, key, hashes):
+        if self.redis_client is not None and hashes:
+            async with self.redis_client.pipeline() as pipe:
+                pipe.hset(key, mapping=hashes)
+
+    async def delete_row_hashes(self, key, row_keys):
+        if self.redis_client is not None and row_keys:
+            async with self.redis_client.pipeline() as pipe:
+                pipe.hdel(key, *row_keys)
+
+
+class IncrementalQuery:
+    """
+    Fetches only new or changed rows of a polling query.
+
+    'watermark' mode wraps the query and binds the last seen value of a monotonic column (id or timestamp)
+    as parameter. 'hash' mode runs the full query but only emits rows whose content hash changed since
+    the last poll, for tables without monotonic column. Keys missing from a complete scan are forgotten;
+    with 'emit_deletes' a row {key_column: key, '_deleted': True} is emitted for each of them (the key as
+    string, as it is stored).
+    """
+
+    def __init__(self, db_client, query, config, state_store):
+        """
+        :param config: The 'incremental' option of the source: mode, column (watermark mode),
+            key_column and emit_deletes (hash mode), state_key and initial_value.
+        """
+        self.db_client = db_client
+        self.query = query
+        self.mode = config.get('mode', 'watermark')
+        self.column = config.get('column')
+        self.key_column = config.get('key_column', self.column)
+        self.state_store = state_store
+        query_id = hashlib.sha1(query.encode()).hexdigest()[:12]
+        self.state_key = config.get('state_key', f"dc-streaming:polling:{db_client.client_id}:{query_id}")
+        self.watermark = config.get('initial_value')
+        self.row_hashes = {}
+        self.pending_hashes = {}
+        self.emit_deletes = config.get('emit_deletes', False)
+        self.pending_deletes = set()
+        self.loaded = False
+
+        if self.mode not in ('watermark', 'hash'):
+            raise ValueError(f"Unknown incremental polling mode '{self.mode}'")
+        column = self.column if self.mode == 'watermark' else self.key_column
+        if not column or not re.fullmatch(r'\w+', column):
+            raise ValueError(f"Incremental polling mode '{self.mode}' requires a valid column name, got '{column}'")
+
+    async def load_state(self):
+        if self.loaded:
+            return
+        if self.mode == 'watermark':
+            stored = await self.state_store.load_watermark(self.state_key)
+            if stored is not None:
+                self.watermark = stored
+            logger.info(f"Incremental polling of '{self.query}' starts after {self.column} = {self.watermark}.")
+        else:
+            self.row_hashes = await self.state_store.load_row_hashes(self.state_key)
+        self.loaded = True
+
+    def watermark_query(self):
+        query = self.query.strip().rstrip(';')
+        source = f"SELECT * FROM ({query}) AS incremental_source"
+        if self.watermark is None:
+            return f"{source} ORDER BY incremental_source.{self.column}", ()
+        return (f"{source} WHERE incremental_source.{self.column} > $1 "
+                f"ORDER BY incremental_source.{self.column}", (self.watermark,))
+
+    @staticmethod
+    def row_hash(row):
+        return hashlib.blake2b(codec.dumps(row), digest_size=16).hexdigest()
+
+    async def rows(self):
+        """
+        Yields the new or changed rows of the next poll.
+        """
+        await self.load_state()
+        if self.mode == 'watermark':
+            query, args = self.watermark_query()
+            async for row in self.db_client.execute_query(query, *args):
+                yield row
+            return
+
+        self.pending_hashes = {}
+        self.pending_deletes = set()
+        seen = set()
+        async for row in self.db_client.execute_query(self.query):
+            key = str(row.get(self.key_column))
+            seen.add(key)
+            row_hash = self.row_hash(row)
+            if self.row_hashes.get(key) != row_hash:
+                self.pending_hashes[key] = row_hash
+                yield row
+
+        # Nur nach einem vollständigen Durchlauf: Schlüssel, die nicht mehr vorkommen, wurden gelöscht
+        deleted = [key for key in self.row_hashes if key not in seen]
+        if not deleted:
+            return
+        if not self.emit_deletes:
+            await self.forget_rows(deleted)
+            return
+        self.pending_deletes.update(deleted)
+        for key in deleted:
+            yield {self.key_column: key, DELETED_FIELD: True}
+
+    async def commit(self, rows):
+        """
+        Records the rows as processed, after they were passed to the processing chain.
+        """
+        if not rows:
+            return
+        if self.mode == 'watermark':
+            self.watermark = rows[-1].get(self.column)
+            await self.state_store.save_watermark(self.state_key, self.watermark)
+            return
+        committed = {}
+        deleted = []
+        for row in rows:
+            key = str(row.get(self.key_column))
+            if key in self.pending_deletes:
+                self.pending_deletes.discard(key)
+                deleted.append(key)
+            elif key in self.pending_hashes:
+                committed[key] = self.pending_hashes.pop(key)
+        self.row_hashes.update(committed)
+        await self.state_store.save_row_hashes(self.state_key, committed)
+        await self.forget_rows(deleted)
+
+    async def forget_rows(self, keys):
+        """
+        Removes the hashes of deleted rows, so they do not accumulate.
+        """
+        if not keys:
+            return
+        for key in keys:
+            self.row_hashes.pop(key, None)
+        await self.state_store.delete_row_hashes(self.state_key, keys)
@@ -4,6 +4,7 @@
 Entry Point for the dc-streaming Service
 """
 import asyncio
+import signal
 from typing import  Dict
 
 from client_manager import ClientManager
@@ -41,6 +42,21 @@ def map_sources_and_targets_to_chains(configs):
     return source_to_chain_map, target_to_chain_map, unused_sources, unused_targets
 
 
+def install_shutdown_handlers():
+    """
+    Cancels the main task on SIGTERM (e.g. 'docker stop', the process runs as PID 1) and SIGINT,
+    so ClientManager.shutdown flushes the buffered target records before the process exits.
+    """
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signal_number, main_task.cancel)
+        except NotImplementedError:
+            # Unter Windows nicht verfügbar
+            pass
+
+
 async def main():
     logger.info("Validating configurations...")
     chain_config_path = "./configs/chain_config_file.json"
@@ -59,13 +75,17 @@ async def main():
         logger.info("New configurations loaded successfully.")
         specific_configs = extract_specific_configs(new_configs)
         client_manager = ClientManager(specific_configs)
+        install_shutdown_handlers()
         await client_manager.initialize_and_run_clients()
 
 
     else:
         logger.error("Failed to load new configurations.")
 if __name__ == '__main__':
-    asyncio.run(main())
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        logger.info("Shutdown completed.")
 
 
 
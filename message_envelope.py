@@ -0,0 +1,110 @@
+from collections.abc import MutableMapping
+
+from helpers import codec
+
+_NOT_DECODED = object()
+
+
+class MessageEnvelope(MutableMapping):
+    """
+    Incoming MQTT message in the form the chains expect ({'topic': ..., 'data': ...}), which keeps the
+    original payload bytes and decodes them only when a step accesses 'data'.
+
+    As long as no step decoded or modified the message, targets with payload_format 'data' republish
+    the original bytes without any JSON cost. Python scripts receive the envelope as well, so pass-through
+    scripts keep this path; 'copy' returns an envelope, codec.dumps encodes it like its dict (to_dict).
+    """
+
+    __slots__ = ('topic', 'payload', 'decoder', '_data', '_extra', 'mutated')
+
+    def __init__(self, topic, payload, decoder=codec.loads):
+        """
+        :param topic: Topic the message was received on.
+        :param payload: Original payload as bytes or memoryview.
+        :param decoder: Function decoding the payload, e.g. a typed decoder of the source schema.
+        """
+        self.topic = topic
+        self.payload = payload
+        self.decoder = decoder
+        self._data = _NOT_DECODED
+        self._extra = {}
+        self.mutated = False
+
+    @property
+    def data(self):
+        if self._data is _NOT_DECODED:
+            try:
+                self._data = self.decoder(self.payload)
+            except (codec.JSONDecodeError, UnicodeDecodeError):
+                # Falls die Nutzlast kein JSON ist, wird die rohe Zeichenkette verwendet
+                self._data = bytes(self.payload).decode(errors='replace')
+        return self._data
+
+    @property
+    def is_decoded(self):
+        return self._data is not _NOT_DECODED
+
+    @property
+    def untouched(self):
+        """
+        True if the payload was neither decoded nor modified, i.e. the original bytes are still valid.
+        """
+        return not self.mutated and self._data is _NOT_DECODED
+
+    def __getitem__(self, key):
+        if key == 'data':
+            return self.data
+        if key == 'topic':
+            return self.topic
+        return self._extra[key]
+
+    def __setitem__(self, key, value):
+        self.mutated = True
+        if key == 'data':
+            self._data = value
+        elif key == 'topic':
+            self.topic = value
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in ('data', 'topic'):
+            raise KeyError(f"'{key}' cannot be removed from a message envelope")
+        del self._extra[key]
+        self.mutated = True
+
+    def __iter__(self):
+        yield 'topic'
+        yield 'data'
+        yield from self._extra
+
+    def __len__(self):
+        return 2 + len(self._extra)
+
+    def __repr__(self):
+        data = repr(self._data) if self.is_decoded else f"<{len(self.payload)} undecoded bytes>"
+        return f"MessageEnvelope(topic={self.topic!r}, data={data})"
+
+    def copy(self):
+        """
+        Shallow copy like dict.copy. The copy shares the payload, so an untouched copy keeps the original bytes.
+        """
+        envelope = MessageEnvelope(self.topic, self.payload, self.decoder)
+        envelope._data = self._data
+        envelope._extra = dict(self._extra)
+        envelope.mutated = self.mutated
+        return envelope
+
+    def to_dict(self):
+        return {'topic': self.topic, 'data': self.data, **self._extra}
+
+    def encode_data(self):
+        """
+        Returns the payload of the 'data' field: the original bytes if untouched, otherwise the encoded data.
+        """
+        if self.untouched:
+            return self.payload
+        data = self.data
+        if isinstance(data, str):
+            return data.encode()
+        return codec.dumps(data)
@@ -2,10 +2,46 @@ import asyncio
 import aiomqtt
 
 from helpers.custom_logging_helper import logger
+from helpers.message_dispatcher import MessageDispatcher
+from helpers.metrics import REGISTRY
+from publish_queue import PublishQueue
+
+
+MESSAGES_RECEIVED = REGISTRY.counter('dc_mqtt_messages_received_total', 'Messages received from the broker.',
+                                     ('client_id',))
+
+
+def subscription_filter(subscription):
+    """
+    Returns the topic filter and QoS of a subscription given as topic string or as dictionary with
+    'topic', 'qos' and 'shared_group' (MQTT v5 shared subscription '$share/<group>/<topic>').
+    """
+    if isinstance(subscription, str):
+        return subscription, 0
+    topic = subscription['topic']
+    if subscription.get('shared_group'):
+        topic = f"$share/{subscription['shared_group']}/{topic}"
+    return topic, subscription.get('qos', 0)
 
 
 class MQTTClient:
-    def __init__(self, host: str, port: int, client_id: str, username: str = "", password: str = "", topics=None):
+    def __init__(self, host: str, port: int, client_id: str, username: str = "", password: str = "", topics=None,
+                 max_workers: int = 16, queue_size: int = 10000, overflow_policy: str = "block",
+                 ordered_by_topic: bool = False, connections: int = 1, protocol: int = 4,
+                 max_in_flight: int = 100, publish_queue_size: int = 10000, publish_overflow_policy: str = "block"):
+        """
+        :param queue_size: Capacity of the incoming queue. Each connection additionally buffers up to
+            queue_size received messages in aiomqtt; once that buffer is full aiomqtt discards further
+            messages (with a warning), so memory stays bounded while the chains fall behind.
+        :param overflow_policy: Policy of the incoming queue when it is full, see MessageDispatcher.
+            'block' stops reading from the aiomqtt buffer, it cannot slow down the broker itself.
+        :param connections: Number of parallel broker connections. Shared subscriptions are subscribed on
+            every connection, so the broker balances their messages; other topics are spread across them.
+        :param protocol: MQTT protocol version, 5 is required for shared subscriptions on most brokers.
+        :param max_in_flight: Maximum number of outgoing messages awaiting the broker at the same time.
+        :param publish_queue_size: Number of outgoing messages buffered, e.g. while reconnecting.
+        :param publish_overflow_policy: Policy of the outgoing buffer when it is full, see PublishQueue.
+        """
         self.client_id = client_id
         self.hostname = host
         self.port = port
@@ -15,9 +51,30 @@ class MQTTClient:
         self.subscribed_topics = set()
         self.processing_chain = None
         self.is_connected = False
-        self.client = aiomqtt.Client(hostname=host, port=port, client_id=client_id, username=username, password=password)
+        protocol_version = aiomqtt.ProtocolVersion.V5 if protocol == 5 else aiomqtt.ProtocolVersion.V311
+        self.clients = [
+            aiomqtt.Client(hostname=host, port=port,
+                           client_id=client_id if index == 0 else f"{client_id}-{index}",
+                           username=username, password=password, protocol=protocol_version)
+            for index in range(max(1, connections))
+        ]
+        # Veröffentlicht wird über die erste Verbindung
+        self.client = self.clients[0]
+        self.connected = [False] * len(self.clients)
+        self.queue_size = queue_size
+        self.messages_received = MESSAGES_RECEIVED.labels(client_id)
+        # Begrenzte Anzahl paralleler Verarbeitungen statt eines Tasks pro Nachricht
+        self.dispatcher = MessageDispatcher(f"mqtt:{client_id}", self.process_message, workers=max_workers,
+                                            queue_size=queue_size, overflow_policy=overflow_policy,
+                                            ordered=ordered_by_topic)
+        # Ausgehende Nachrichten werden gepuffert und im Fenster von max_in_flight veröffentlicht.
+        # Verbindungsfehler (MqttError) werden unbegrenzt wiederholt, andere Fehler (z.B. ungültige Topics) nicht
+        self.publish_queue = PublishQueue(f"mqtt:{client_id}", self.send_message, max_in_flight=max_in_flight,
+                                          queue_size=publish_queue_size, overflow_policy=publish_overflow_policy,
+                                          connection_errors=(aiomqtt.MqttError, ConnectionError))
         logger.info("Initializing MQTT client...")
-        logger.success(f"MQTT client initialized with Host: {host}, Port: {port}, Client ID: {client_id}")
+        logger.success(f"MQTT client initialized with Host: {host}, Port: {port}, Client ID: {client_id}, "
+                       f"Connections: {len(self.clients)}")
 
     def set_processing_chain(self, processing_chain):
         self.processing_chain = processing_chain
@@ -28,36 +85,100 @@ class MQTTClient:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         return self
 
-    async def subscribe_to_topics(self, topics):
+    def distribute_subscriptions(self, subscriptions):
+        """
+        Assigns the subscriptions to the connections: shared subscriptions to all of them,
+        other topics round robin, so every message is received exactly once.
+        """
+        per_connection = [[] for _ in self.clients]
+        position = 0
+        for subscription in subscriptions:
+            topic_filter, qos = subscription_filter(subscription)
+            if topic_filter.startswith('$share/'):
+                for assigned in per_connection:
+                    assigned.append((topic_filter, qos))
+            else:
+                per_connection[position % len(self.clients)].append((topic_filter, qos))
+                position += 1
+        return per_connection
+
+    async def subscribe_to_topics(self, subscriptions):
+        """
+        Connects all connections and subscribes them to their share of the subscriptions.
+
+        :param subscriptions: Topic strings or dictionaries with 'topic', 'qos' and 'shared_group'.
+        """
+        per_connection = self.distribute_subscriptions(subscriptions)
+        await asyncio.gather(*(self.run_connection(index, topic_filters)
+                               for index, topic_filters in enumerate(per_connection)))
+
+    async def run_connection(self, index, topic_filters):
         interval = 10  # Sekunden für den erneuten Versuch
-        while not self.is_connected:
+        client = self.clients[index]
+        while True:
             try:
-                async with self.client:
-                    logger.success("Connected to MQTT broker!")
-                    self.is_connected = True  # Aktualisiere den Verbindungsstatus
+                async with client:
+                    logger.success(f"Connected to MQTT broker! (connection {index} of {self.client_id})")
+                    self.set_connected(index, True)
 
-                    async with self.client.messages() as messages:
-                        tasks = [asyncio.create_task(self.client.subscribe(topic)) for topic in topics]
-                        logger.info(f"Subscribing to topics: {topics}")
-                        self.subscribed_topics.update(topics)
+                    # Begrenzt den Puffer von aiomqtt, der sonst unbegrenzt wächst, während der Dispatcher blockiert
+                    async with client.messages(queue_maxsize=self.queue_size) as messages:
+                        tasks = [asyncio.create_task(client.subscribe(topic_filter, qos=qos))
+                                 for topic_filter, qos in topic_filters]
+                        logger.info(f"Subscribing connection {index} to topics: {topic_filters}")
+                        self.subscribed_topics.update(topic_filter for topic_filter, _ in topic_filters)
 
                         tasks.append(asyncio.create_task(self.handle_messages(messages)))
                         await asyncio.gather(*tasks)
+                return
 
             except aiomqtt.MqttError as e:
                 logger.danger(f"Failed to connect or lost connection: {e}.")
                 logger.warning(f"Reconnecting in {interval} seconds ...")
-                self.is_connected = False  # Setze den Status zurück, falls ein Fehler auftritt
+                self.set_connected(index, False)  # Setze den Status zurück, falls ein Fehler auftritt
                 await asyncio.sleep(interval)
             except Exception as e:
                 logger.error(f"An error occurred: {str(e)}")
-                self.is_connected = False  # Sicherstellen, dass der Status korrekt zurückgesetzt wird
+                self.set_connected(index, False)  # Sicherstellen, dass der Status korrekt zurückgesetzt wird
                 await asyncio.sleep(interval)
+
+    def set_connected(self, index, connected):
+        self.connected[index] = connected
+        # Der Status der ersten Verbindung bestimmt, ob veröffentlicht werden kann
+        self.is_connected = self.connected[0]
+        self.publish_queue.set_connected(self.is_connected)
+
     async def handle_messages(self, messages):
+        messages_received = self.messages_received
         async for message in messages:
-            asyncio.create_task(self.processing_chain.handle_incoming_message(message, self.client_id))
+            messages_received.inc()
+            await self.dispatcher.submit(message, message.topic.value)
+
+    async def process_message(self, message):
+        await self.processing_chain.handle_incoming_message(message, self.client_id)
+
+    def get_queue_metrics(self):
+        """
+        Returns depth, drop counters and pickup age of the incoming message queue.
+        """
+        return self.dispatcher.metrics()
 
 
-    async def publish_message(self, topic, message):
+    async def publish_message(self, topic, message, qos=0, retain=False, ordered=False):
+        """
+        Queues a message for publishing and returns a future, which is resolved with True once the broker
+        accepted the message or with False if it was dropped. Awaiting the future is optional.
+
+        :param ordered: Do not start the message before the previous message of the topic was accepted.
+        """
+        return await self.publish_queue.put(topic, message, qos, retain, ordered)
+
+    async def send_message(self, topic, message, qos=0, retain=False):
         #logger.debug(f"Publishing message to topic {topic}...")
-        await self.client.publish(topic, message)
+        await self.client.publish(topic, message, qos=qos, retain=retain)
+
+    def get_publish_metrics(self):
+        """
+        Returns depth, in-flight count and latency histograms of the outgoing message queue.
+        """
+        return self.publish_queue.metrics()
@@ -0,0 +1,294 @@
+import asyncio
+import re
+
+import asyncpg
+
+from helpers import codec
+from helpers.custom_logging_helper import logger
+from target_buffer import CoalescingBuffer
+
+# pg_notify lehnt Nutzlasten ab 8000 Bytes ab
+MAX_NOTIFY_PAYLOAD = 8000
+PRIMARY_KEY_MARKER = '__dc_primary_key'
+
+LISTEN_ERRORS = (asyncpg.PostgresError, asyncpg.InterfaceError, OSError, asyncio.TimeoutError)
+
+
+def check_identifier(name, value):
+    """
+    Validates a (schema qualified) identifier taken from the configuration before it is used in SQL.
+    """
+    if not value or not re.fullmatch(r'\w+(\.\w+)?', value):
+        raise ValueError(f"Invalid {name} '{value}'")
+    return value
+
+
+class ChannelSubscription:
+    """
+    A trigger channel of the hub: the processing chain its notifications are passed to and the queue
+    of pending notifications, which are processed in arrival order.
+    """
+
+    def __init__(self, trigger_config, processing_chain):
+        self.name = trigger_config['trigger_name']
+        self.table = trigger_config.get('table')
+        self.primary_key = trigger_config.get('primary_key')
+        self.catch_up_query = trigger_config.get('catch_up_query')
+        schema = trigger_config.get('schema')
+        self.decode = codec.TypedDecoder(schema).decode if schema else codec.loads
+        self.processing_chain = processing_chain
+        self.queue = asyncio.Queue()
+        self.consumer = None
+        self.coalesce = trigger_config.get('coalesce')
+        self.buffer = None
+        # SQL-Typ des Primärschlüssels, wird beim ersten Nachladen ermittelt
+        self.primary_key_type = None
+        if self.coalesce and not self.coalesce.get('key', self.primary_key):
+            raise ValueError(f"Coalescing trigger {self.name} requires a 'key' or 'primary_key'")
+        if self.primary_key:
+            check_identifier('primary key', self.primary_key)
+            check_identifier('table', self.table)
+
+
+class NotificationHub:
+    """
+    Holds one LISTEN connection per DBClient and multiplexes the channels of all trigger sources over it.
+
+    The connection is watched and re-established with exponential backoff; all channels are subscribed
+    again and their optional 'catch_up_query' is run to pick up changes missed while disconnected.
+    Notifications carrying only primary keys (rows too large for NOTIFY) are resolved by fetching the rows
+    in batches.
+    """
+
+    def __init__(self, db_client, reconnect_delay=1, max_reconnect_delay=30, check_interval=10,
+                 fetch_batch_size=500):
+        """
+        :param reconnect_delay: Initial delay in seconds before reconnecting, doubled up to max_reconnect_delay.
+        :param check_interval: Interval in seconds in which the LISTEN connection is checked.
+        :param fetch_batch_size: Maximum number of rows fetched per query for primary key notifications.
+        """
+        self.db_client = db_client
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.check_interval = check_interval
+        self.fetch_batch_size = fetch_batch_size
+        self.channels = {}
+        self.connection = None
+        self.connection_lock = asyncio.Lock()
+        self.run_task = None
+        self.closed = False
+
+    @property
+    def connected(self):
+        return self.connection is not None and not self.connection.is_closed()
+
+    async def subscribe(self, trigger_config, processing_chain):
+        """
+        Registers a trigger channel and starts the hub if necessary.
+        """
+        subscription = ChannelSubscription(trigger_config, processing_chain)
+        if subscription.coalesce:
+            subscription.buffer = CoalescingBuffer(
+                subscription.name,
+                lambda rows, subscription=subscription: self.dispatch(subscription, rows),
+                key=subscription.coalesce.get('key', subscription.primary_key),
+                batch_size=subscription.coalesce.get('max_items', 1000),
+                max_batch_time=subscription.coalesce.get('window_ms', 500) / 1000)
+        previous = self.channels.get(subscription.name)
+        if previous is not None and previous.consumer is not None:
+            previous.consumer.cancel()
+        self.channels[subscription.name] = subscription
+        subscription.consumer = asyncio.create_task(self.consume(subscription))
+
+        if self.connected:
+            await self.listen(subscription)
+        if self.run_task is None:
+            self.run_task = asyncio.create_task(self.run())
+        logger.info(f"DB Client {self.db_client.client_id} subscribed to {subscription.name} notifications.")
+
+    async def listen(self, subscription):
+        # Die LISTEN-Verbindung erlaubt nur eine Operation gleichzeitig
+        async with self.connection_lock:
+            if self.connection is not None:
+                await self.connection.add_listener(subscription.name, self.on_notification)
+
+    def on_notification(self, conn, pid, channel, payload):
+        subscription = self.channels.get(channel)
+        if subscription is not None:
+            subscription.queue.put_nowait(payload)
+
+    async def run(self):
+        delay = self.reconnect_delay
+        reconnect = False
+        while not self.closed:
+            try:
+                self.connection = await asyncpg.connect(self.db_client.asyncpg_dsn,
+                                                        timeout=self.db_client.pool_timeout)
+                lost = asyncio.Event()
+                self.connection.add_termination_listener(lambda conn: lost.set())
+                for subscription in list(self.channels.values()):
+                    await self.listen(subscription)
+                logger.info(f"LISTEN connection established for {len(self.channels)} channels. "
+                            f"Client ID: {self.db_client.client_id}")
+                if reconnect:
+                    for subscription in list(self.channels.values()):
+                        await self.catch_up(subscription)
+                delay = self.reconnect_delay
+                reconnect = True
+                await self.watch(lost)
+            except Exception as e:
+                logger.error(f"LISTEN connection failed: {e}. Client ID: {self.db_client.client_id}")
+            finally:
+                await self.close_connection()
+            if self.closed:
+                break
+            logger.warning(f"Reconnecting LISTEN connection in {delay} seconds. Client ID: {self.db_client.client_id}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def watch(self, lost):
+        """
+        Returns when the connection was terminated, raises if it does not respond anymore.
+        """
+        while not lost.is_set():
+            try:
+                await asyncio.wait_for(lost.wait(), timeout=self.check_interval)
+                return
+            except asyncio.TimeoutError:
+                pass
+            if self.connection.is_closed():
+                return
+            async with self.connection_lock:
+                await self.connection.fetchval('SELECT 1', timeout=self.check_interval)
+
+    async def catch_up(self, subscription):
+        if not subscription.catch_up_query:
+            return
+        try:
+            rows = await self.db_client.fetch_all(subscription.catch_up_query)
+        except Exception as e:
+            logger.error(f"Catch-up query of {subscription.name} failed: {e}")
+            return
+        logger.info(f"Catch-up query of {subscription.name} returned {len(rows)} rows.")
+        for row in rows:
+            subscription.queue.put_nowait(row)
+
+    async def consume(self, subscription):
+        """
+        Processes the notifications of a channel in order. Consecutive primary key notifications are
+        collected and resolved with one query per batch.
+        """
+        while True:
+            items = [await subscription.queue.get()]
+            while not subscription.queue.empty() and len(items) < self.fetch_batch_size:
+                items.append(subscription.queue.get_nowait())
+
+            keys = []
+            for item in items:
+                try:
+                    data = subscription.decode(item) if isinstance(item, str) else item
+                except codec.JSONDecodeError:
+                    logger.error(f"Error decoding JSON from notification on channel {subscription.name}")
+                    continue
+                if isinstance(data, dict) and len(data) == 1 and PRIMARY_KEY_MARKER in data:
+                    key = data[PRIMARY_KEY_MARKER]
+                    keys.extend(key if isinstance(key, list) else [key])
+                    continue
+                if keys:
+                    await self.dispatch_keys(subscription, keys)
+                    keys = []
+                await self.deliver(subscription, [data])
+            if keys:
+                await self.dispatch_keys(subscription, keys)
+
+    async def deliver(self, subscription, rows):
+        """
+        Passes rows to the chain one by one, or to the coalescing buffer which passes them as one list
+        per window (trigger option 'coalesce': {"window_ms", "max_items", "key"}).
+        """
+        if subscription.buffer is not None:
+            await subscription.buffer.add(rows)
+            return
+        for row in rows:
+            await self.dispatch(subscription, row)
+
+    async def dispatch(self, subscription, data):
+        try:
+            await subscription.processing_chain.process_step(data, self.db_client.client_id, 'postgres',
+                                                             subscription.name)
+        except Exception as e:
+            logger.error(f"Error handling notification from {subscription.name}: {e}")
+
+    async def dispatch_keys(self, subscription, keys):
+        if subscription.buffer is not None:
+            # Beim Zusammenfassen genügt jede Zeile einmal
+            keys = list(dict.fromkeys(keys))
+        for start in range(0, len(keys), self.fetch_batch_size):
+            try:
+                payloads = await self.fetch_rows(subscription, keys[start:start + self.fetch_batch_size])
+            except Exception as e:
+                logger.error(f"Failed to fetch rows of {subscription.name} by primary key: {e}")
+                continue
+            await self.deliver(subscription, [subscription.decode(payload) for payload in payloads])
+
+    async def fetch_rows(self, subscription, keys):
+        """
+        Fetches rows by primary key as JSON, in the order of the keys, so they are decoded exactly like
+        rows sent in the notification itself.
+        """
+        if not subscription.primary_key:
+            raise ValueError(f"Trigger {subscription.name} sends primary keys but has no 'primary_key' configured")
+        keys = [str(key) for key in keys]
+        if self.db_client.use_async:
+            pool = await self.db_client.ensure_pool()
+            async with pool.acquire() as conn:
+                return await self.fetch_rows_on(conn, subscription, keys)
+        # Ohne Pool über die LISTEN-Verbindung, die nur eine Abfrage gleichzeitig erlaubt
+        async with self.connection_lock:
+            if not self.connected:
+                raise asyncpg.InterfaceError("LISTEN connection is not established")
+            return await self.fetch_rows_on(self.connection, subscription, keys)
+
+    async def fetch_rows_on(self, conn, subscription, keys):
+        if subscription.primary_key_type is None:
+            subscription.primary_key_type = await self.lookup_primary_key_type(conn, subscription)
+        # Die Schlüssel werden in den Typ der Spalte umgewandelt, damit der Index des Primärschlüssels greift
+        query = (f"SELECT row_to_json(t)::text FROM {subscription.table} AS t "
+                 f"JOIN unnest($1::text[]::{subscription.primary_key_type}[]) WITH ORDINALITY AS k(key, position) "
+                 f"ON t.{subscription.primary_key} = k.key ORDER BY k.position")
+        return [record[0] for record in await conn.fetch(query, keys)]
+
+    @staticmethod
+    async def lookup_primary_key_type(conn, subscription):
+        """
+        Returns the SQL type of the primary key column, e.g. 'bigint' or 'character varying(40)'.
+        """
+        column_type = await conn.fetchval(
+            "SELECT format_type(a.atttypid, a.atttypmod) FROM pg_attribute a "
+            "WHERE a.attrelid = $1::regclass AND a.attname = $2 AND NOT a.attisdropped",
+            subscription.table, subscription.primary_key)
+        if column_type is None:
+            raise ValueError(f"Column {subscription.primary_key} of table {subscription.table} not found")
+        return column_type
+
+    async def close_connection(self):
+        connection, self.connection = self.connection, None
+        if connection is not None and not connection.is_closed():
+            try:
+                await connection.close(timeout=self.check_interval)
+            except LISTEN_ERRORS as e:
+                logger.warning(f"Error closing LISTEN connection: {e}")
+
+    async def close(self):
+        self.closed = True
+        tasks = [subscription.consumer for subscription in self.channels.values() if subscription.consumer]
+        if self.run_task is not None:
+            tasks.append(self.run_task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        for subscription in self.channels.values():
+            if subscription.buffer is not None:
+                await subscription.buffer.close()
+        await self.close_connection()
+        logger.info(f"Notification hub closed. Client ID: {self.db_client.client_id}")
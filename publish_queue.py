@@ -0,0 +1,301 @@
+import asyncio
+import collections
+import time
+
+from helpers.custom_logging_helper import logger
+from helpers.message_dispatcher import OVERFLOW_POLICIES
+from helpers.metrics import Histogram
+
+
+class PublishEntry:
+    __slots__ = ('topic', 'payload', 'qos', 'retain', 'ordered', 'future', 'enqueued_at', 'attempts', 'sequence')
+
+    def __init__(self, topic, payload, qos, retain, ordered, future, sequence):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+        self.ordered = ordered
+        self.future = future
+        self.enqueued_at = time.monotonic()
+        self.attempts = 0
+        self.sequence = sequence
+
+
+class PublishQueue:
+    """
+    Outbound queue of an MQTT client. A drain task pipelines the publishes, so up to 'max_in_flight'
+    messages wait for the broker at the same time instead of one after another.
+
+    While the client is disconnected the messages stay in the bounded buffer and are published after the
+    reconnect; publishes failing on connection errors are retried until they succeed, publishes failing
+    for other reasons at most 'max_attempts' times. Failed publishes give up their in-flight slot and are
+    put back together, in their original order, after 'retry_interval' once the client is connected.
+
+    Messages marked as ordered are not started while a previous message of the same topic is in flight or
+    awaiting its retry, so they reach the broker in order even with QoS 1/2 retries. Such messages wait in a
+    queue of their topic, so messages of other topics are not held up behind them.
+    """
+
+    def __init__(self, name, publish, max_in_flight=100, queue_size=10000, overflow_policy='block',
+                 retry_interval=1.0, max_attempts=5, connection_errors=(ConnectionError,)):
+        """
+        :param name: Name used in logs and metrics.
+        :param publish: Coroutine function (topic, payload, qos, retain) publishing one message.
+        :param max_in_flight: Maximum number of publishes awaiting the broker at the same time.
+        :param queue_size: Maximum number of buffered messages.
+        :param overflow_policy: 'block' waits for free space, 'drop_oldest' discards the oldest buffered
+            message, 'drop_newest' discards the new message.
+        :param retry_interval: Delay in seconds before failed publishes are retried.
+        :param max_attempts: Maximum number of attempts of a message failing with another error than a
+            connection error. Afterwards it is discarded and its future resolved with False.
+        :param connection_errors: Exception types retried without limit, like failures while disconnected.
+        """
+        if overflow_policy not in OVERFLOW_POLICIES:
+            raise ValueError(f"Unknown overflow policy '{overflow_policy}', expected one of {OVERFLOW_POLICIES}")
+        self.name = name
+        self.publish = publish
+        self.max_in_flight = max(1, max_in_flight)
+        self.queue_size = queue_size
+        self.overflow_policy = overflow_policy
+        self.retry_interval = retry_interval
+        self.max_attempts = max(1, max_attempts)
+        self.connection_errors = connection_errors
+        self.entries = collections.deque()
+        # Geordnete Nachrichten, deren Topic gerade belegt ist, je Topic in Eingangsreihenfolge
+        self.waiting = {}
+        self.waiting_count = 0
+        # Fehlgeschlagene Nachrichten bis zum gemeinsamen erneuten Einreihen
+        self.retries = []
+        self.retrying_topics = collections.Counter()
+        self.retry_task = None
+        self.in_flight = set()
+        self.in_flight_topics = collections.Counter()
+        self.connected = asyncio.Event()
+        self.changed = asyncio.Event()
+        self.drain_task = None
+        self.sequence = 0
+        self.latency = Histogram()
+        self.publish_latency = Histogram()
+        self.published = 0
+        self.dropped = 0
+        self.retried = 0
+        self.failed = 0
+
+    def set_connected(self, connected):
+        if connected:
+            self.connected.set()
+        else:
+            self.connected.clear()
+
+    def start(self):
+        if self.drain_task is None:
+            self.drain_task = asyncio.create_task(self.drain())
+
+    async def put(self, topic, payload, qos=0, retain=False, ordered=False):
+        """
+        Buffers a message and returns a future resolved with True once the broker accepted it,
+        or with False if the message was dropped.
+        """
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        self.sequence += 1
+        entry = PublishEntry(topic, payload, qos, retain, ordered, future, self.sequence)
+        if self.depth >= self.queue_size:
+            if self.overflow_policy == 'block':
+                while self.depth >= self.queue_size:
+                    await self.wait_for_change()
+            else:
+                self.dropped += 1
+                if self.overflow_policy == 'drop_newest':
+                    future.set_result(False)
+                    return future
+                self.drop_oldest()
+        self.entries.append(entry)
+        self.notify()
+        return future
+
+    def drop_oldest(self):
+        if self.entries:
+            entry = self.entries.popleft()
+            entry.future.set_result(False)
+            # Falls es die freigegebene Nachricht eines Topics war, rückt die nächste wartende nach
+            self.release_topic(entry.topic)
+            return
+        if self.waiting:
+            # Nur noch wartende geordnete Nachrichten: die älteste davon verwerfen
+            topic = min(self.waiting, key=lambda waiting_topic: self.waiting[waiting_topic][0].sequence)
+            self.waiting[topic].popleft().future.set_result(False)
+            self.waiting_count -= 1
+            if not self.waiting[topic]:
+                del self.waiting[topic]
+            return
+        entry = min(self.retries, key=lambda retry: retry.sequence)
+        self.retries.remove(entry)
+        entry.future.set_result(False)
+        if entry.ordered:
+            self.retrying_topics[entry.topic] -= 1
+            if not self.retrying_topics[entry.topic]:
+                del self.retrying_topics[entry.topic]
+            self.release_topic(entry.topic)
+
+    def notify(self):
+        self.changed.set()
+
+    async def wait_for_change(self):
+        self.changed.clear()
+        await self.changed.wait()
+
+    def topic_busy(self, topic):
+        return self.in_flight_topics[topic] or self.retrying_topics[topic]
+
+    def release_topic(self, topic):
+        """
+        Moves the next waiting ordered message of a topic to the front once the topic is no longer busy.
+        """
+        if self.topic_busy(topic):
+            return
+        waiting = self.waiting.get(topic)
+        if waiting:
+            self.entries.appendleft(waiting.popleft())
+            self.waiting_count -= 1
+            if not waiting:
+                del self.waiting[topic]
+
+    def wait_for_topic(self, entry):
+        waiting = self.waiting.setdefault(entry.topic, collections.deque())
+        if waiting and waiting[-1].sequence > entry.sequence:
+            # Eine bereits freigegebene Nachricht, die erneut warten muss, behält ihren Platz
+            position = next(index for index, other in enumerate(waiting) if other.sequence > entry.sequence)
+            waiting.insert(position, entry)
+        else:
+            waiting.append(entry)
+        self.waiting_count += 1
+
+    def next_entry(self):
+        """
+        Returns the first buffered message that may be started now. Ordered messages of a busy topic are
+        moved to the queue of their topic on the way.
+        """
+        while len(self.in_flight) < self.max_in_flight and self.entries:
+            entry = self.entries.popleft()
+            if entry.ordered and self.topic_busy(entry.topic):
+                # Die vorherige Nachricht desselben Topics ist noch unterwegs
+                self.wait_for_topic(entry)
+                continue
+            return entry
+        return None
+
+    async def drain(self):
+        while True:
+            await self.connected.wait()
+            entry = self.next_entry()
+            if entry is None:
+                await self.wait_for_change()
+                continue
+            task = asyncio.create_task(self.send(entry))
+            self.in_flight.add(task)
+            self.in_flight_topics[entry.topic] += 1
+
+    async def send(self, entry):
+        start = time.monotonic()
+        try:
+            entry.attempts += 1
+            await self.publish(entry.topic, entry.payload, entry.qos, entry.retain)
+        except asyncio.CancelledError:
+            if not entry.future.done():
+                entry.future.set_result(False)
+            raise
+        except Exception as e:
+            connection_error = isinstance(e, self.connection_errors) or not self.connected.is_set()
+            if not connection_error and entry.attempts >= self.max_attempts:
+                # Dauerhafte Fehler dürfen geordnete Topics nicht endlos blockieren
+                self.failed += 1
+                logger.error(f"Publishing to {entry.topic} failed after {entry.attempts} attempts, "
+                             f"discarding the message: {e}")
+                if not entry.future.done():
+                    entry.future.set_result(False)
+                return
+            self.retried += 1
+            logger.warning(f"Publishing to {entry.topic} failed ({e}), retrying in {self.retry_interval} seconds.")
+            self.schedule_retry(entry)
+        else:
+            now = time.monotonic()
+            self.publish_latency.observe(now - start)
+            self.latency.observe(now - entry.enqueued_at)
+            self.published += 1
+            if not entry.future.done():
+                entry.future.set_result(True)
+        finally:
+            # Der Platz im Fenster wird sofort frei, auch wenn die Nachricht auf ihre Wiederholung wartet
+            self.in_flight.discard(asyncio.current_task())
+            self.in_flight_topics[entry.topic] -= 1
+            if not self.in_flight_topics[entry.topic]:
+                del self.in_flight_topics[entry.topic]
+            self.release_topic(entry.topic)
+            self.notify()
+
+    def schedule_retry(self, entry):
+        self.retries.append(entry)
+        if entry.ordered:
+            self.retrying_topics[entry.topic] += 1
+        if self.retry_task is None or self.retry_task.done():
+            self.retry_task = asyncio.create_task(self.requeue_retries())
+
+    async def requeue_retries(self):
+        """
+        Puts all failed messages back at the front in their original order, after 'retry_interval' and once
+        the client is connected.
+        """
+        await asyncio.sleep(self.retry_interval)
+        await self.connected.wait()
+        retries, self.retries = sorted(self.retries, key=lambda entry: entry.sequence), []
+        for entry in retries:
+            if entry.ordered:
+                self.retrying_topics[entry.topic] -= 1
+                if not self.retrying_topics[entry.topic]:
+                    del self.retrying_topics[entry.topic]
+        for entry in retries:
+            self.release_topic(entry.topic)
+        # Vor die freigegebenen wartenden Nachrichten, da die Wiederholungen älter sind
+        self.entries.extendleft(reversed(retries))
+        self.notify()
+
+    async def close(self, timeout=5.0):
+        """
+        Waits up to 'timeout' seconds for the buffered messages, then stops the drain task.
+        """
+        deadline = time.monotonic() + timeout
+        while ((self.depth or self.in_flight) and self.connected.is_set()
+               and time.monotonic() < deadline):
+            await asyncio.sleep(0.05)
+        tasks = list(self.in_flight)
+        for task in (self.drain_task, self.retry_task):
+            if task is not None:
+                tasks.append(task)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        unsent = list(self.entries) + self.retries + [entry for waiting in self.waiting.values() for entry in waiting]
+        if unsent:
+            logger.warning(f"Publish queue {self.name} closed with {len(unsent)} unsent messages.")
+        for entry in unsent:
+            if not entry.future.done():
+                entry.future.set_result(False)
+
+    @property
+    def depth(self):
+        return len(self.entries) + self.waiting_count + len(self.retries)
+
+    def metrics(self):
+        return {
+            "depth": self.depth,
+            "in_flight": len(self.in_flight),
+            "max_in_flight": self.max_in_flight,
+            "published": self.published,
+            "dropped": self.dropped,
+            "retried": self.retried,
+            "failed": self.failed,
+            "latency": self.latency.snapshot(),
+            "publish_latency": self.publish_latency.snapshot(),
+        }
@@ -0,0 +1,36 @@
+class ColumnBatch(dict):
+    """
+    Columnar batch of query results: column name -> list of values, with native Python types.
+
+    Being a dict, it is JSON serializable and can be handed to pandas directly (pd.DataFrame(batch)).
+    """
+
+    @classmethod
+    def from_rows(cls, rows):
+        batch = cls()
+        if not rows:
+            return batch
+        columns = list(rows[0].keys())
+        for column in columns:
+            batch[column] = [row.get(column) for row in rows]
+        return batch
+
+    @property
+    def row_count(self):
+        return len(next(iter(self.values()))) if self else 0
+
+    def rows(self):
+        """
+        Returns the batch as list of dictionaries (e.g. for bulk inserts).
+        """
+        columns = list(self.keys())
+        return [dict(zip(columns, values)) for values in zip(*self.values())]
+
+
+def to_records(message):
+    """
+    Converts a message into the list of records inserted by postgres targets.
+    """
+    if isinstance(message, ColumnBatch):
+        return message.rows()
+    return message if isinstance(message, list) else [message]
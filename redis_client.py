@@ -1,12 +1,35 @@
 import asyncio
+import collections
+import json
+import time
+from contextlib import asynccontextmanager
 
 import redis
-import time
+import redis.asyncio as aioredis
+
+from helpers import tracing
 from helpers.custom_logging_helper import logger
+from helpers.local_cache import LocalCache, MISSING
+
+# Trennzeichen zwischen Hash-Name und Feld im lokalen Cache
+HASH_FIELD_SEPARATOR = '\x1f'
+
+
+def as_response_value(value):
+    """
+    Returns the value as Redis returns it with decode_responses=True (used for write-through caching).
+    """
+    if isinstance(value, (bytes, bytearray)):
+        return value.decode()
+    if isinstance(value, float):
+        return repr(value)
+    return value if isinstance(value, str) else str(value)
 
 class RedisClient:
 
-    def __init__(self, client_id, host='localhost', port=6379, db=0, password=None, max_retries=-1, retry_delay=1, check_interval=10):
+    def __init__(self, client_id, host='localhost', port=6379, db=0, password=None, max_retries=-1, retry_delay=1, check_interval=10,
+                 max_connections=50, max_retry_delay=30, socket_timeout=5, local_cache_size=0, local_cache_ttl=5.0,
+                 local_cache_prefixes=None, invalidation_listener=False):
         """
         Initializes a new instance of the RedisClient.
 
@@ -16,8 +39,15 @@ class RedisClient:
         :param db: The database number. Defaults to 0.
         :param password: The password for authenticating with Redis. Defaults to None.
         :param max_retries: Maximum number of retry attempts to connect. -1 for infinite retries.
-        :param retry_delay: Delay between retry attempts in seconds.
+        :param retry_delay: Initial delay between retry attempts in seconds, doubled after every failed attempt.
         :param check_interval: How often to check the connection in seconds.
+        :param max_connections: Maximum number of connections in the connection pool.
+        :param max_retry_delay: Upper bound for the delay between retry attempts in seconds.
+        :param socket_timeout: Timeout in seconds for connecting and for single commands.
+        :param local_cache_size: Number of entries of the in-process read-through cache for get/hget. 0 disables it.
+        :param local_cache_ttl: Time in seconds a locally cached value is served without asking Redis.
+        :param local_cache_prefixes: Only cache keys (and hash names) starting with one of these prefixes. None caches all.
+        :param invalidation_listener: Evict locally cached keys on keyspace notifications, i.e. on writes by other clients.
         """
         self.client_id = client_id
         self.host = host
@@ -26,105 +56,494 @@ class RedisClient:
         self.password = password
         self.max_retries = max_retries
         self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
         self.check_interval = check_interval
-        self.connection = None
+        self.pool = aioredis.ConnectionPool(host=host, port=port, db=db, password=password, decode_responses=True,
+                                            max_connections=max_connections, socket_timeout=socket_timeout,
+                                            socket_connect_timeout=socket_timeout)
+        self.connection = aioredis.Redis(connection_pool=self.pool)
+        self.is_connected = False
+        # Schreibvorgänge, die ohne await aufgerufen wurden
+        self.pending_writes = set()
+        self.local_cache = LocalCache(local_cache_size, local_cache_ttl) if local_cache_size > 0 else None
+        self.local_cache_prefixes = tuple(local_cache_prefixes) if local_cache_prefixes else None
         self.loop = asyncio.get_event_loop()
-        self.ensure_connection()
-        self.loop.create_task(self.connection_check_loop())
+        self.check_task = self.loop.create_task(self.connection_check_loop())
+        self.listener_task = None
+        # Erwartete Keyspace-Ereignisse eigener Schreibvorgänge je (Key, Ereignis), die nicht invalidieren
+        self.own_events = collections.Counter()
+        self.listener_connection = None
+        if self.local_cache is not None and invalidation_listener:
+            # Eigene Verbindung ohne socket_timeout: eine ruhige Subscription ist kein Fehler. Tote Verbindungen
+            # erkennt der Health-Check (PING alle check_interval Sekunden)
+            self.listener_connection = aioredis.Redis(host=host, port=port, db=db, password=password,
+                                                      decode_responses=True, socket_timeout=None,
+                                                      socket_connect_timeout=socket_timeout,
+                                                      health_check_interval=check_interval)
+            self.listener_task = self.loop.create_task(self.invalidation_listener_loop())
 
     async def connection_check_loop(self):
         """
         Periodically checks the Redis connection and tries to reconnect if necessary.
         """
+        await self.ensure_connection()
         while True:
             await asyncio.sleep(self.check_interval)
-            if not self.connection or not self.ping():
+            if not await self.ping():
+                self.is_connected = False
                 logger.warning(f"Redis client '{self.client_id}': connection lost. Attempting to reconnect.")
-                self.ensure_connection()
+                await self.ensure_connection()
 
-    def ensure_connection(self):
+    async def ensure_connection(self):
         """
-        Ensures that the client is connected to the Redis database, retrying if necessary.
+        Ensures that the client is connected to the Redis database, retrying with exponential backoff
+        without blocking the event loop.
         """
         attempt = 0
+        delay = self.retry_delay
         while self.max_retries == -1 or attempt < self.max_retries:
-            if self.connect():
-                return
-            attempt += 1 if self.max_retries != -1 else 0
-            logger.error(f"Failed to reconnect Redis client '{self.client_id}'. Attempt {attempt} of {self.max_retries if self.max_retries != -1 else 'infinite'}. Retrying in {self.retry_delay} seconds.")
-            time.sleep(self.retry_delay)
-        if self.max_retries != -1:
-            logger.error(f"Could not reconnect Redis client '{self.client_id}' after several attempts.")
+            if await self.connect():
+                return True
+            attempt += 1
+            logger.error(f"Failed to reconnect Redis client '{self.client_id}'. Attempt {attempt} of {self.max_retries if self.max_retries != -1 else 'infinite'}. Retrying in {delay} seconds.")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_retry_delay)
+        logger.error(f"Could not reconnect Redis client '{self.client_id}' after several attempts.")
+        return False
 
-    def connect(self):
+    async def connect(self):
         """
         Attempts to establish a connection to the Redis database.
         """
-        try:
-            self.connection = redis.Redis(host=self.host, port=self.port, db=self.db, password=self.password, decode_responses=True)
-            if self.ping():
-                logger.success(f"Successfully connected Redis client '{self.client_id}'.")
-                return True
-        except redis.exceptions.ConnectionError:
-            logger.error(f"Failed to connect Redis client '{self.client_id}'.")
+        if await self.ping():
+            self.is_connected = True
+            logger.success(f"Successfully connected Redis client '{self.client_id}'.")
+            return True
+        logger.error(f"Failed to connect Redis client '{self.client_id}'.")
         return False
 
-    def ping(self):
+    async def ping(self):
         """
         Checks if the Redis connection is alive.
         """
         try:
-            self.connection.ping()
+            await self.connection.ping()
             return True
-        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError):
+        except (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError, OSError):
             return False
-    def set(self, key, value):
+
+    def schedule(self, coroutine):
         """
-        Sets a value in Redis under a specified key.
+        Runs a write operation as a task. The task can be awaited; if the caller does not await it,
+        the write still completes in the background (compatibility with scripts calling 'set' without 'await').
         """
-        if self.connection:
-            try:
-                self.connection.set(key, value)
-                #logger.debug(f"Value '{value}' was stored under the key '{key}'.")
-            except Exception as e:
-                logger.error(f"Error saving the value: {e}")
-        else:
-            logger.error("Unable to store the value, as connection to Redis is not available.")
+        task = asyncio.ensure_future(coroutine)
+        self.pending_writes.add(task)
+        task.add_done_callback(self.pending_writes.discard)
+        return task
+
+    def set(self, key, value, ex=None):
+        """
+        Sets a value in Redis under a specified key. Returns an awaitable task.
+        """
+        self.cache_put(key, value, ex)
+        events = [(key, 'set'), (key, 'expire')] if ex is not None else [(key, 'set')]
+        self.expect_own_events(events)
+        return self.schedule(self._set(key, value, ex, events))
+
+    async def _set(self, key, value, ex=None, events=()):
+        try:
+            await self.connection.set(key, value, ex=ex)
+            #logger.debug(f"Value '{value}' was stored under the key '{key}'.")
+        except Exception as e:
+            self.forget_own_events(events)
+            # Der Wert wurde vorab in den lokalen Cache geschrieben, aber nie gespeichert
+            self.invalidate(key)
+            logger.error(f"Error saving the value: {e}")
 
     def delete(self, key):
         """
-        Removes a key from Redis.
+        Removes a key from Redis. Returns an awaitable task.
         """
-        if self.connection:
-            try:
-                self.connection.delete(key)
-                #logger.debug(f"Key '{key}' was removed from Redis.")
-            except Exception as e:
-                logger.error(f"Error removing the key '{key}': {e}")
-        else:
-            logger.error("Unable to remove the key, as connection to Redis is not available.")
+        self.invalidate(key)
+        return self.schedule(self._delete(key))
+
+    async def _delete(self, key):
+        try:
+            await self.connection.delete(key)
+            #logger.debug(f"Key '{key}' was removed from Redis.")
+        except Exception as e:
+            logger.error(f"Error removing the key '{key}': {e}")
 
     async def get(self, key):
         """
-        Retrieves a value from Redis by a specified key asynchronously and ensures the method is always awaitable.
+        Retrieves a value from Redis by a specified key asynchronously.
+        Served from the local cache if it is enabled for the key and the cached value is still valid.
         """
-        if not self.connection:
-            logger.error("Unable to retrieve the value, as connection to Redis is not available.")
-            return None
-
+        cacheable = self.is_cacheable(key)
+        if cacheable:
+            value = self.local_cache.get(key)
+            if value is not MISSING:
+                return value
+        start = time.monotonic()
+        # Ein während des Lesens geschriebener Wert darf nicht vom älteren Leseergebnis überschrieben werden
+        version = self.local_cache.begin_read(key) if cacheable else None
+        value = MISSING
         try:
-            value = self.connection.get(key)
-            if value is not None:
-                #logger.debug(f"Value under the key '{key}': {value}")
-                pass
-            else:
-                #logger.debug(f"Key '{key}' does not exist in Redis.")
-                pass
+            value = await self.connection.get(key)
         except Exception as e:
             logger.error(f"Error retrieving the value: {e}")
-            value = None
+        finally:
+            tracing.record(f"redis {self.client_id} get", start)
+            if cacheable:
+                self.local_cache.end_read(key, version, value)
+        return None if value is MISSING else value
+
+    def hset(self, name, key, value):
+        """
+        Sets a field of a Redis hash. Returns an awaitable task.
+        """
+        self.cache_put(f"{name}{HASH_FIELD_SEPARATOR}{key}", value, hash_name=name)
+        self.expect_own_events([(name, 'hset')])
+        return self.schedule(self._hset(name, key, value))
+
+    async def _hset(self, name, key, value):
+        try:
+            await self.connection.hset(name, key, value)
+        except Exception as e:
+            self.forget_own_events([(name, 'hset')])
+            self.invalidate(f"{name}{HASH_FIELD_SEPARATOR}{key}")
+            logger.error(f"Error saving the field '{key}' of hash '{name}': {e}")
+
+    def hdel(self, name, key):
+        """
+        Removes a field from a Redis hash. Returns an awaitable task.
+        """
+        self.invalidate(f"{name}{HASH_FIELD_SEPARATOR}{key}")
+        return self.schedule(self._hdel(name, key))
+
+    async def _hdel(self, name, key):
+        try:
+            await self.connection.hdel(name, key)
+        except Exception as e:
+            logger.error(f"Error removing the field '{key}' of hash '{name}': {e}")
+
+    async def hget(self, name, key):
+        """
+        Retrieves a field of a Redis hash, using the local cache like 'get'.
+        """
+        cache_key = f"{name}{HASH_FIELD_SEPARATOR}{key}"
+        cacheable = self.is_cacheable(name)
+        if cacheable:
+            value = self.local_cache.get(cache_key)
+            if value is not MISSING:
+                return value
+        start = time.monotonic()
+        version = self.local_cache.begin_read(cache_key, group=name) if cacheable else None
+        value = MISSING
+        try:
+            value = await self.connection.hget(name, key)
+        except Exception as e:
+            logger.error(f"Error retrieving the field '{key}' of hash '{name}': {e}")
+        finally:
+            tracing.record(f"redis {self.client_id} hget", start)
+            if cacheable:
+                self.local_cache.end_read(cache_key, version, value, group=name)
+        return None if value is MISSING else value
+
+    async def hgetall(self, name):
+        """
+        Retrieves all fields of a Redis hash, bypassing the local cache.
+        """
+        try:
+            return await self.connection.hgetall(name)
+        except Exception as e:
+            logger.error(f"Error retrieving the hash '{name}': {e}")
+            return {}
+
+    async def mget(self, keys):
+        """
+        Retrieves the values of several keys in one round trip. Missing keys yield None.
+        """
+        keys = list(keys)
+        if not keys:
+            return []
+        start = time.monotonic()
+        try:
+            return await self.connection.mget(keys)
+        except Exception as e:
+            logger.error(f"Error retrieving the values: {e}")
+            return [None] * len(keys)
+        finally:
+            tracing.record(f"redis {self.client_id} mget ({len(keys)} keys)", start)
+
+    async def mset(self, mapping):
+        """
+        Sets several keys in one round trip.
+        """
+        if not mapping:
+            return
+        for key, value in mapping.items():
+            self.cache_put(key, value)
+        events = [(key, 'set') for key in mapping]
+        self.expect_own_events(events)
+        start = time.monotonic()
+        try:
+            await self.connection.mset(mapping)
+        except Exception as e:
+            self.forget_own_events(events)
+            for key in mapping:
+                self.invalidate(key)
+            logger.error(f"Error saving the values: {e}")
+        finally:
+            tracing.record(f"redis {self.client_id} mset ({len(mapping)} keys)", start)
+
+    @asynccontextmanager
+    async def pipeline(self, transaction=False):
+        """
+        Buffers the commands issued on the yielded pipeline and sends them in one round trip on exit:
 
-        # Der Trick hier ist, `asyncio.sleep(0)` zu nutzen, um sicherzustellen,
-        # dass die Methode eine Coroutine bleibt, unabhängig vom Wert von `value`.
-        await asyncio.sleep(0)
-        return value
+            async with redis_client.pipeline() as pipe:
+                pipe.set("a", 1)
+                pipe.set("b", 2)
+        """
+        pipe = self.connection.pipeline(transaction=transaction)
+        try:
+            yield pipe
+            commands = len(pipe)
+            start = time.monotonic()
+            await pipe.execute()
+            tracing.record(f"redis {self.client_id} pipeline ({commands} commands)", start)
+        finally:
+            await pipe.reset()
+
+    async def delete_matching(self, pattern, exclude=(), chunk_size=1000):
+        """
+        Removes all keys matching a pattern (SCAN and UNLINK in chunks, without blocking Redis like KEYS).
+
+        :param exclude: Keys matching the pattern that are kept.
+        :return: Number of removed keys.
+        """
+        removed = 0
+        chunk = []
+        async for key in self.connection.scan_iter(match=pattern, count=chunk_size):
+            if key in exclude:
+                continue
+            chunk.append(key)
+            if len(chunk) >= chunk_size:
+                removed += await self.connection.unlink(*chunk)
+                chunk = []
+        if chunk:
+            removed += await self.connection.unlink(*chunk)
+        self.clear_local_cache()
+        return removed
+
+    async def get_warm_up_checkpoint(self, progress_key):
+        """
+        Returns the checkpoint written by 'warm_up' ({"last_key", "count", "done"}) or None.
+        """
+        checkpoint = await self.get(progress_key)
+        return json.loads(checkpoint) if checkpoint else None
+
+    async def warm_up(self, rows, key, value, hash_name=None, key_prefix='', serializer=None, chunk_size=1000,
+                      progress_key=None, resume_from=None, log_interval=50000):
+        """
+        Streams rows into Redis using pipelined writes of 'chunk_size' entries.
+
+        :param rows: Async or sync iterable of dictionaries, e.g. the stream of DBClient.execute_query.
+        :param key: Field name or function returning the Redis key (or hash field) of a row.
+        :param value: Field name or function returning the value of a row.
+        :param hash_name: Write all rows as fields of this hash (HSET) instead of separate keys (SET).
+        :param key_prefix: Prefix for the keys (SET mode only).
+        :param serializer: Optional function converting the value before writing (e.g. custom_json_dumps).
+        :param chunk_size: Number of rows per pipeline round trip.
+        :param progress_key: Key to store a checkpoint after every chunk. Rows must be ordered by key,
+            so a restarted warm-up can continue after the last written key (see 'get_warm_up_checkpoint').
+        :param resume_from: Checkpoint of an interrupted warm-up; its row count is continued.
+        :param log_interval: Log progress every n rows.
+        :return: Number of rows written (including resumed rows).
+        """
+        get_key = key if callable(key) else (lambda row: row[key])
+        get_value = value if callable(value) else (lambda row: row[value])
+        count = resume_from.get("count", 0) if resume_from else 0
+        last_key = resume_from.get("last_key") if resume_from else None
+        start = time.monotonic()
+        next_log = count + log_interval
+        chunk = {}
+
+        async def write_chunk(done=False):
+            async with self.pipeline() as pipe:
+                if chunk:
+                    if hash_name:
+                        pipe.hset(hash_name, mapping=chunk)
+                    else:
+                        pipe.mset({f"{key_prefix}{chunk_key}": chunk_value for chunk_key, chunk_value in chunk.items()})
+                if progress_key:
+                    pipe.set(progress_key, json.dumps({"last_key": last_key, "count": count, "done": done},
+                                                      default=str))
+
+        async def iterate():
+            if hasattr(rows, '__aiter__'):
+                async for row in rows:
+                    yield row
+            else:
+                for row in rows:
+                    yield row
+
+        async for row in iterate():
+            row_key = get_key(row)
+            row_value = get_value(row)
+            chunk[row_key] = serializer(row_value) if serializer else row_value
+            last_key = row_key
+            count += 1
+            if len(chunk) >= chunk_size:
+                await write_chunk()
+                chunk = {}
+                if count >= next_log:
+                    logger.info(f"Redis client '{self.client_id}': warm-up wrote {count} rows "
+                                f"({count / (time.monotonic() - start):.0f} rows/s).")
+                    next_log = count + log_interval
+        await write_chunk(done=True)
+        if hash_name:
+            self.invalidate_hash(hash_name)
+        elif self.local_cache is not None:
+            self.local_cache.clear()
+        logger.info(f"Redis client '{self.client_id}': warm-up completed with {count} rows "
+                    f"in {time.monotonic() - start:.1f} s.")
+        return count
+
+    def is_cacheable(self, key):
+        if self.local_cache is None:
+            return False
+        return self.local_cache_prefixes is None or key.startswith(self.local_cache_prefixes)
+
+    def cache_put(self, cache_key, value, ex=None, hash_name=None):
+        """
+        Write-through of a value written by this client into the local cache.
+        """
+        if not self.is_cacheable(hash_name if hash_name is not None else cache_key):
+            return
+        ttl = min(ex, self.local_cache.ttl) if ex is not None and self.local_cache.ttl is not None else MISSING
+        self.local_cache.put(cache_key, as_response_value(value), ttl, group=hash_name)
+
+    def invalidate(self, key):
+        """
+        Evicts a key (or a hash field key) from the local cache.
+        """
+        if self.local_cache is not None:
+            self.local_cache.invalidate(key)
+
+    def invalidate_hash(self, name):
+        """
+        Evicts all locally cached fields of a hash.
+        """
+        if self.local_cache is not None:
+            self.local_cache.invalidate_group(name)
+
+    def expect_own_events(self, events):
+        """
+        Registers the keyspace events a write of this client will cause. The local cache already holds the
+        written value (write-through), so the invalidation listener skips these events instead of evicting
+        e.g. the whole cached hash on every own 'hset'. Deletes are not registered, they may cause no event.
+        """
+        if self.listener_task is None:
+            return
+        for key, event in events:
+            if self.is_cacheable(key):
+                self.own_events[(key, event)] += 1
+
+    def forget_own_events(self, events):
+        for event in events:
+            if self.own_events[event] > 0:
+                self.own_events[event] -= 1
+            if not self.own_events[event]:
+                del self.own_events[event]
+
+    def is_own_event(self, key, event):
+        """
+        Consumes an expected event of an own write. Events of other clients to the same key in between only
+        shift which of the events is skipped, every change still causes at least one invalidation afterwards.
+        """
+        own_event = (key, event)
+        if own_event not in self.own_events:
+            return False
+        self.forget_own_events([own_event])
+        return True
+
+    def clear_local_cache(self):
+        if self.local_cache is not None:
+            self.local_cache.clear()
+
+    def get_cache_stats(self):
+        """
+        Returns hit/miss statistics of the local cache.
+        """
+        return self.local_cache.stats() if self.local_cache is not None else {}
+
+    async def enable_keyspace_events(self):
+        """
+        Makes sure Redis publishes generic, string and hash keyspace events (keeps already configured flags).
+        """
+        try:
+            config = await self.connection.config_get('notify-keyspace-events')
+            flags = config.get('notify-keyspace-events', '')
+            # 'A' ist ein Alias für alle Ereignisklassen
+            required = 'K' if 'A' in flags else 'Kg$hx'
+            missing = ''.join(flag for flag in required if flag not in flags)
+            if missing:
+                await self.connection.config_set('notify-keyspace-events', flags + missing)
+        except redis.exceptions.ResponseError as e:
+            # z.B. bei gemanagten Instanzen, in denen CONFIG gesperrt ist
+            logger.warning(f"Redis client '{self.client_id}': cannot configure keyspace notifications: {e}")
+
+    async def invalidation_listener_loop(self):
+        """
+        Subscribes to keyspace notifications and evicts changed keys from the local cache.
+        After a lost subscription the whole local cache is cleared, since events may have been missed.
+        """
+        channel_prefix = f"__keyspace@{self.db}__:"
+        delay = self.retry_delay
+        while True:
+            pubsub = self.listener_connection.pubsub()
+            try:
+                await self.enable_keyspace_events()
+                await pubsub.psubscribe(f"{channel_prefix}*")
+                self.clear_local_cache()
+                self.own_events.clear()
+                delay = self.retry_delay
+                logger.info(f"Redis client '{self.client_id}': listening for keyspace notifications.")
+                while True:
+                    # Wartet höchstens check_interval, damit der Health-Check regelmäßig läuft
+                    message = await pubsub.get_message(timeout=self.check_interval)
+                    if message is None or message['type'] != 'pmessage':
+                        continue
+                    key = message['channel'][len(channel_prefix):]
+                    if self.is_own_event(key, message['data']):
+                        continue
+                    self.invalidate(key)
+                    self.invalidate_hash(key)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Redis client '{self.client_id}': keyspace listener failed: {e}. "
+                             f"Retrying in {delay} seconds.")
+                self.clear_local_cache()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.max_retry_delay)
+            finally:
+                await pubsub.aclose()
+
+    async def close(self):
+        """
+        Waits for pending writes and closes the connection pool.
+        """
+        self.check_task.cancel()
+        if self.listener_task is not None:
+            self.listener_task.cancel()
+        if self.pending_writes:
+            await asyncio.gather(*self.pending_writes, return_exceptions=True)
+        await self.connection.aclose()
+        await self.pool.disconnect()
+        if self.listener_connection is not None:
+            await self.listener_connection.aclose()
+        logger.info(f"Redis client '{self.client_id}' closed.")
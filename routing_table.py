@@ -0,0 +1,149 @@
+import json
+from typing import Dict, List, Optional, Tuple
+
+
+class TopicTrie:
+    """
+    Trie of MQTT topic filters. Supports the single level wildcard '+' and the multi level wildcard '#'.
+    Matching a concrete topic costs O(depth) instead of comparing against every configured filter.
+    """
+
+    class Node:
+        __slots__ = ('children', 'values', 'multi_level_values')
+
+        def __init__(self):
+            self.children = {}
+            self.values = set()
+            self.multi_level_values = set()
+
+    def __init__(self):
+        self.root = TopicTrie.Node()
+
+    def insert(self, topic_filter: str, value) -> None:
+        node = self.root
+        for level in topic_filter.split('/'):
+            if level == '#':
+                node.multi_level_values.add(value)
+                return
+            node = node.children.setdefault(level, TopicTrie.Node())
+        node.values.add(value)
+
+    def match(self, topic: str) -> set:
+        levels = topic.split('/')
+        result = set()
+        # Topics beginning with '$' are not matched by wildcards on the first level (MQTT spec)
+        self._match(self.root, levels, 0, result, topic.startswith('$'))
+        return result
+
+    def _match(self, node, levels, index, result, system_topic):
+        wildcards_allowed = not (system_topic and index == 0)
+        if wildcards_allowed:
+            # '#' also matches the parent level ("a/#" matches "a")
+            result.update(node.multi_level_values)
+        if index == len(levels):
+            result.update(node.values)
+            return
+        child = node.children.get(levels[index])
+        if child is not None:
+            self._match(child, levels, index + 1, result, system_topic)
+        if wildcards_allowed:
+            child = node.children.get('+')
+            if child is not None:
+                self._match(child, levels, index + 1, result, system_topic)
+
+
+class RoutingTable:
+    """
+    Routing index built once from 'data_processing_chains'.
+
+    Chains are registered under (client_type, client_id) and the subscribed key of the source:
+    the topic filter for MQTT sources, the trigger name and the polling query for postgres sources.
+    """
+
+    def __init__(self, chains_config, topic_cache_size=10000):
+        self.chain_order = {}
+        self.exact_routes: Dict[Tuple[str, str, str], set] = {}
+        self.topic_tries: Dict[str, TopicTrie] = {}
+        self.client_routes: Dict[Tuple[str, str], set] = {}
+        self.client_id_routes: Dict[str, set] = {}
+        self.topic_cache: Dict[Tuple[str, str], List[str]] = {}
+        self.topic_cache_size = topic_cache_size
+        # Typisierte Dekodierung: Schema-Schlüssel je Topic-Filter
+        self.schema_tries: Dict[str, TopicTrie] = {}
+        self.schemas: Dict[str, dict] = {}
+        self.schema_cache: Dict[Tuple[str, str], Optional[dict]] = {}
+        self.build(chains_config)
+
+    def build(self, chains_config) -> None:
+        for position, chain in enumerate(chains_config):
+            chain_id = chain['id']
+            self.chain_order.setdefault(chain_id, position)
+            for source in chain.get('sources', []):
+                client_type = source.get('client_type')
+                client_id = source['client_id']
+                self.client_routes.setdefault((client_type, client_id), set()).add(chain_id)
+                self.client_id_routes.setdefault(client_id, set()).add(chain_id)
+
+                if client_type == 'mqtt' and source.get('topic'):
+                    trie = self.topic_tries.setdefault(client_id, TopicTrie())
+                    trie.insert(source['topic'], chain_id)
+                    if source.get('schema'):
+                        schema_key = json.dumps(source['schema'], sort_keys=True)
+                        self.schemas[schema_key] = source['schema']
+                        self.schema_tries.setdefault(client_id, TopicTrie()).insert(source['topic'], schema_key)
+                elif client_type == 'postgres':
+                    for trigger in source.get('triggers', []):
+                        self._add_exact(client_type, client_id, trigger['trigger_name'], chain_id)
+                    if source.get('query'):
+                        self._add_exact(client_type, client_id, source['query'], chain_id)
+
+    def _add_exact(self, client_type, client_id, key, chain_id):
+        self.exact_routes.setdefault((client_type, client_id, key), set()).add(chain_id)
+
+    def _ordered(self, chain_ids) -> List[str]:
+        return sorted(chain_ids, key=self.chain_order.__getitem__)
+
+    def lookup(self, client_id: str, client_type: Optional[str] = None, key: Optional[str] = None) -> List[str]:
+        """
+        Returns the IDs of all chains subscribed to a message, in configuration order.
+
+        Without a key all chains of the client are returned, without a client type the client ID is
+        matched across all client types.
+        """
+        if client_type is None:
+            return self._ordered(self.client_id_routes.get(client_id, ()))
+        if key is None:
+            return self._ordered(self.client_routes.get((client_type, client_id), ()))
+        if client_type == 'mqtt':
+            return self.lookup_topic(client_id, key)
+        return self._ordered(self.exact_routes.get((client_type, client_id, key), ()))
+
+    def lookup_topic(self, client_id: str, topic: str) -> List[str]:
+        cache_key = (client_id, topic)
+        cached = self.topic_cache.get(cache_key)
+        if cached is not None:
+            return cached
+        trie = self.topic_tries.get(client_id)
+        chain_ids = self._ordered(trie.match(topic)) if trie else []
+        if len(self.topic_cache) >= self.topic_cache_size:
+            # Einfache Begrenzung: Cache leeren statt LRU-Buchhaltung im Hot Path
+            self.topic_cache.clear()
+        self.topic_cache[cache_key] = chain_ids
+        return chain_ids
+
+    def lookup_schema(self, client_id: str, topic: str) -> Optional[dict]:
+        """
+        Returns the merged field schema of all MQTT sources matching the topic, or None.
+        """
+        cache_key = (client_id, topic)
+        if cache_key in self.schema_cache:
+            return self.schema_cache[cache_key]
+        trie = self.schema_tries.get(client_id)
+        schema = None
+        if trie:
+            for schema_key in sorted(trie.match(topic)):
+                schema = {**(schema or {}), **self.schemas[schema_key]}
+        if len(self.schema_cache) >= self.topic_cache_size:
+            self.schema_cache.clear()
+        self.schema_cache[cache_key] = schema
+        return schema
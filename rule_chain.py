@@ -1,62 +1,201 @@
 import asyncio
-import json
 import os
-import importlib.util
 import time
-from typing import List
+from collections.abc import Mapping
+from typing import List, Optional
 
+from helpers import codec
 from helpers.custom_logging_helper import logger
+from helpers.metrics import REGISTRY
+from helpers.tracing import current_span
+from message_envelope import MessageEnvelope
+from record_batch import to_records
+from routing_table import RoutingTable
+from helpers.micro_batcher import MicroBatcher
+from script_executor import EXECUTORS, ProcessScriptExecutor, ThreadScriptExecutor, run_script_batch
+from script_registry import ScriptRegistry
+from target_buffer import TargetBuffer
+from transforms import DROP, compile_transforms
 
 # Ermitteln des Basisverzeichnisses des Projekts
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
 python_interpreter = os.getenv('PYTHON_INTERPRETER_PATH', 'python3')  # Standardmäßig 'python3', falls nicht definiert
 
-
+PAYLOAD_ENCODERS = {
+    'json': codec.dumps,
+    # Früherer Name des Encoders mit datetime/Decimal-Unterstützung, die 'json' inzwischen ebenfalls hat
+    'custom_json': codec.dumps,
+}
+
+
+def encode_payload(message, encoding='json', payload_format='envelope'):
+    """
+    Encodes a message once for publishing. Strings and bytes are published as they are.
+
+    With payload_format 'data' only the 'data' field of a message is published; if no step
+    decoded or modified a message envelope, its original payload bytes are republished unchanged.
+    """
+    if isinstance(message, MessageEnvelope):
+        if payload_format == 'data':
+            return message.encode_data()
+        message = message.to_dict()
+    elif payload_format == 'data' and isinstance(message, Mapping) and 'data' in message:
+        message = message['data']
+    if isinstance(message, (bytes, bytearray, memoryview)):
+        return message
+    if isinstance(message, str):
+        return message.encode()
+    encoder = PAYLOAD_ENCODERS.get(encoding)
+    if encoder is None:
+        raise ValueError(f"Unknown payload encoding '{encoding}'")
+    return encoder(message)
+
+
+def copy_message(message):
+    """
+    Shallow copy of a message passed to one of several chains, so a step changing the top level of its input
+    in place does not affect the other chains. Nested values are shared and must not be changed in place.
+    """
+    if isinstance(message, (dict, list, MessageEnvelope)):
+        return message.copy()
+    return message
+
+
+MESSAGES_TOTAL = REGISTRY.counter('dc_messages_total', 'Messages passed to the rule chains.',
+                                  ('client_id', 'client_type'))
+CHAIN_RUNS = REGISTRY.counter('dc_chain_runs_total', 'Chain runs by result (forwarded, dropped, error).',
+                              ('chain', 'result'))
+CHAIN_DURATION = REGISTRY.histogram('dc_chain_duration_seconds', 'Duration of a chain run including its targets.',
+                                    ('chain',))
+STEP_DURATION = REGISTRY.histogram('dc_step_duration_seconds', 'Duration of a processing step.',
+                                   ('chain', 'step', 'type'))
+SCRIPT_ERRORS = REGISTRY.counter('dc_script_errors_total', 'Failed executions of Python scripts.', ('script',))
+TARGET_DURATION = REGISTRY.histogram('dc_target_duration_seconds', 'Duration of forwarding a message to a target.',
+                                     ('chain', 'target', 'client_id'))
+TARGET_MESSAGES = REGISTRY.counter('dc_target_messages_total', 'Messages forwarded to targets by result.',
+                                   ('chain', 'target', 'client_id', 'result'))
 
 
 class RuleChain:
-    def __init__(self, chains_config, targets=None, mqtt_clients=None, db_clients=None, redis_clients=None):
+    def __init__(self, chains_config, targets=None, mqtt_clients=None, db_clients=None, redis_clients=None,
+                 client_configs=None, tracer=None):
         self.targets = targets if targets is not None else []
         self.chain = []
         self.mqtt_clients = mqtt_clients if mqtt_clients is not None else {}
         self.db_clients = db_clients if db_clients is not None else {}
         self.redis_clients = redis_clients if redis_clients is not None else {}
+        # Client-Konfigurationen je ID als (client_type, config), um Clients in Worker-Prozessen neu zu erzeugen
+        self.client_configs = client_configs if client_configs is not None else {}
         self.chains_config = chains_config
+        # Optionaler Tracer (helpers.tracing.Tracer) für Zeitaufschlüsselungen langsamer Nachrichten
+        self.tracer = tracer
+        self.chains_by_id = {chain['id']: chain for chain in chains_config}
+        self.routing_table = RoutingTable(chains_config)
         self.last_query_time = {}
+        self.target_buffers = {}
+        self.payload_decoders = {}
+        self.script_registry = ScriptRegistry(os.path.join(script_dir, 'configs', 'external-scripts'))
+        self.script_executors = {}
+        self.step_batchers = {}
+        self.transforms = compile_transforms(chains_config)
+
 
 
+    async def initialize_transforms(self):
+        """
+        Loads the data of declarative steps, e.g. the cached tables of lookup steps.
+        """
+        for transform in self.transforms.values():
+            await transform.start(self.db_clients)
 
     async def initialize_external_scripts(self):
         for chain in self.chains_config:
             for step in chain.get('processing_steps', []):
                 if step['type'] == 'python_script':
                     client_access = step.get('client_access', {})
-                    await self.initialize_python_script(step['script_path'], client_access)
-
-    async def initialize_python_script(self, script_path, client_access):
-        full_script_path = os.path.join(script_dir, 'configs', 'external-scripts', script_path)
+                    if step.get('executor') == 'process':
+                        await self.start_process_executor(step)
+                        continue
+                    await self.initialize_python_script(step['script_path'], client_access,
+                                                        step.get('reload_on_change', False),
+                                                        step.get('init_timeout', 10))
+
+    async def initialize_python_script(self, script_path, client_access, reload_on_change=False, init_timeout=10):
         try:
-            spec = importlib.util.spec_from_file_location("external_module", full_script_path)
-            external_module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(external_module)
-
-            clients = self.prepare_clients_for_script(client_access)
-
-            if hasattr(external_module, 'initialize'):
-                logger.info(f"Initialization of script {script_path}...")
-                # Set a timeout for the initialization
-                timeout = 10  # 10 seconds
-                if asyncio.iscoroutinefunction(external_module.initialize):
-                    await asyncio.wait_for(external_module.initialize(clients), timeout)
-                else:
-                    external_module.initialize(clients)
-
+            entry = self.script_registry.load(script_path, watch=reload_on_change)
+            entry.init_timeout = init_timeout
+            await self.run_script_initialize(entry, client_access)
+        except FileNotFoundError:
+            logger.error(f"The script {script_path} was not found at {self.script_registry.full_path_for(script_path)}.")
         except asyncio.TimeoutError:
             logger.error(f"Initialization of script {script_path} timed out.")
         except Exception as e:
             logger.error(f"Error initializing Python script {script_path}: {str(e)}")
 
+    async def start_process_executor(self, step):
+        """
+        Starts the worker processes of a step with 'executor': 'process'. If the script splits its
+        initialization (see script_executor.worker_initializer), its 'initialize' runs once here.
+        """
+        script_path = step['script_path']
+        if step.get('reload_on_change'):
+            logger.error(f"'reload_on_change' is not supported with 'executor': 'process', the workers keep "
+                         f"the loaded version of script {script_path}.")
+        try:
+            entry = self.script_registry.load(script_path)
+            if hasattr(entry.module, 'worker_initialize'):
+                entry.init_timeout = step.get('init_timeout', 10)
+                await self.run_script_initialize(entry, step.get('client_access', []))
+        except asyncio.TimeoutError:
+            logger.error(f"Initialization of script {script_path} timed out.")
+        except Exception as e:
+            logger.error(f"Error initializing Python script {script_path}: {e}")
+        try:
+            await self.get_script_executor(step).start()
+        except Exception as e:
+            logger.error(f"Error starting process workers for script {step['script_path']}: {e}")
+
+    def get_script_executor(self, step):
+        """
+        Returns the executor of a script step (step option 'executor': 'thread' or 'process'), created on first use.
+        """
+        script_path = step['script_path']
+        executor_type = step.get('executor', 'inline')
+        executor = self.script_executors.get((script_path, executor_type))
+        if executor is None:
+            if executor_type == 'process':
+                executor = ProcessScriptExecutor(script_path, self.script_registry.base_dir,
+                                                 step.get('client_access', []), self.client_configs,
+                                                 workers=step.get('workers'),
+                                                 batch_size=step.get('batch', {}).get(
+                                                     'max_size', step.get('executor_batch_size', 10)),
+                                                 max_wait_ms=step.get('batch', {}).get(
+                                                     'max_wait_ms', step.get('executor_max_wait_ms', 5)),
+                                                 init_timeout=step.get('init_timeout', 10))
+            else:
+                executor = ThreadScriptExecutor(script_path, workers=step.get('workers'))
+            self.script_executors[(script_path, executor_type)] = executor
+        return executor
+
+    async def run_script_initialize(self, entry, client_access):
+        """
+        Runs the optional 'initialize' function of a loaded script once per loaded module version.
+        """
+        if entry.initialized:
+            return
+        # Mark before awaiting, so concurrent messages do not start a second initialization
+        entry.initialized = True
+        external_module = entry.module
+        if hasattr(external_module, 'initialize'):
+            clients = self.prepare_clients_for_script(client_access)
+            logger.info(f"Initialization of script {entry.script_path}...")
+            # Set a timeout for the initialization (step option 'init_timeout', 10 seconds by default)
+            if asyncio.iscoroutinefunction(external_module.initialize):
+                await asyncio.wait_for(external_module.initialize(clients), entry.init_timeout)
+            else:
+                external_module.initialize(clients)
+
     def get_last_update_time(self, db_id, query):
         logger.info("get_last_update_time", query, db_id)
         # Implementiere eine Methode, um den Zeitstempel der letzten relevanten Datenänderung zu ermitteln.
@@ -68,8 +207,7 @@ class RuleChain:
         if db_id not in self.last_query_time or self.last_query_time[db_id] < last_update_time:
             # Führe die Abfrage aus, wenn es Änderungen gab oder die Abfrage noch nie ausgeführt wurde
             db_client = self.db_clients[db_id]
-            result = db_client.execute_query(query)
-            result_list = [dict(row) for row in result]
+            result_list = [row async for row in db_client.execute_query(query)]
             # Aktualisiere den Zeitstempel der letzten erfolgreichen Abfrage
             self.last_query_time[db_id] = time.time()
             return result_list  # Oder modifiziere die input_message basierend auf dem Ergebnis
@@ -77,45 +215,110 @@ class RuleChain:
             # Keine Änderungen, kein Bedarf, die Abfrage erneut auszuführen
             return input_message
 
-    async def execute_python_script(self, script_path, input_message, client_access):
+    def get_step_batcher(self, step, batch_key):
         """
-        Dynamically loads and executes a Python script with the specified input message and client objects.
-        This method bypasses the limitations of inter-process communication by directly invoking the script in the same process.
+        Returns the micro-batcher of a script step with the option 'batch': {"max_size", "max_wait_ms"}.
         """
-        # Construct the full path to the script
-        full_script_path = os.path.join(script_dir, 'configs', 'external-scripts', script_path)
+        batcher = self.step_batchers.get(batch_key)
+        if batcher is None:
+            batch_config = step['batch']
+            batcher = MicroBatcher(f"step {step['script_path']} of chain {batch_key[0]}",
+                                   lambda messages: self.execute_script_batch(step, messages),
+                                   max_size=batch_config.get('max_size', 100),
+                                   max_wait=batch_config.get('max_wait_ms', 10) / 1000)
+            self.step_batchers[batch_key] = batcher
+        return batcher
+
+    async def execute_script_batch(self, step, messages):
+        """
+        Processes a micro-batch of a step on the event loop, or in the thread pool of a step with
+        'executor': 'thread', with 'process_batch' if the script defines it.
+        """
+        script_path = step['script_path']
+        try:
+            entry = self.script_registry.get(script_path)
+        except Exception as e:
+            logger.error(f"An error occurred while loading the script {script_path}: {e}")
+            return messages
+        if not entry.initialized:
+            try:
+                await self.run_script_initialize(entry, step.get('client_access', []))
+            except Exception as e:
+                logger.error(f"Error initializing Python script {script_path}: {str(e)}")
+        clients = self.prepare_clients_for_script(step.get('client_access', []))
+        if step.get('executor') == 'thread':
+            return await self.get_script_executor(step).execute_batch(entry, messages, clients)
+        return await run_script_batch(entry, messages, clients)
+
+    async def execute_python_script(self, script_path, input_message, client_access, step=None, batch_key=None):
+        """
+        Executes the cached 'process_message' function of a script with the specified input message and client objects.
+        The script is loaded once by the script registry and only reloaded if it is watched and changed on disk.
+
+        The step option 'executor' selects where the function runs: 'inline' on the event loop (default),
+        'thread' in a thread pool (synchronous functions only) or 'process' in a pool of worker processes.
+        With the step option 'batch' messages are collected into micro-batches, which are passed to the
+        script's 'process_batch' function; every message still receives its own output.
+
+        MQTT messages are passed as MessageEnvelope, so a script returning its input unchanged keeps the
+        original payload bytes. Scripts relying on a real dict (isinstance, json.dumps) set the step option
+        'message_type': 'dict'.
+        """
+        if isinstance(input_message, MessageEnvelope) and step and step.get('message_type') == 'dict':
+            input_message = input_message.to_dict()
+        executor_type = step.get('executor', 'inline') if step else 'inline'
+        if executor_type not in EXECUTORS:
+            logger.warning(f"Unknown executor '{executor_type}' for script {script_path}, running inline.")
+            executor_type = 'inline'
+        if step and step.get('batch') and executor_type != 'process' and batch_key is not None:
+            try:
+                return await self.get_step_batcher(step, batch_key).submit(input_message)
+            except Exception as e:
+                SCRIPT_ERRORS.labels(script_path).inc()
+                logger.error(f"An error occurred while executing a batch of the script {script_path}: {e}")
+                return input_message
+        if executor_type == 'process':
+            try:
+                return await self.get_script_executor(step).execute(input_message)
+            except Exception as e:
+                SCRIPT_ERRORS.labels(script_path).inc()
+                logger.error(f"An error occurred while executing the script {script_path} in a worker process: {e}")
+                return input_message
 
-        # Attempt to dynamically load the script as a module
         try:
-            spec = importlib.util.spec_from_file_location("external_module", full_script_path)
-            external_module = importlib.util.module_from_spec(spec)
-            spec.loader.exec_module(external_module)
+            entry = self.script_registry.get(script_path)
         except FileNotFoundError:
-            logger.error(f"The script {script_path} was not found at {full_script_path}.")
+            logger.error(f"The script {script_path} was not found at {self.script_registry.full_path_for(script_path)}.")
             return input_message
         except Exception as e:
-            logger.error(f"An error occurred while loading the script {script_path} from {full_script_path}: {e}")
+            logger.error(f"An error occurred while loading the script {script_path}: {e}")
             return input_message
 
+        if not entry.initialized:
+            # The script was loaded lazily or reloaded after a change
+            try:
+                await self.run_script_initialize(entry, client_access)
+            except asyncio.TimeoutError:
+                logger.error(f"Initialization of script {script_path} timed out.")
+            except Exception as e:
+                logger.error(f"Error initializing Python script {script_path}: {str(e)}")
+
         # Prepare the client objects for the script based on 'client_access'
         clients = self.prepare_clients_for_script(client_access)
 
-        # Before executing, log the module's attributes for debugging
-        #logger.debug(f"Loaded module attributes: {dir(external_module)}")
-
         # Execute the unified function in the script
+        process_message = entry.process_message
+        if process_message is None:
+            logger.error(f"The script {script_path} does not have a 'process_message' function.")
+            return input_message
         try:
-            if hasattr(external_module, 'process_message'):
-                if asyncio.iscoroutinefunction(external_module.process_message):
-                    processed_message = await external_module.process_message(input_message, clients)
-                else:
-                    processed_message = external_module.process_message(input_message, clients)
-                return processed_message
-            else:
-                raise AttributeError("process_message function not found")
-        except AttributeError as ae:
-            logger.error(f"The script {script_path} does not have a 'process_message' function: {ae}")
+            if executor_type == 'thread':
+                return await self.get_script_executor(step).execute(process_message, input_message, clients)
+            if asyncio.iscoroutinefunction(process_message):
+                return await process_message(input_message, clients)
+            return process_message(input_message, clients)
         except Exception as e:
+            SCRIPT_ERRORS.labels(script_path).inc()
             logger.error(
                 f"An error occurred while executing the 'process_message' function in the script {script_path}: {e}")
 
@@ -140,95 +343,273 @@ class RuleChain:
                 logger.warning(f"Client ID {client_id} not found among available clients.")
         return clients_info
 
-    async def process_step(self, message, client_id):
+    async def process_step(self, message, client_id, client_type=None, route_key=None):
         """
         Process each step in the rule chain with modifications to handle client access.
+        Only chains subscribed to the message are executed: 'route_key' is the MQTT topic, the trigger name
+        or the polling query the message originates from. Every chain starts from the original message and
+        forwards its own output exactly once to its targets.
+
+        Independent chains run concurrently. Chains sharing the same 'order_group' run one after another
+        in configuration order.
+
+        Returns the output of each executed chain by chain ID.
         """
-        modified_message = message
-        chain_ids = self.find_chains_by_client_id(client_id)
+        MESSAGES_TOTAL.labels(client_id, client_type or '').inc()
+        if self.tracer is None:
+            return await self.run_chains(message, client_id, client_type, route_key)
+        span, token = self.tracer.start(f"{client_type or ''} {client_id} {route_key or ''}")
+        try:
+            return await self.run_chains(message, client_id, client_type, route_key)
+        finally:
+            current_span.reset(token)
+            span.release()
+
+    async def run_chains(self, message, client_id, client_type, route_key):
+        results = {}
+        chain_ids = self.find_chains_by_client_id(client_id, client_type, route_key)
+        if len(chain_ids) == 1:
+            await self.run_chain(chain_ids[0], message, results)
+            return results
+
+        groups = {}
         for chain_id in chain_ids:
-            chain_config = next((chain for chain in self.chains_config if chain['id'] == chain_id), None)
+            chain_config = self.chains_by_id.get(chain_id)
             if chain_config:
-                for step in chain_config['processing_steps']:
-                    client_access = step.get('client_access', [])
-
-                    if step['type'] == 'python_script':
-                        # Executes Python script
-                        modified_message = await self.execute_python_script(step['script_path'], modified_message,
-                                                                            client_access)
-                        #logger.debug("{}, {}, {}".format(step['script_path'], step['type'], type(modified_message)))
-
-                    elif step['type'] == 'sql_query':
-                        # Execute SQL query logic here
-                        modified_message = await self.execute_sql_query(step['query'], step['id'], modified_message)
+                # Ketten ohne Gruppe bilden jeweils eine eigene Gruppe
+                groups.setdefault(chain_config.get('order_group', ('chain', chain_id)), []).append(chain_id)
+        await asyncio.gather(*(self.run_chains_in_order(group, message, results) for group in groups.values()))
+        # Ergebnisse in Konfigurationsreihenfolge
+        return {chain_id: results[chain_id] for chain_id in chain_ids if chain_id in results}
 
-                    else:
-                        logger.warning("Unknown step type: %s", step['type'])
+    async def run_chains_in_order(self, chain_ids, message, results):
+        """
+        Runs the chains of an order group one after another, each with its own shallow copy of the message.
+        An error in one chain is logged and does not stop the following chains.
+        """
+        for chain_id in chain_ids:
+            try:
+                await self.run_chain(chain_id, copy_message(message), results)
+            except Exception as e:
+                logger.error(f"Error in chain {chain_id}: {e}")
 
+    async def run_chain(self, chain_id, message, results):
+        chain_config = self.chains_by_id.get(chain_id)
+        if chain_config:
+            start = time.perf_counter()
+            result = 'error'
+            try:
+                modified_message = await self.run_chain_steps(chain_config, message)
+                if modified_message is DROP:
+                    # Von einem Filter verworfen
+                    result = 'dropped'
+                    return
                 await self.forward_to_targets(chain_id, modified_message)
+                results[chain_id] = modified_message
+                result = 'forwarded'
+            finally:
+                CHAIN_DURATION.labels(chain_id).observe(time.perf_counter() - start)
+                CHAIN_RUNS.labels(chain_id, result).inc()
+
+    async def run_chain_steps(self, chain_config, message):
+        """
+        Runs the processing steps of a single chain and returns the processed message,
+        or DROP if a filter step discarded it.
+        """
+        modified_message = message
+        for index, step in enumerate(chain_config['processing_steps']):
+            client_access = step.get('client_access', [])
+            start = time.perf_counter()
+
+            if step['type'] == 'python_script':
+                # Executes Python script
+                modified_message = await self.execute_python_script(step['script_path'], modified_message,
+                                                                    client_access, step,
+                                                                    (chain_config['id'], index))
+                #logger.debug("{}, {}, {}".format(step['script_path'], step['type'], type(modified_message)))
+
+            elif step['type'] == 'sql_query':
+                # Execute SQL query logic here
+                modified_message = await self.execute_sql_query(step['query'], step['id'], modified_message)
+
+            elif (chain_config['id'], index) in self.transforms:
+                # Deklarative Schritte (map, filter, project, rename, explode, lookup)
+                try:
+                    modified_message = self.transforms[(chain_config['id'], index)](modified_message)
+                except Exception as e:
+                    logger.error(f"Error in {step['type']} step of chain {chain_config['id']}: {e}")
 
+            else:
+                logger.warning("Unknown step type: %s", step['type'])
+            elapsed = time.perf_counter() - start
+            STEP_DURATION.labels(chain_config['id'], str(index), step['type']).observe(elapsed)
+            span = current_span.get()
+            if span is not None:
+                end = time.monotonic()
+                span.record(f"{chain_config['id']} step {index} {step.get('script_path', step['type'])}",
+                            end - elapsed, end)
+            if modified_message is DROP:
+                return DROP
         return modified_message
 
-    def find_chains_by_client_id(self, client_id: str) -> List[str]:
-        """Find all unique chain IDs corresponding to a given client ID."""
-        matching_chains = set()  # Using a set to avoid duplicates
-        for chain in self.chains_config:
-            for source in chain['sources']:
-                if source['client_id'] == client_id:
-                    matching_chains.add(chain['id'])
-        return list(matching_chains)  # Converting back to a list for the return
+    def find_chains_by_client_id(self, client_id: str, client_type: Optional[str] = None,
+                                 route_key: Optional[str] = None) -> List[str]:
+        """Find all unique chain IDs subscribed to a client and, if given, to a topic, trigger or query."""
+        return self.routing_table.lookup(client_id, client_type, route_key)
 
     async def forward_to_targets(self, chain_id, message):
-        chain_config = next((chain for chain in self.chains_config if chain['id'] == chain_id), None)
+        """
+        Forwards the output of a chain to its targets, concurrently unless the chain sets 'ordered_targets'.
+        """
+        chain_config = self.chains_by_id.get(chain_id)
         if chain_config:
-            for target in chain_config.get('targets', []):
-                # Behandlung für MQTT Targets
-                if target['client_id'] in self.mqtt_clients:
-                    try:
-                        client = self.mqtt_clients[target['client_id']]
-                        message_str = json.dumps(message) if not isinstance(message, str) else message
-                        await client.publish_message(target['topic'], message_str)
-                        #logger.debug(f"Message sent to MQTT {target['client_id']} on topic {target['topic']}")
-                    except Exception as e:
-                        logger.error(
-                            f"Error sending MQTT message to {target['client_id']} on topic {target['topic']}: {e}")
-
-                # Bulk Insert für PostgreSQL Targets
-                elif target['client_type'] == 'postgres':
-                    try:
-                        db_client = self.db_clients[target['client_id']]
-                        # Konvertiere `message` in eine Liste von Dictionaries, falls erforderlich
-                        data = message if isinstance(message, list) else [message]
-                        # Führe den Bulk Insert aus
-                        await db_client.execute_bulk_insert(target['insert_statement'], data,
-                                                            target.get('batch_size', 100))
-                        logger.info(f"Bulk insert sent to PostgreSQL {target['client_id']}")
-                    except Exception as e:
-                        logger.error(f"Error performing bulk insert for PostgreSQL {target['client_id']}: {e}")
+            targets = chain_config.get('targets', [])
+            # Encoded payloads of this message per encoding, shared by all MQTT targets of the chain
+            encoded_payloads = {}
+            if len(targets) == 1 or chain_config.get('ordered_targets', False):
+                for index, target in enumerate(targets):
+                    await self.forward_to_target(chain_id, index, target, message, encoded_payloads)
+            else:
+                await asyncio.gather(*(self.forward_to_target(chain_id, index, target, message, encoded_payloads)
+                                       for index, target in enumerate(targets)))
+
+    async def forward_to_target(self, chain_id, index, target, message, encoded_payloads):
+        start = time.perf_counter()
+        result = 'error'
+        # Behandlung für MQTT Targets
+        if target['client_id'] in self.mqtt_clients:
+            try:
+                client = self.mqtt_clients[target['client_id']]
+                encoding = (target.get('encoding', 'json'), target.get('payload_format', 'envelope'))
+                payload = encoded_payloads.get(encoding)
+                if payload is None:
+                    payload = encode_payload(message, *encoding)
+                    encoded_payloads[encoding] = payload
+                # Gibt nach dem Puffern zurück, die Bestätigung des Brokers wird nicht abgewartet
+                ack = await client.publish_message(target['topic'], payload, qos=target.get('qos', 0),
+                                                   retain=target.get('retain', False),
+                                                   ordered=target.get('ordered', False))
+                result = 'queued'
+                self.trace_ack(chain_id, target, ack)
+                #logger.debug(f"Message sent to MQTT {target['client_id']} on topic {target['topic']}")
+            except Exception as e:
+                logger.error(
+                    f"Error sending MQTT message to {target['client_id']} on topic {target['topic']}: {e}")
+
+        # Bulk Insert für PostgreSQL Targets
+        elif target['client_type'] == 'postgres':
+            try:
+                # Konvertiere `message` in eine Liste von Dictionaries, falls erforderlich
+                data = to_records(message)
+                target_buffer = self.get_target_buffer(chain_id, index, target)
+                if target_buffer is not None:
+                    await target_buffer.add(data)
+                    result = 'buffered'
+                else:
+                    await self.insert_into_postgres_target(target, data)
+                    result = 'inserted'
+            except Exception as e:
+                logger.error(f"Error performing bulk insert for PostgreSQL {target['client_id']}: {e}")
+        else:
+            result = 'unknown_target'
+        labels = (chain_id, str(index), target['client_id'])
+        elapsed = time.perf_counter() - start
+        TARGET_DURATION.labels(*labels).observe(elapsed)
+        TARGET_MESSAGES.labels(*labels, result).inc()
+        span = current_span.get()
+        if span is not None:
+            end = time.monotonic()
+            span.record(f"{chain_id} target {index} {target['client_id']} {result}", end - elapsed, end)
+
+    @staticmethod
+    def trace_ack(chain_id, target, ack):
+        """
+        Keeps the span of the message open until the broker acknowledged the publish.
+        """
+        span = current_span.get()
+        if span is None or not isinstance(ack, asyncio.Future):
+            return
+        queued_at = time.monotonic()
+        span.hold()
+
+        def acknowledged(future):
+            outcome = 'ack' if not future.cancelled() and future.result() else 'dropped'
+            span.record(f"{chain_id} mqtt {target['client_id']} {target['topic']} {outcome}", queued_at)
+            span.release()
+        ack.add_done_callback(acknowledged)
+
+    async def insert_into_postgres_target(self, target, data):
+        db_client = self.db_clients[target['client_id']]
+        # Führe den Bulk Insert aus
+        await db_client.execute_bulk_insert(target.get('insert_statement'), data,
+                                            target.get('batch_size', 100),
+                                            columns=target.get('columns'),
+                                            table=target.get('table'),
+                                            insert_mode=target.get('insert_mode', 'copy'),
+                                            copy_format=target.get('copy_format', 'csv'))
+        logger.info(f"Bulk insert of {len(data)} records sent to PostgreSQL {target['client_id']}")
+
+    def get_target_buffer(self, chain_id, index, target):
+        """
+        Returns the accumulating buffer of a postgres target. Targets without 'batch_size' and
+        'max_batch_time' are not buffered and insert every message immediately.
+        """
+        key = (chain_id, index)
+        target_buffer = self.target_buffers.get(key)
+        if target_buffer is None:
+            if 'batch_size' not in target and 'max_batch_time' not in target:
+                return None
+
+            async def flush(records):
+                await self.insert_into_postgres_target(target, records)
+
+            target_buffer = TargetBuffer(f"{chain_id}/{target['client_id']}/{index}", flush,
+                                         batch_size=target.get('batch_size', 100),
+                                         max_batch_time=target.get('max_batch_time', 1.0))
+            self.target_buffers[key] = target_buffer
+        return target_buffer
+
+    def get_target_buffer_metrics(self):
+        """
+        Returns depth and age of all target buffers by buffer name.
+        """
+        return {target_buffer.name: target_buffer.metrics() for target_buffer in self.target_buffers.values()}
+
+    async def shutdown(self):
+        """
+        Flushes all buffered target records and stops the script executors.
+        """
+        for target_buffer in self.target_buffers.values():
+            await target_buffer.close()
+        logger.info("Flushed all target buffers.")
+        for batcher in self.step_batchers.values():
+            await batcher.close()
+        for executor in self.script_executors.values():
+            await executor.close()
+
+    def get_payload_decoder(self, client_id, topic):
+        """
+        Returns the decode function for a topic: a typed decoder if matching sources declare a 'schema',
+        otherwise the plain codec without any per-field type probing.
+        """
+        cache_key = (client_id, topic)
+        decoder = self.payload_decoders.get(cache_key)
+        if decoder is None:
+            schema = self.routing_table.lookup_schema(client_id, topic) if topic is not None else None
+            decoder = codec.TypedDecoder(schema).decode if schema else codec.loads
+            if len(self.payload_decoders) >= self.routing_table.topic_cache_size:
+                self.payload_decoders.clear()
+            self.payload_decoders[cache_key] = decoder
+        return decoder
 
     async def handle_incoming_message(self, message, client_id):
 
-        payload = message.payload.decode()  # Nimmt an, dass die Nutzlast eine Zeichenkette ist
         topic = message.topic.value if hasattr(message, 'topic') else None  # Überprüfen, ob das Topic vorhanden ist
-        #logger.debug(f"Received message from client: {client_id} on topic {topic}: {payload}")
+        #logger.debug(f"Received message from client: {client_id} on topic {topic}: {message.payload}")
 
-        try:
-            decoded_message = json.loads(payload)
-
-        except json.JSONDecodeError:
-            # Falls die Nutzlast kein JSON ist, verwenden Sie die rohe Zeichenkette
-            decoded_message = payload
-
-        # Integrieren des Topics in das zu verarbeitende Objekt
-        message_to_process = {
-            'topic': topic,
-            'data': decoded_message
-        }
-
-        processed_data = await self.process_step(message_to_process, client_id)
-        # Finde die zugehörigen Chain IDs für die gegebene Client ID
-        chain_ids = self.find_chains_by_client_id(client_id)
-        # Iteriere über jede gefundene Chain ID und leite die verarbeitete Nachricht weiter
-        for chain_id in chain_ids:
-            await self.forward_to_targets(chain_id, processed_data)
+        # Die Nutzlast wird erst dekodiert, wenn ein Schritt auf 'data' zugreift
+        message_to_process = MessageEnvelope(topic, message.payload, self.get_payload_decoder(client_id, topic))
+
+        # process_step forwards the output of every chain to its targets
+        await self.process_step(message_to_process, client_id, 'mqtt', topic)
         return message
@@ -0,0 +1,255 @@
+import asyncio
+import inspect
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from helpers.custom_logging_helper import logger
+from helpers.micro_batcher import MicroBatcher
+from message_envelope import MessageEnvelope
+from script_registry import ScriptRegistry
+
+EXECUTORS = ('inline', 'thread', 'process')
+
+# Zustand eines Worker-Prozesses: Event-Loop, geladenes Skript und neu erzeugte Clients
+_worker = {}
+
+
+def to_picklable(message):
+    """
+    Converts a message so it can be sent to a worker process.
+    """
+    if isinstance(message, MessageEnvelope):
+        return message.to_dict()
+    return message
+
+
+async def create_worker_clients(client_access, client_configs):
+    """
+    Re-creates the clients a script may access inside a worker process. MQTT clients are not available
+    in workers, their messages are published by the chain targets of the main process.
+    """
+    clients = {}
+    if not client_access:
+        return clients
+    # Import im Worker, um einen Zirkelimport zu vermeiden
+    from client_manager import ClientManager
+
+    for client_id in client_access:
+        client_type, client_config = client_configs.get(client_id, (None, None))
+        if client_type == 'redis':
+            # Ohne lokalen Cache: der Cache eines Workers würde von Schreibvorgängen anderer Prozesse nie invalidiert
+            clients[client_id] = ClientManager.create_redis_client(
+                dict(client_config, local_cache_size=0, invalidation_listener=False))
+        elif client_type == 'postgres':
+            db_client = ClientManager.create_db_client(client_config)
+            await db_client.connect_and_verify()
+            clients[client_id] = db_client
+        else:
+            logger.warning(f"Client ID {client_id} is not available in process workers.")
+    return clients
+
+
+async def run_script_batch(entry, messages, clients):
+    """
+    Processes a batch of messages with the optional 'process_batch(messages, clients)' function of a script,
+    which returns one output per message in the same order. Scripts without it, or whose 'process_batch'
+    fails or returns a different number of outputs, are called with 'process_message' for each message.
+    Messages whose processing fails are passed on unchanged.
+    """
+    if entry.process_batch is not None:
+        try:
+            results = entry.process_batch(messages, clients)
+            if asyncio.iscoroutine(results):
+                results = await results
+            if isinstance(results, list) and len(results) == len(messages):
+                return results
+            count = len(results) if isinstance(results, list) else type(results).__name__
+            logger.warning(f"'process_batch' of script {entry.script_path} returned {count} outputs for "
+                           f"{len(messages)} messages, processing the messages one by one.")
+        except Exception as e:
+            logger.error(f"An error occurred while executing the 'process_batch' function in the script "
+                         f"{entry.script_path}: {e}")
+
+    results = []
+    for message in messages:
+        if entry.process_message is None:
+            results.append(message)
+            continue
+        try:
+            result = entry.process_message(message, clients)
+            if asyncio.iscoroutine(result):
+                result = await result
+        except Exception as e:
+            logger.error(f"An error occurred while executing the 'process_message' function in the script "
+                         f"{entry.script_path}: {e}")
+            result = message
+        results.append(result)
+    return results
+
+
+def worker_initializer(module):
+    """
+    Returns the function initializing a script in each worker process. Scripts splitting their initialization
+    define 'worker_initialize' for the state of every worker, their 'initialize' then runs once in the main
+    process (e.g. a Redis warm-up). Otherwise 'initialize' runs in every worker, like in the main process.
+    """
+    return getattr(module, 'worker_initialize', None) or getattr(module, 'initialize', None)
+
+
+def initialize_worker(base_dir, script_path, client_access, client_configs, init_timeout):
+    """
+    Runs once per worker process: loads the script, re-creates its clients and initializes the script
+    with 'worker_initialize(clients)' if it defines one, otherwise with 'initialize(clients)'.
+    """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    entry = ScriptRegistry(base_dir).load(script_path)
+    clients = loop.run_until_complete(create_worker_clients(client_access, client_configs))
+    initialize = worker_initializer(entry.module)
+    if initialize is not None:
+        if asyncio.iscoroutinefunction(initialize):
+            loop.run_until_complete(asyncio.wait_for(initialize(clients), init_timeout))
+        else:
+            initialize(clients)
+    _worker.update(loop=loop, entry=entry, clients=clients)
+    logger.info(f"Process worker {os.getpid()} loaded script {script_path}.")
+
+
+def worker_ready():
+    return os.getpid()
+
+
+def run_batch(messages):
+    """
+    Runs 'process_batch' or 'process_message' for a batch of messages inside a worker process.
+    """
+    loop = _worker['loop']
+    entry = _worker['entry']
+    clients = _worker['clients']
+    results = loop.run_until_complete(run_script_batch(entry, messages, clients))
+    # Nicht abgewartete Redis-Schreibvorgänge vor der Rückgabe abschließen
+    pending_writes = [task for client in clients.values() for task in getattr(client, 'pending_writes', ())]
+    if pending_writes:
+        loop.run_until_complete(asyncio.gather(*pending_writes, return_exceptions=True))
+    return results
+
+
+class LoopClientProxy:
+    """
+    Gives a script running in a pool thread access to a client of the event loop.
+
+    Every method call is run on the event loop and waited for, awaitable results included, so the thread
+    sees a synchronous client: 'redis_client.get(key)' returns the value and 'redis_client.set(...)' returns
+    once the value was written. Query streams are read completely on the event loop and returned as list of
+    rows, so the asyncpg pool and the SQLAlchemy session are only used from the event loop thread.
+    Async context managers such as 'redis_client.pipeline()' are not supported through the proxy.
+    """
+
+    def __init__(self, client, loop):
+        self._client = client
+        self._loop = loop
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if not callable(attribute):
+            return attribute
+
+        def call(*args, **kwargs):
+            return asyncio.run_coroutine_threadsafe(self._call(attribute, args, kwargs), self._loop).result()
+
+        return call
+
+    @staticmethod
+    async def _call(method, args, kwargs):
+        result = method(*args, **kwargs)
+        if hasattr(result, '__aiter__'):
+            return [row async for row in result]
+        if inspect.isawaitable(result):
+            result = await result
+        return result
+
+
+class ThreadScriptExecutor:
+    """
+    Runs a synchronous 'process_message' function in a thread pool, so it does not block the event loop.
+    The function receives its clients wrapped in a LoopClientProxy, their calls run on the event loop.
+    """
+
+    def __init__(self, script_path, workers=None):
+        self.script_path = script_path
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=f"script-{script_path}")
+
+    @staticmethod
+    def proxy_clients(clients, loop):
+        return {client_id: LoopClientProxy(client, loop) for client_id, client in clients.items()}
+
+    async def execute(self, process_message, message, clients):
+        if asyncio.iscoroutinefunction(process_message):
+            # Coroutinen laufen ohnehin auf dem Event-Loop
+            return await process_message(message, clients)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, process_message, message, self.proxy_clients(clients, loop))
+
+    async def execute_batch(self, entry, messages, clients):
+        """
+        Runs 'process_batch' or 'process_message' for a micro-batch in the thread pool. Scripts with
+        coroutine functions are run on the event loop.
+        """
+        if (asyncio.iscoroutinefunction(entry.process_batch)
+                or asyncio.iscoroutinefunction(entry.process_message)):
+            return await run_script_batch(entry, messages, clients)
+        loop = asyncio.get_running_loop()
+        proxies = self.proxy_clients(clients, loop)
+        return await loop.run_in_executor(self.pool, lambda: asyncio.run(run_script_batch(entry, messages, proxies)))
+
+    async def close(self):
+        self.pool.shutdown(wait=False)
+
+
+class ProcessScriptExecutor:
+    """
+    Runs the 'process_message' function of a script in a pool of worker processes for CPU bound steps.
+
+    Each worker loads and initializes the script and re-creates its Redis (without local cache) and PostgreSQL
+    clients once, see 'worker_initializer'. Changes of the script file are not reloaded. Messages of
+    concurrent chain runs are collected into micro-batches, so one round trip to a worker handles
+    several messages.
+    """
+
+    def __init__(self, script_path, base_dir, client_access, client_configs, workers=None, batch_size=10,
+                 max_wait_ms=5, init_timeout=10):
+        """
+        :param workers: Number of worker processes, the number of CPU cores by default.
+        :param batch_size: Maximum number of messages sent to a worker at once.
+        :param max_wait_ms: Maximum time a message waits for further messages of its batch.
+        """
+        self.script_path = script_path
+        self.workers = workers or os.cpu_count() or 1
+        # 'spawn' statt 'fork', damit Worker keine Sockets und Event-Loops des Hauptprozesses erben
+        self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                        mp_context=multiprocessing.get_context('spawn'),
+                                        initializer=initialize_worker,
+                                        initargs=(base_dir, script_path, list(client_access), client_configs,
+                                                  init_timeout))
+        self.batcher = MicroBatcher(f"process executor {script_path}", self.run_batch, max_size=batch_size,
+                                    max_wait=max_wait_ms / 1000, max_concurrency=self.workers * 2)
+
+    async def start(self):
+        """
+        Starts all workers up front, so the first messages do not wait for script loading.
+        """
+        loop = asyncio.get_running_loop()
+        pids = await asyncio.gather(*(loop.run_in_executor(self.pool, worker_ready) for _ in range(self.workers)))
+        logger.info(f"Started {len(set(pids))} process workers for script {self.script_path}.")
+
+    async def run_batch(self, messages):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, run_batch, [to_picklable(message) for message in messages])
+
+    async def execute(self, message):
+        return await self.batcher.submit(message)
+
+    async def close(self):
+        await self.batcher.close()
+        self.pool.shutdown(wait=False, cancel_futures=True)
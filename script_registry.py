@@ -0,0 +1,174 @@
+import hashlib
+import importlib.util
+import os
+import re
+import sys
+import time
+
+from helpers.custom_logging_helper import logger
+
+
+class ScriptEntry:
+    """
+    Holds a loaded external script module together with its load metadata.
+    """
+
+    def __init__(self, script_path, full_path, module_name):
+        self.script_path = script_path
+        self.full_path = full_path
+        self.module_name = module_name
+        self.module = None
+        self.process_message = None
+        self.process_batch = None
+        self.mtime = None
+        self.file_hash = None
+        self.read_time = 0.0
+        self.compile_time = 0.0
+        self.exec_time = 0.0
+        self.load_count = 0
+        self.loaded_at = None
+        self.last_check = 0.0
+        self.watch = False
+        self.initialized = False
+        self.init_timeout = 10
+
+    @property
+    def load_time(self):
+        return self.read_time + self.compile_time + self.exec_time
+
+    def timings(self):
+        return {
+            "module_name": self.module_name,
+            "read_time": self.read_time,
+            "compile_time": self.compile_time,
+            "exec_time": self.exec_time,
+            "load_time": self.load_time,
+            "load_count": self.load_count,
+            "loaded_at": self.loaded_at,
+        }
+
+
+class ScriptRegistry:
+    """
+    Loads external scripts once and hands out the cached module and its 'process_message' and
+    'process_batch' callables.
+
+    Every script gets its own module name, so module-level state of one script does not collide
+    with another one. Optionally the registry watches the file (mtime, then content hash) and reloads
+    the module when it changed on disk.
+    """
+
+    def __init__(self, base_dir, check_interval=2.0):
+        """
+        :param base_dir: Directory the configured 'script_path' values are relative to.
+        :param check_interval: Minimum time in seconds between two change checks of a watched script.
+        """
+        self.base_dir = base_dir
+        self.check_interval = check_interval
+        self.entries = {}
+
+    @staticmethod
+    def module_name_for(script_path):
+        """
+        Builds a unique, importable module name from the script path.
+        """
+        stem = os.path.splitext(script_path)[0]
+        return "external_scripts." + re.sub(r'\W', '_', stem)
+
+    def full_path_for(self, script_path):
+        return os.path.join(self.base_dir, script_path)
+
+    def load(self, script_path, watch=False):
+        """
+        Loads (or returns the already loaded) script. Raises if the script cannot be read or executed.
+        """
+        entry = self.entries.get(script_path)
+        if entry is None:
+            entry = ScriptEntry(script_path, self.full_path_for(script_path), self.module_name_for(script_path))
+            self._load_module(entry)
+            self.entries[script_path] = entry
+        entry.watch = entry.watch or watch
+        return entry
+
+    def get(self, script_path):
+        """
+        Returns the cached entry of a script, loading it on first use and reloading it if it is
+        watched and changed on disk.
+        """
+        entry = self.entries.get(script_path)
+        if entry is None:
+            return self.load(script_path)
+        if entry.watch:
+            self._reload_if_changed(entry)
+        return entry
+
+    def timings(self):
+        """
+        Returns the load/compile timings of all loaded scripts.
+        """
+        return {script_path: entry.timings() for script_path, entry in self.entries.items()}
+
+    def _reload_if_changed(self, entry):
+        now = time.monotonic()
+        if now - entry.last_check < self.check_interval:
+            return
+        entry.last_check = now
+        try:
+            mtime = os.stat(entry.full_path).st_mtime
+        except OSError as e:
+            logger.error(f"Cannot check script {entry.script_path} for changes: {e}")
+            return
+        if mtime == entry.mtime:
+            return
+        with open(entry.full_path, 'rb') as f:
+            source = f.read()
+        if hashlib.sha256(source).hexdigest() == entry.file_hash:
+            # Nur der Zeitstempel hat sich geändert
+            entry.mtime = mtime
+            return
+        logger.info(f"Script {entry.script_path} changed on disk. Reloading...")
+        try:
+            self._load_module(entry, source)
+        except Exception as e:
+            # Keep serving the previous version of the module
+            entry.mtime = mtime
+            logger.error(f"Reloading script {entry.script_path} failed, keeping previous version: {e}")
+
+    def _load_module(self, entry, source=None):
+        start = time.perf_counter()
+        mtime = os.stat(entry.full_path).st_mtime
+        if source is None:
+            with open(entry.full_path, 'rb') as f:
+                source = f.read()
+        read_done = time.perf_counter()
+
+        code = compile(source, entry.full_path, 'exec')
+        compile_done = time.perf_counter()
+
+        spec = importlib.util.spec_from_file_location(entry.module_name, entry.full_path)
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[entry.module_name] = module
+        try:
+            exec(code, module.__dict__)
+        except Exception:
+            if entry.module is not None:
+                sys.modules[entry.module_name] = entry.module
+            else:
+                sys.modules.pop(entry.module_name, None)
+            raise
+        exec_done = time.perf_counter()
+
+        entry.module = module
+        entry.process_message = getattr(module, 'process_message', None)
+        entry.process_batch = getattr(module, 'process_batch', None)
+        entry.mtime = mtime
+        entry.file_hash = hashlib.sha256(source).hexdigest()
+        entry.read_time = read_done - start
+        entry.compile_time = compile_done - read_done
+        entry.exec_time = exec_done - compile_done
+        entry.load_count += 1
+        entry.loaded_at = time.time()
+        entry.last_check = time.monotonic()
+        entry.initialized = False
+        logger.info(f"Loaded script {entry.script_path} as module '{entry.module_name}' "
+                    f"in {entry.load_time * 1000:.1f} ms (compile {entry.compile_time * 1000:.1f} ms).")
@@ -0,0 +1,154 @@
+import asyncio
+import time
+
+from helpers.custom_logging_helper import logger
+
+
+class TargetBuffer:
+    """
+    Accumulates records for a target across messages and flushes them as one batch
+    when either 'batch_size' records are buffered or the oldest record reached 'max_batch_time'.
+    """
+
+    def __init__(self, name, flush_callback, batch_size=100, max_batch_time=1.0):
+        """
+        :param name: Name of the buffer used in logs and metrics.
+        :param flush_callback: Coroutine function receiving the list of buffered records.
+        :param batch_size: Number of buffered records that triggers a flush.
+        :param max_batch_time: Maximum age in seconds of the oldest buffered record before a flush.
+        """
+        self.name = name
+        self.flush_callback = flush_callback
+        self.batch_size = batch_size
+        self.max_batch_time = max_batch_time
+        self.records = []
+        self.first_added = None
+        self.generation = 0
+        self.timer_task = None
+        self.flush_lock = asyncio.Lock()
+        self.flushed_batches = 0
+        self.flushed_records = 0
+        self.last_flush_duration = 0.0
+        self.closed = False
+
+    async def add(self, records):
+        """
+        Adds records to the buffer and flushes if the size threshold is reached.
+        """
+        if not records:
+            return
+        if self.closed:
+            # Nach dem Schließen direkt durchreichen
+            await self.flush_callback(list(records))
+            return
+        if not self.records:
+            self.first_added = time.monotonic()
+            self.start_timer()
+        self.append_records(records)
+        if len(self.records) >= self.batch_size:
+            await self.flush()
+
+    def append_records(self, records):
+        self.records.extend(records)
+
+    def take_records(self):
+        records = self.records
+        self.records = []
+        return records
+
+    def start_timer(self):
+        if self.max_batch_time is None:
+            return
+        generation = self.generation
+        self.timer_task = asyncio.create_task(self.flush_after_timeout(generation))
+
+    async def flush_after_timeout(self, generation):
+        await asyncio.sleep(self.max_batch_time)
+        # Only flush the batch the timer was started for
+        if generation == self.generation and self.records:
+            await self.flush()
+
+    async def flush(self):
+        """
+        Flushes all buffered records. Records added while a flush is running go into the next batch.
+        """
+        if not self.records:
+            return
+        records = self.take_records()
+        self.first_added = None
+        self.generation += 1
+        if self.timer_task is not None and self.timer_task is not asyncio.current_task():
+            self.timer_task.cancel()
+        self.timer_task = None
+
+        # Keep the order of batches for the target
+        async with self.flush_lock:
+            start = time.monotonic()
+            try:
+                await self.flush_callback(records)
+            except Exception as e:
+                logger.error(f"Flushing {len(records)} records of buffer {self.name} failed: {e}")
+            self.last_flush_duration = time.monotonic() - start
+            self.flushed_batches += 1
+            self.flushed_records += len(records)
+
+    async def close(self):
+        """
+        Flushes the remaining records and passes records added afterwards straight through.
+        """
+        self.closed = True
+        await self.flush()
+
+    @property
+    def depth(self):
+        return len(self.records)
+
+    @property
+    def age(self):
+        return time.monotonic() - self.first_added if self.first_added is not None else 0.0
+
+    def metrics(self):
+        return {
+            "depth": self.depth,
+            "age": self.age,
+            "batch_size": self.batch_size,
+            "max_batch_time": self.max_batch_time,
+            "flushed_batches": self.flushed_batches,
+            "flushed_records": self.flushed_records,
+            "last_flush_duration": self.last_flush_duration,
+        }
+
+
+class CoalescingBuffer(TargetBuffer):
+    """
+    Buffer that keeps only the latest record per key, e.g. for bursts of notifications caused by bulk updates.
+    A batch contains every key once, in the order of the last change.
+    """
+
+    def __init__(self, name, flush_callback, key, batch_size=1000, max_batch_time=0.5):
+        """
+        :param key: Field identifying a record. Records without this field are never merged.
+        """
+        super().__init__(name, flush_callback, batch_size, max_batch_time)
+        self.key = key
+        self.records = {}
+        self.coalesced_records = 0
+
+    def append_records(self, records):
+        for record in records:
+            key = record.get(self.key) if isinstance(record, dict) else None
+            if key is None:
+                key = object()
+            elif key in self.records:
+                # Neuester Stand gewinnt und rückt ans Ende
+                del self.records[key]
+                self.coalesced_records += 1
+            self.records[key] = record
+
+    def take_records(self):
+        records = list(self.records.values())
+        self.records = {}
+        return records
+
+    def metrics(self):
+        return {**super().metrics(), "coalesced_records": self.coalesced_records}
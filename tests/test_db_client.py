@@ -0,0 +1,34 @@
+import asyncio
+
+from db_client import DBClient
+
+
+class RecordingChain:
+    def __init__(self, cursor_state):
+        self.cursor_state = cursor_state
+        self.messages = []
+
+    async def process_step(self, message, client_id, client_type=None, route_key=None):
+        # Die Kette darf erst laufen, wenn Verbindung und Cursor-Transaktion wieder frei sind
+        assert not self.cursor_state['open']
+        self.messages.append(message)
+
+
+def test_polled_batches_are_processed_after_the_cursor_is_released(monkeypatch):
+    cursor_state = {'open': False}
+
+    async def rows():
+        cursor_state['open'] = True
+        try:
+            for value in range(5):
+                yield {'id': value}
+        finally:
+            cursor_state['open'] = False
+
+    db_client = DBClient('test', 'postgresql://localhost/test')
+    monkeypatch.setattr(db_client, 'execute_query', lambda query, *args: rows())
+    chain = RecordingChain(cursor_state)
+
+    asyncio.run(db_client.poll_batches('SELECT id FROM t', chain, 'rows', max_rows_per_batch=2))
+
+    assert chain.messages == [[{'id': 0}, {'id': 1}], [{'id': 2}, {'id': 3}], [{'id': 4}]]
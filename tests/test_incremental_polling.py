@@ -0,0 +1,53 @@
+import asyncio
+
+from incremental_polling import IncrementalQuery, PollingStateStore
+
+
+class FakeDBClient:
+    client_id = 'db'
+
+    def __init__(self):
+        self.rows = []
+
+    def execute_query(self, query, *args):
+        async def stream():
+            for row in self.rows:
+                yield dict(row)
+        return stream()
+
+
+def poll(incremental):
+    async def run():
+        rows = [row async for row in incremental.rows()]
+        await incremental.commit(rows)
+        return rows
+    return asyncio.run(run())
+
+
+def make_query(tmp_path, **config):
+    db_client = FakeDBClient()
+    incremental = IncrementalQuery(db_client, 'SELECT id, value FROM t', dict(mode='hash', key_column='id', **config),
+                                   PollingStateStore(state_file=str(tmp_path / 'state.json')))
+    return db_client, incremental
+
+
+def test_hash_mode_forgets_deleted_rows(tmp_path):
+    db_client, incremental = make_query(tmp_path)
+    db_client.rows = [{'id': 1, 'value': 'a'}, {'id': 2, 'value': 'b'}]
+    assert len(poll(incremental)) == 2
+
+    db_client.rows = [{'id': 1, 'value': 'a'}]
+    assert poll(incremental) == []
+    assert set(incremental.row_hashes) == {'1'}
+
+
+def test_hash_mode_emits_deletes(tmp_path):
+    db_client, incremental = make_query(tmp_path, emit_deletes=True)
+    db_client.rows = [{'id': 1, 'value': 'a'}, {'id': 2, 'value': 'b'}]
+    poll(incremental)
+
+    db_client.rows = [{'id': 1, 'value': 'a'}]
+    assert poll(incremental) == [{'id': '2', '_deleted': True}]
+    assert set(incremental.row_hashes) == {'1'}
+    # Einmal gemeldet, danach vergessen
+    assert poll(incremental) == []
@@ -0,0 +1,67 @@
+import asyncio
+import json
+
+from message_envelope import MessageEnvelope
+from rule_chain import RuleChain, encode_payload
+from test_rule_chain_publish import CountingMQTTClient, mqtt_message
+
+
+def test_scripts_receive_a_plain_dict_with_message_type_dict(tmp_path, monkeypatch):
+    script = tmp_path / 'check_dict.py'
+    script.write_text(
+        "import json\n"
+        "def process_message(input_message, clients):\n"
+        "    copy = input_message.copy()\n"
+        "    copy['is_dict'] = isinstance(input_message, dict)\n"
+        "    copy['encoded'] = json.dumps(input_message)\n"
+        "    return copy\n")
+    processing_chain = RuleChain([])
+    monkeypatch.setattr(processing_chain.script_registry, 'base_dir', str(tmp_path))
+    envelope = MessageEnvelope('a/b', b'{"value": 1}')
+
+    step = {'type': 'python_script', 'script_path': 'check_dict.py', 'message_type': 'dict'}
+
+    result = asyncio.run(processing_chain.execute_python_script('check_dict.py', envelope, [], step=step))
+
+    assert result['is_dict'] is True
+    assert json.loads(result['encoded']) == {'topic': 'a/b', 'data': {'value': 1}}
+
+
+def test_data_payload_format_applies_to_plain_dicts():
+    envelope = MessageEnvelope('a/b', b'{"value": 1}')
+    mapped = {'topic': 'a/b', 'data': {'value': 1, 'mapped': True}}
+
+    assert encode_payload(envelope, payload_format='data') == b'{"value": 1}'
+    assert json.loads(encode_payload(mapped, payload_format='data')) == {'value': 1, 'mapped': True}
+    assert json.loads(encode_payload(mapped)) == mapped
+
+
+def test_pass_through_script_republishes_the_original_bytes(tmp_path, monkeypatch):
+    script = tmp_path / 'pass_through.py'
+    script.write_text(
+        "async def process_message(input_message, clients):\n"
+        "    return input_message\n")
+    payload = b'{"value":  1, "unit": "C"}'
+    sink = CountingMQTTClient()
+    processing_chain = RuleChain([{
+        'id': 'bridge',
+        'sources': [{'client_id': 'source', 'client_type': 'mqtt', 'topic': 'a/#'}],
+        'processing_steps': [{'type': 'python_script', 'script_path': 'pass_through.py'}],
+        'targets': [{'client_id': 'sink', 'client_type': 'mqtt', 'topic': 'out', 'payload_format': 'data'}],
+    }], mqtt_clients={'sink': sink})
+    monkeypatch.setattr(processing_chain.script_registry, 'base_dir', str(tmp_path))
+
+    asyncio.run(processing_chain.handle_incoming_message(mqtt_message('a/b', payload), 'source'))
+
+    # Unverändert weitergegeben, also weder dekodiert noch neu kodiert (doppeltes Leerzeichen bleibt)
+    assert sink.payloads['out'] == [payload]
+
+
+def test_envelope_copy_stays_untouched():
+    envelope = MessageEnvelope('a/b', b'{"value": 1}')
+    copy = envelope.copy()
+
+    assert copy.untouched and copy.encode_data() == b'{"value": 1}'
+    copy['source'] = 'bridge'
+    assert 'source' not in envelope
+    assert json.loads(encode_payload(copy)) == {'topic': 'a/b', 'data': {'value': 1}, 'source': 'bridge'}
@@ -0,0 +1,127 @@
+import asyncio
+
+from publish_queue import PublishQueue
+
+
+def test_permanent_errors_are_given_up_and_do_not_block_ordered_topics():
+    attempts = []
+
+    async def publish(topic, payload, qos, retain):
+        attempts.append(payload)
+        if payload == b'invalid':
+            raise ValueError('invalid payload')
+
+    async def run():
+        queue = PublishQueue('test', publish, retry_interval=0, max_attempts=3)
+        queue.set_connected(True)
+        failed = await queue.put('a/b', b'invalid', ordered=True)
+        published = await queue.put('a/b', b'valid', ordered=True)
+        results = await asyncio.wait_for(asyncio.gather(failed, published), 1)
+        await queue.close()
+        return queue, results
+
+    queue, results = asyncio.run(run())
+
+    assert results == [False, True]
+    assert attempts == [b'invalid'] * 3 + [b'valid']
+    assert queue.failed == 1
+
+
+def test_connection_errors_are_retried_without_limit():
+    failures = iter([ConnectionError()] * 5)
+
+    async def publish(topic, payload, qos, retain):
+        error = next(failures, None)
+        if error is not None:
+            raise error
+
+    async def run():
+        queue = PublishQueue('test', publish, retry_interval=0, max_attempts=2)
+        queue.set_connected(True)
+        result = await asyncio.wait_for(await queue.put('a/b', b'value'), 1)
+        await queue.close()
+        return queue, result
+
+    queue, result = asyncio.run(run())
+
+    assert result is True
+    assert queue.retried == 5
+
+
+def test_busy_ordered_topic_does_not_block_other_topics():
+    release = asyncio.Event()
+    published = []
+
+    async def publish(topic, payload, qos, retain):
+        if payload == b'slow':
+            await release.wait()
+        published.append(payload)
+
+    async def run():
+        queue = PublishQueue('test', publish, max_in_flight=10)
+        queue.set_connected(True)
+        slow = await queue.put('ordered', b'slow', ordered=True)
+        second = await queue.put('ordered', b'second', ordered=True)
+        other = await queue.put('other', b'other')
+        await asyncio.wait_for(other, 1)
+        blocked = list(published)
+        release.set()
+        await asyncio.wait_for(asyncio.gather(slow, second), 1)
+        await queue.close()
+        return blocked
+
+    blocked = asyncio.run(run())
+
+    assert blocked == [b'other']
+
+
+def test_retries_free_their_slot_and_keep_the_original_order():
+    failing = {b'1', b'2', b'3'}
+    published = []
+    concurrent = []
+
+    async def publish(topic, payload, qos, retain):
+        concurrent.append(payload)
+        await asyncio.sleep(0)
+        if payload in failing:
+            failing.discard(payload)
+            raise ConnectionError()
+        published.append(payload)
+
+    async def run():
+        queue = PublishQueue('test', publish, max_in_flight=3, retry_interval=0.05)
+        queue.set_connected(True)
+        futures = [await queue.put('a/b', str(value).encode()) for value in range(1, 6)]
+        await asyncio.sleep(0.01)
+        # Während der Wartezeit der Wiederholungen laufen die übrigen Nachrichten weiter
+        during_backoff = list(published)
+        await asyncio.wait_for(asyncio.gather(*futures), 1)
+        await queue.close()
+        return during_backoff
+
+    during_backoff = asyncio.run(run())
+
+    assert during_backoff == [b'4', b'5']
+    assert published == [b'4', b'5', b'1', b'2', b'3']
+
+
+def test_ordered_topic_waits_for_the_retry_of_its_previous_message():
+    failures = {b'first': 1}
+    published = []
+
+    async def publish(topic, payload, qos, retain):
+        if failures.get(payload):
+            failures[payload] -= 1
+            raise ConnectionError()
+        published.append(payload)
+
+    async def run():
+        queue = PublishQueue('test', publish, retry_interval=0.02)
+        queue.set_connected(True)
+        futures = [await queue.put('a/b', payload, ordered=True) for payload in (b'first', b'second', b'third')]
+        await asyncio.wait_for(asyncio.gather(*futures), 1)
+        await queue.close()
+
+    asyncio.run(run())
+
+    assert published == [b'first', b'second', b'third']
@@ -0,0 +1,157 @@
+import asyncio
+
+from helpers.local_cache import MISSING
+from redis_client import RedisClient
+
+
+def encode(value):
+    if isinstance(value, list):
+        return b'*%d\r\n' % len(value) + b''.join(encode(item) for item in value)
+    if isinstance(value, int):
+        return b':%d\r\n' % value
+    value = value.encode()
+    return b'$%d\r\n%s\r\n' % (len(value), value)
+
+
+class FakeRedisServer:
+    """
+    Minimal RESP server: answers the commands of the keyspace listener and otherwise stays idle.
+    """
+
+    def __init__(self):
+        self.subscribers = []
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def read_command(self, reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        command = []
+        for _ in range(int(line[1:])):
+            length = int((await reader.readline())[1:])
+            command.append((await reader.readexactly(length + 2))[:-2].decode())
+        return command
+
+    async def handle(self, reader, writer):
+        while (command := await self.read_command(reader)) is not None:
+            name = command[0].upper()
+            if name == 'PING':
+                # Health-Check einer Subscription: ['pong', message]
+                writer.write(encode(['pong', command[1]]) if len(command) > 1 else b'+PONG\r\n')
+            elif name == 'CONFIG':
+                writer.write(encode(['notify-keyspace-events', 'KEA']))
+            elif name == 'PSUBSCRIBE':
+                writer.write(encode(['psubscribe', command[1], 1]))
+                self.subscribers.append(writer)
+            else:
+                writer.write(b'+OK\r\n')
+            await writer.drain()
+
+    def publish(self, key, event):
+        for writer in self.subscribers:
+            writer.write(encode(['pmessage', '__keyspace@0__:*', f'__keyspace@0__:{key}', event]))
+
+    async def close(self):
+        for writer in self.subscribers:
+            writer.close()
+        self.server.close()
+
+
+def test_idle_keyspace_subscription_keeps_the_local_cache():
+    async def run():
+        server = FakeRedisServer()
+        port = await server.start()
+        client = RedisClient('test', port=port, socket_timeout=0.3, check_interval=0.2, local_cache_size=10,
+                             local_cache_ttl=None, invalidation_listener=True)
+        try:
+            while not server.subscribers:
+                await asyncio.sleep(0.01)
+            await asyncio.sleep(0.05)
+            client.cache_put('a', '1')
+            client.cache_put('b', '2')
+            # Länger ruhig als socket_timeout und check_interval
+            await asyncio.sleep(1.0)
+            idle = (client.local_cache.get('a'), client.local_cache.get('b'), len(server.subscribers))
+            server.publish('a', 'set')
+            await asyncio.sleep(0.1)
+            return idle, client.local_cache.get('a'), client.local_cache.get('b')
+        finally:
+            await client.close()
+            await asyncio.gather(client.listener_task, client.check_task, return_exceptions=True)
+            await server.close()
+
+    idle, a, b = asyncio.run(run())
+
+    assert idle == ('1', '2', 1)
+    assert a is MISSING
+    assert b == '2'
+
+
+class FailingConnection:
+    def __init__(self):
+        self.release = asyncio.Event()
+
+    async def set(self, key, value, ex=None):
+        raise ConnectionError('connection lost')
+
+    async def get(self, key):
+        await self.release.wait()
+        return 'old'
+
+
+def make_client(connection):
+    client = RedisClient('test', local_cache_size=10, local_cache_ttl=None)
+    client.check_task.cancel()
+    client.connection = connection
+    return client
+
+
+def test_failed_write_is_evicted_from_the_local_cache():
+    async def run():
+        client = make_client(FailingConnection())
+        await client.set('a', 'new')
+        return client.local_cache.get('a')
+
+    assert asyncio.run(run()) is MISSING
+
+
+def test_read_in_flight_does_not_overwrite_a_newer_write():
+    async def run():
+        connection = FailingConnection()
+        client = make_client(connection)
+        read = asyncio.create_task(client.get('a'))
+        await asyncio.sleep(0)
+        client.cache_put('a', 'new')
+        connection.release.set()
+        return await read, client.local_cache.get('a')
+
+    assert asyncio.run(run()) == ('old', 'new')
+
+
+class ScanningConnection:
+    def __init__(self, keys):
+        self.keys = set(keys)
+
+    async def scan_iter(self, match=None, count=None):
+        prefix = match.rstrip('*')
+        for key in sorted(self.keys):
+            if key.startswith(prefix):
+                yield key
+
+    async def unlink(self, *keys):
+        self.keys.difference_update(keys)
+        return len(keys)
+
+
+def test_delete_matching_keeps_excluded_keys():
+    async def run():
+        connection = ScanningConnection(['group_data:1', 'group_data:2', 'group_data:warm_up', 'other'])
+        client = make_client(connection)
+        removed = await client.delete_matching('group_data:*', exclude=('group_data:warm_up',), chunk_size=1)
+        return removed, connection.keys
+
+    assert asyncio.run(run()) == (2, {'group_data:warm_up', 'other'})
@@ -0,0 +1,143 @@
+import asyncio
+import collections
+import json
+from types import SimpleNamespace
+
+import rule_chain
+from rule_chain import RuleChain
+
+
+class CountingMQTTClient:
+    """
+    Fake MQTT client counting the publishes per topic.
+    """
+
+    def __init__(self):
+        self.published = collections.Counter()
+        self.payloads = collections.defaultdict(list)
+
+    async def publish_message(self, topic, message, qos=0, retain=False, ordered=False):
+        self.published[topic] += 1
+        self.payloads[topic].append(message)
+        future = asyncio.get_running_loop().create_future()
+        future.set_result(True)
+        return future
+
+
+def mqtt_message(topic, payload):
+    return SimpleNamespace(topic=SimpleNamespace(value=topic), payload=payload)
+
+
+def chain(chain_id, topic_filter, targets, steps=()):
+    return {
+        'id': chain_id,
+        'sources': [{'client_id': 'source', 'client_type': 'mqtt', 'topic': topic_filter}],
+        'processing_steps': list(steps),
+        'targets': [{'client_id': 'sink', 'client_type': 'mqtt', 'topic': topic} for topic in targets],
+    }
+
+
+def run(chains, messages):
+    sink = CountingMQTTClient()
+    processing_chain = RuleChain(chains, mqtt_clients={'sink': sink})
+
+    async def main():
+        for topic, payload in messages:
+            await processing_chain.handle_incoming_message(mqtt_message(topic, payload), 'source')
+
+    asyncio.run(main())
+    return sink
+
+
+def test_each_target_is_published_once_per_message_with_overlapping_filters():
+    chains = [
+        chain('exact', 'plant/line1/temp', ['out/exact']),
+        chain('single_level', 'plant/+/temp', ['out/single', 'out/shared']),
+        chain('multi_level', 'plant/#', ['out/multi', 'out/shared']),
+        chain('other', 'other/#', ['out/other']),
+    ]
+    sink = run(chains, [('plant/line1/temp', b'{"value": 1}'), ('plant/line2/temp', b'{"value": 2}'),
+                        ('plant/line1/pressure', b'{"value": 3}')])
+
+    assert sink.published == {
+        'out/exact': 1,
+        'out/single': 2,
+        'out/multi': 3,
+        # Zwei Ketten mit demselben Ziel-Topic veröffentlichen jeweils ihre eigene Ausgabe
+        'out/shared': 5,
+    }
+
+
+def test_each_chain_publishes_its_own_output():
+    chains = [
+        chain('first', 'a/#', ['out/first'], [{'type': 'map', 'fields': {'chain': {'value': 'first'}}}]),
+        chain('second', 'a/#', ['out/second'], [{'type': 'map', 'fields': {'chain': {'value': 'second'}}}]),
+    ]
+    sink = run(chains, [('a/b', b'{"value": 1}')])
+
+    assert sink.published == {'out/first': 1, 'out/second': 1}
+    assert b'"first"' in sink.payloads['out/first'][0]
+    assert b'"second"' in sink.payloads['out/second'][0]
+
+
+def test_payload_is_encoded_once_per_chain_and_encoding(monkeypatch):
+    encode_calls = collections.Counter()
+    encoder = rule_chain.PAYLOAD_ENCODERS['json']
+
+    def counting_encoder(message):
+        encode_calls['json'] += 1
+        return encoder(message)
+
+    monkeypatch.setitem(rule_chain.PAYLOAD_ENCODERS, 'json', counting_encoder)
+    steps = [{'type': 'map', 'fields': {'value': 'value'}}]
+    chains = [chain('fan_out', 'a/#', ['out/1', 'out/2', 'out/3'], steps)]
+    sink = run(chains, [('a/b', b'{"value": 1}'), ('a/c', b'{"value": 2}')])
+
+    assert sink.published == {'out/1': 2, 'out/2': 2, 'out/3': 2}
+    assert encode_calls['json'] == 2
+    assert sink.payloads['out/1'][0] is sink.payloads['out/2'][0] is sink.payloads['out/3'][0]
+
+
+def test_chains_receive_their_own_copy_and_errors_stay_in_their_chain(tmp_path, monkeypatch):
+    script = tmp_path / 'mark.py'
+    script.write_text(
+        "def process_message(input_message, clients):\n"
+        "    input_message['marks'] = input_message.get('marks', 0) + 1\n"
+        "    return input_message\n")
+    step = {'type': 'python_script', 'script_path': 'mark.py'}
+    chains = [
+        dict(chain('failing', 'a/#', ['out/failing']), order_group='group'),
+        dict(chain('grouped', 'a/#', ['out/grouped'], [step]), order_group='group'),
+        chain('separate', 'a/#', ['out/separate'], [step]),
+    ]
+    sink = CountingMQTTClient()
+    processing_chain = RuleChain(chains, mqtt_clients={'sink': sink})
+    monkeypatch.setattr(processing_chain.script_registry, 'base_dir', str(tmp_path))
+    run_chain_steps = processing_chain.run_chain_steps
+
+    async def failing_steps(chain_config, message):
+        if chain_config['id'] == 'failing':
+            raise RuntimeError('broken chain')
+        return await run_chain_steps(chain_config, message)
+
+    monkeypatch.setattr(processing_chain, 'run_chain_steps', failing_steps)
+
+    async def main():
+        return await processing_chain.handle_incoming_message(mqtt_message('a/b', b'{"value": 1}'), 'source')
+
+    asyncio.run(main())
+
+    assert sink.published == {'out/grouped': 1, 'out/separate': 1}
+    assert b'"marks":1' in sink.payloads['out/grouped'][0].replace(b' ', b'')
+    assert b'"marks":1' in sink.payloads['out/separate'][0].replace(b' ', b'')
+
+
+def test_explode_without_target_is_published_as_one_array():
+    chains = [chain('explode', 'a/#', ['out/items'], [{'type': 'explode', 'path': 'data.items'}])]
+    sink = run(chains, [('a/b', b'{"items": [1, 2]}')])
+
+    assert sink.published == {'out/items': 1}
+    assert json.loads(sink.payloads['out/items'][0]) == [
+        {'topic': 'a/b', 'data': {'items': 1}},
+        {'topic': 'a/b', 'data': {'items': 2}},
+    ]
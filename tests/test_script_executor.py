@@ -0,0 +1,128 @@
+import asyncio
+import threading
+
+from rule_chain import RuleChain
+from script_executor import ThreadScriptExecutor, _worker, create_worker_clients, initialize_worker
+
+
+class LoopBoundClient:
+    """
+    Stands in for the Redis and DB clients, whose methods only work on the thread of the event loop.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.loop_thread = threading.get_ident()
+
+    def set(self, key, value):
+        assert threading.get_ident() == self.loop_thread
+        # Wie RedisClient.set: Schreibvorgang als Task im Hintergrund
+        return asyncio.ensure_future(self.write(key, value))
+
+    async def write(self, key, value):
+        self.values[key] = value
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def rows(self):
+        for row in (1, 2, 3):
+            yield row
+
+    def execute_query(self):
+        return self.rows()
+
+
+def process_message(message, clients):
+    client = clients['client']
+    client.set('key', message['value'])
+    return {'value': client.get('key'), 'rows': client.execute_query(),
+            'thread': threading.get_ident()}
+
+
+def test_thread_executor_runs_client_calls_on_the_loop():
+    async def run():
+        client = LoopBoundClient()
+        executor = ThreadScriptExecutor('test.py', workers=1)
+        try:
+            return client, await executor.execute(process_message, {'value': 42}, {'client': client})
+        finally:
+            await executor.close()
+
+    client, result = asyncio.run(run())
+
+    assert result['value'] == 42
+    assert result['rows'] == [1, 2, 3]
+    assert result['thread'] != client.loop_thread
+
+
+def run_initialize_worker(tmp_path, source):
+    (tmp_path / 'worker_script.py').write_text(source)
+    initialize_worker(str(tmp_path), 'worker_script.py', [], {}, 5)
+    try:
+        return _worker['entry'].module.calls
+    finally:
+        _worker.pop('loop').close()
+        asyncio.set_event_loop(None)
+
+
+def test_process_workers_run_worker_initialize_instead_of_initialize(tmp_path):
+    calls = run_initialize_worker(tmp_path,
+                                  "calls = []\n"
+                                  "def initialize(clients):\n"
+                                  "    calls.append('initialize')\n"
+                                  "def worker_initialize(clients):\n"
+                                  "    calls.append('worker_initialize')\n")
+
+    assert calls == ['worker_initialize']
+
+
+def test_process_workers_run_initialize_without_worker_initialize(tmp_path):
+    calls = run_initialize_worker(tmp_path,
+                                  "calls = []\n"
+                                  "def initialize(clients):\n"
+                                  "    calls.append('initialize')\n")
+
+    assert calls == ['initialize']
+
+
+def test_worker_redis_clients_have_no_local_cache():
+    config = {'id': 'redis1', 'host': 'localhost', 'port': 6379, 'db': 0, 'local_cache_size': 100,
+              'invalidation_listener': True}
+
+    async def run():
+        clients = await create_worker_clients(['redis1'], {'redis1': ('redis', config)})
+        client = clients['redis1']
+        client.check_task.cancel()
+        await client.close()
+        return client
+
+    client = asyncio.run(run())
+
+    assert client.local_cache is None and client.listener_task is None
+
+
+def test_thread_executor_runs_batches_in_the_pool(tmp_path, monkeypatch):
+    script = tmp_path / 'batch_script.py'
+    script.write_text(
+        "import threading\n"
+        "def process_batch(messages, clients):\n"
+        "    return [dict(message, thread=threading.get_ident()) for message in messages]\n")
+    step = {'type': 'python_script', 'script_path': 'batch_script.py', 'executor': 'thread', 'workers': 1,
+            'batch': {'max_size': 2, 'max_wait_ms': 50}}
+    processing_chain = RuleChain([])
+    monkeypatch.setattr(processing_chain.script_registry, 'base_dir', str(tmp_path))
+
+    async def run():
+        try:
+            return await asyncio.gather(*(
+                processing_chain.execute_python_script('batch_script.py', {'value': value}, [], step=step,
+                                                       batch_key=('chain', 0))
+                for value in range(2)))
+        finally:
+            await processing_chain.shutdown()
+
+    results = asyncio.run(run())
+
+    assert [result['value'] for result in results] == [0, 1]
+    assert all(result['thread'] != threading.get_ident() for result in results)
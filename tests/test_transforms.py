@@ -0,0 +1,35 @@
+import copy
+
+from transforms import ExplodeTransform, MapTransform
+
+
+def test_map_steps_do_not_modify_the_shared_input_message():
+    message = {'topic': 'a/b', 'data': {'x': 1, 'nested': {'z': 0}}}
+    original = copy.deepcopy(message)
+    first = MapTransform({'type': 'map', 'fields': {'data.y': {'value': 2}}})
+    second = MapTransform({'type': 'map', 'fields': {'data.nested.z': {'value': 3}}})
+
+    first_output = first(message)
+    second_output = second(message)
+
+    assert message == original
+    assert first_output['data'] == {'x': 1, 'y': 2, 'nested': {'z': 0}}
+    assert second_output['data'] == {'x': 1, 'nested': {'z': 3}}
+
+
+def test_explode_copies_the_nested_path_of_every_element():
+    message = {'data': {'items': [1, 2], 'id': 7}}
+    original = copy.deepcopy(message)
+
+    outputs = ExplodeTransform({'type': 'explode', 'path': 'data.items'})(message)
+
+    assert message == original
+    assert outputs == [{'data': {'items': 1, 'id': 7}}, {'data': {'items': 2, 'id': 7}}]
+
+
+def test_bool_conversion_parses_string_literals():
+    step = MapTransform({'type': 'map', 'keep': False, 'fields': {
+        'flag': {'path': 'value', 'convert': 'bool', 'default': None}}})
+
+    assert [step({'value': value})['flag'] for value in ('false', '0', 'no', 'True', 'yes', 1, 0.0, 'maybe')] == [
+        False, False, False, True, True, True, False, None]
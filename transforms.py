@@ -0,0 +1,441 @@
+import asyncio
+import copy
+import time
+from collections.abc import Mapping
+
+from helpers import codec
+from helpers.custom_logging_helper import logger
+from record_batch import ColumnBatch
+
+# Ergebnis eines Filters, wenn die Nachricht nicht weitergegeben wird
+DROP = object()
+_MISSING = object()
+
+FILTER_OPERATORS = {
+    'eq': lambda value, expected: value == expected,
+    'ne': lambda value, expected: value != expected,
+    'gt': lambda value, expected: value is not None and value > expected,
+    'ge': lambda value, expected: value is not None and value >= expected,
+    'lt': lambda value, expected: value is not None and value < expected,
+    'le': lambda value, expected: value is not None and value <= expected,
+    'in': lambda value, expected: value in expected,
+    'not_in': lambda value, expected: value not in expected,
+    'not_null': lambda value, expected: value is not None,
+    'is_null': lambda value, expected: value is None,
+}
+
+BOOLEAN_STRINGS = {
+    'true': True, '1': True, 'yes': True, 'y': True, 'on': True, 't': True,
+    'false': False, '0': False, 'no': False, 'n': False, 'off': False, 'f': False, '': False,
+}
+
+
+def to_bool(value):
+    """
+    Converts booleans, numbers and the usual string literals ('true', 'no', '0', ...). Raises ValueError for
+    other strings, so the 'default' of the field applies.
+    """
+    if isinstance(value, str):
+        try:
+            return BOOLEAN_STRINGS[value.strip().lower()]
+        except KeyError:
+            raise ValueError(f"Cannot convert '{value}' to bool") from None
+    if isinstance(value, (bool, int, float)):
+        return bool(value)
+    raise ValueError(f"Cannot convert {type(value).__name__} to bool")
+
+
+CONVERTERS = {
+    'int': int,
+    'float': float,
+    'str': str,
+    'bool': to_bool,
+    'json': codec.loads,
+}
+
+
+def compile_getter(path):
+    """
+    Compiles a dotted path ('data.product_id') into a function returning the value or _MISSING.
+    """
+    parts = path.split('.')
+    if len(parts) == 1:
+        key = parts[0]
+        return lambda obj: obj.get(key, _MISSING) if isinstance(obj, Mapping) else _MISSING
+
+    def get(obj):
+        for part in parts:
+            if not isinstance(obj, Mapping):
+                return _MISSING
+            obj = obj.get(part, _MISSING)
+            if obj is _MISSING:
+                return _MISSING
+        return obj
+    return get
+
+
+def set_path(obj, parts, value):
+    """
+    Sets a value at a path. Nested dicts along the path are copied before writing (copy-on-write), as
+    they may be shared with the input message, which every matching chain receives unchanged.
+    """
+    for part in parts[:-1]:
+        child = obj.get(part)
+        child = dict(child) if isinstance(child, Mapping) else {}
+        obj[part] = child
+        obj = child
+    obj[parts[-1]] = value
+
+
+def to_dict(message):
+    """
+    Returns a shallow mutable copy of a message, decoding JSON strings and message envelopes.
+    Nested values are shared with the message, write them with set_path only.
+    """
+    if isinstance(message, (str, bytes, bytearray, memoryview)):
+        return codec.loads(message)
+    if hasattr(message, 'to_dict'):
+        return message.to_dict()
+    return dict(message)
+
+
+class Transform:
+    """
+    Declarative processing step compiled once at startup.
+
+    Single messages are passed to 'apply', lists of rows (batches) to 'apply_rows' and column batches
+    to 'apply_columns', which transforms whole columns where possible.
+    """
+
+    def __init__(self, step):
+        self.step = step
+        self.type = step['type']
+
+    def __call__(self, message):
+        if isinstance(message, ColumnBatch):
+            batch = self.apply_columns(message)
+            return batch if batch.row_count else DROP
+        if isinstance(message, list):
+            # Leere Batches werden nicht weitergegeben
+            return self.apply_rows(message) or DROP
+        if isinstance(message, (str, bytes, bytearray, memoryview)):
+            message = codec.loads(message)
+        return self.apply(message)
+
+    def apply(self, message):
+        raise NotImplementedError
+
+    def apply_rows(self, rows):
+        results = []
+        for row in rows:
+            result = self.apply(row)
+            if result is DROP:
+                continue
+            if isinstance(result, list):
+                results.extend(result)
+            else:
+                results.append(result)
+        return results
+
+    def apply_columns(self, batch):
+        return ColumnBatch.from_rows(self.apply_rows(batch.rows()))
+
+    async def start(self, db_clients):
+        """
+        Loads the data a transform depends on.
+        """
+
+
+class MapTransform(Transform):
+    """
+    Sets fields from other fields or constants:
+
+        {"type": "map", "fields": {"object_id": "product_id", "source": {"value": "odt"},
+                                   "count": {"path": "data.count", "convert": "int", "default": 0}}}
+
+    With "keep": false the output only contains the mapped fields.
+    """
+
+    def __init__(self, step):
+        super().__init__(step)
+        self.keep = step.get('keep', True)
+        self.fields = []
+        for target, source in step['fields'].items():
+            if isinstance(source, str):
+                source = {'path': source}
+            self.fields.append((target, target.split('.'), self.compile_source(source)))
+
+    @staticmethod
+    def compile_source(source):
+        if 'value' in source:
+            value = source['value']
+            return lambda message: value
+        getter = compile_getter(source['path'])
+        default = source.get('default')
+        converter = CONVERTERS[source['convert']] if source.get('convert') else None
+
+        def get(message):
+            value = getter(message)
+            if value is _MISSING or value is None:
+                return default
+            if converter is not None:
+                try:
+                    return converter(value)
+                except (TypeError, ValueError):
+                    return default
+            return value
+        return get
+
+    def apply(self, message):
+        output = to_dict(message) if self.keep else {}
+        for _, parts, get in self.fields:
+            set_path(output, parts, get(message))
+        return output
+
+    def apply_columns(self, batch):
+        if any(len(parts) > 1 for _, parts, _ in self.fields):
+            return super().apply_columns(batch)
+        rows = batch.rows()
+        output = ColumnBatch(batch) if self.keep else ColumnBatch()
+        for target, _, get in self.fields:
+            output[target] = [get(row) for row in rows]
+        return output
+
+
+class FilterTransform(Transform):
+    """
+    Passes on only messages matching the conditions, others end the chain run:
+
+        {"type": "filter", "conditions": [{"path": "data.group_id", "op": "not_null"}], "match": "all"}
+
+    Batches keep the matching rows.
+    """
+
+    def __init__(self, step):
+        super().__init__(step)
+        self.conditions = []
+        for condition in step['conditions']:
+            operator = FILTER_OPERATORS.get(condition.get('op', 'eq'))
+            if operator is None:
+                raise ValueError(f"Unknown filter operator '{condition.get('op')}'")
+            self.conditions.append((compile_getter(condition['path']), operator, condition.get('value')))
+        self.match_all = step.get('match', 'all') == 'all'
+
+    def matches(self, message):
+        results = (self.test(get, operator, expected, message) for get, operator, expected in self.conditions)
+        return all(results) if self.match_all else any(results)
+
+    @staticmethod
+    def test(get, operator, expected, message):
+        value = get(message)
+        if value is _MISSING:
+            value = None
+        try:
+            return operator(value, expected)
+        except TypeError:
+            return False
+
+    def apply(self, message):
+        return message if self.matches(message) else DROP
+
+    def apply_rows(self, rows):
+        return [row for row in rows if self.matches(row)]
+
+    def apply_columns(self, batch):
+        mask = [self.matches(row) for row in batch.rows()]
+        return ColumnBatch({column: [value for value, keep in zip(values, mask) if keep]
+                            for column, values in batch.items()})
+
+
+class ProjectTransform(Transform):
+    """
+    Keeps only the listed fields: {"type": "project", "fields": ["product_id", "data.value"]}
+    """
+
+    def __init__(self, step):
+        super().__init__(step)
+        self.fields = [(path.split('.'), compile_getter(path)) for path in step['fields']]
+
+    def apply(self, message):
+        output = {}
+        for parts, get in self.fields:
+            value = get(message)
+            if value is not _MISSING:
+                set_path(output, parts, value)
+        return output
+
+    def apply_columns(self, batch):
+        if any(len(parts) > 1 for parts, _ in self.fields):
+            return super().apply_columns(batch)
+        return ColumnBatch({parts[0]: batch[parts[0]] for parts, _ in self.fields if parts[0] in batch})
+
+
+class RenameTransform(Transform):
+    """
+    Renames top level fields: {"type": "rename", "fields": {"product_id": "object_id"}}
+    """
+
+    def __init__(self, step):
+        super().__init__(step)
+        self.fields = dict(step['fields'])
+
+    def apply(self, message):
+        fields = self.fields
+        return {fields.get(key, key): value for key, value in to_dict(message).items()}
+
+    def apply_columns(self, batch):
+        fields = self.fields
+        return ColumnBatch({fields.get(column, column): values for column, values in batch.items()})
+
+
+class ExplodeTransform(Transform):
+    """
+    Splits a list field. Without "target" the step returns a batch (list) with one message per element,
+    the element at the place of the list; following steps process the batch row by row, postgres targets
+    insert one record per element and MQTT targets publish the batch as one JSON array. With "target"
+    the converted list is written to that field instead.
+    Dictionaries can be turned into key/value pairs, e.g. the product data items:
+
+        {"type": "explode", "path": "data", "target": "overwrittenvalues",
+         "pairs": {"key": "group_id", "value": "val"}}
+    """
+
+    def __init__(self, step):
+        super().__init__(step)
+        self.path = step['path']
+        self.parts = self.path.split('.')
+        self.get = compile_getter(self.path)
+        self.target = step['target'].split('.') if step.get('target') else None
+        pairs = step.get('pairs')
+        self.pair_names = (pairs.get('key', 'key'), pairs.get('value', 'value')) if pairs else None
+
+    def elements(self, value):
+        if value is _MISSING or value is None:
+            return []
+        items = value if isinstance(value, list) else [value]
+        if self.pair_names is None:
+            return items
+        key_name, value_name = self.pair_names
+        elements = []
+        for item in items:
+            if isinstance(item, Mapping):
+                elements.extend({key_name: key, value_name: val} for key, val in item.items())
+            else:
+                logger.error(f"Unexpected item format in {self.path}: {item}")
+        return elements
+
+    def apply(self, message):
+        elements = self.elements(self.get(message))
+        if self.target is not None:
+            output = to_dict(message)
+            set_path(output, self.target, elements)
+            return output
+        base = to_dict(message)
+        outputs = []
+        for element in elements:
+            output = copy.copy(base)
+            set_path(output, self.parts, element)
+            outputs.append(output)
+        return outputs
+
+
+class LookupTransform(Transform):
+    """
+    Enriches messages from a table cached in memory and refreshed periodically:
+
+        {"type": "lookup", "client_id": "db1", "query": "SELECT entity_object_id, group_id FROM ...",
+         "key_column": "entity_object_id", "value_column": "group_id", "key": "data.id",
+         "target": "group_id", "default": null, "refresh_interval": 60}
+
+    Without "value_column" the whole row is written to the target field.
+    """
+
+    def __init__(self, step):
+        super().__init__(step)
+        self.client_id = step['client_id']
+        self.query = step['query']
+        self.key_column = step['key_column']
+        self.value_column = step.get('value_column')
+        self.get_key = compile_getter(step['key'])
+        self.target = step['target'].split('.')
+        self.default = step.get('default')
+        self.refresh_interval = step.get('refresh_interval', 60)
+        self.table = {}
+        self.loaded_at = None
+        self.db_client = None
+        self.refresh_task = None
+
+    async def start(self, db_clients):
+        self.db_client = db_clients.get(self.client_id)
+        if self.db_client is None:
+            logger.error(f"DB client {self.client_id} of lookup step not found.")
+            return
+        await self.refresh()
+
+    async def refresh(self):
+        try:
+            rows = await self.db_client.fetch_all(self.query)
+        except Exception as e:
+            logger.error(f"Refreshing lookup table of {self.client_id} failed: {e}")
+            self.loaded_at = time.monotonic()
+            return
+        if self.value_column:
+            self.table = {row[self.key_column]: row[self.value_column] for row in rows}
+        else:
+            self.table = {row[self.key_column]: row for row in rows}
+        self.loaded_at = time.monotonic()
+        logger.info(f"Lookup table of {self.client_id} loaded with {len(self.table)} entries.")
+
+    def refresh_if_stale(self):
+        if self.db_client is None or self.refresh_interval is None or self.loaded_at is None:
+            return
+        if self.refresh_task is not None and not self.refresh_task.done():
+            return
+        if time.monotonic() - self.loaded_at >= self.refresh_interval:
+            # Im Hintergrund aktualisieren, bis dahin gilt die bisherige Tabelle
+            self.refresh_task = asyncio.create_task(self.refresh())
+
+    def __call__(self, message):
+        self.refresh_if_stale()
+        return super().__call__(message)
+
+    def apply(self, message):
+        output = to_dict(message)
+        key = self.get_key(message)
+        set_path(output, self.target, self.table.get(key, self.default) if key is not _MISSING else self.default)
+        return output
+
+    def apply_columns(self, batch):
+        if len(self.target) > 1:
+            return super().apply_columns(batch)
+        rows = batch.rows()
+        output = ColumnBatch(batch)
+        table, default = self.table, self.default
+        output[self.target[0]] = [table.get(key, default) if key is not _MISSING else default
+                                  for key in map(self.get_key, rows)]
+        return output
+
+
+TRANSFORMS = {
+    'map': MapTransform,
+    'filter': FilterTransform,
+    'project': ProjectTransform,
+    'rename': RenameTransform,
+    'explode': ExplodeTransform,
+    'lookup': LookupTransform,
+}
+
+
+def compile_transforms(chains_config):
+    """
+    Compiles the declarative steps of all chains, keyed by (chain ID, step index).
+    """
+    transforms = {}
+    for chain in chains_config:
+        for index, step in enumerate(chain.get('processing_steps', [])):
+            if step['type'] in TRANSFORMS:
+                try:
+                    transforms[(chain['id'], index)] = TRANSFORMS[step['type']](step)
+                except (KeyError, ValueError) as e:
+                    logger.error(f"Invalid {step['type']} step {index} in chain {chain['id']}: {e}")
+    return transforms